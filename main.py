@@ -1,34 +1,128 @@
+import argparse
+
 from src.boolean_query_processor import BooleanQueryProcessor
 from src.query_processor import QueryProcessor
+from src.query_parser import QueryError
+from src.server import QueryServer
+from src.batch_runner import run_batch
+from src.benchmark import run_benchmark, default_tolerance
+import src.instrumentation as instrumentation
 
-def run_boolean_query_processor():
+def run_boolean_query_processor(correct_spelling=False):
     
     # Create query processor object
-    bqp = BooleanQueryProcessor()
+    bqp = BooleanQueryProcessor(correct_spelling=correct_spelling)
 
     while True:
         # Take an input from user
         query = input("Please write a query. ('q' for exit): ")
 
         if query != 'q':
-            print("The result: ", bqp.process(query))
+            try:
+                result = bqp.process(query)
+                print("The result: ", result)
+                if not result:
+                    print_suggestions(bqp, query)
+            except QueryError as e:
+                print(e)
         else:
             break
 
-def run_query_processor():
+def run_query_processor(correct_spelling=False):
     # Create query processor object
-    qp = QueryProcessor()
+    qp = QueryProcessor(correct_spelling=correct_spelling)
 
     while True:
         # Take an input from user
         query = input("Please write a query. ('q' for exit): ")
 
         if query != 'q':
-            print("The result: ", qp.process(query))
+            try:
+                result = qp.process(query)
+                print("The result: ", result)
+                if not result:
+                    print_suggestions(qp, query)
+            except QueryError as e:
+                print(e)
         else:
             break
 
+def print_suggestions(processor, query):
+    """
+    Print the spelling suggestions of the query words that are not in the index
+    """
+    for word, suggestions in processor.suggest(query).items():
+        if suggestions:
+            print(f"Did you mean {' / '.join(term for term, _, _ in suggestions)} instead of {word}?")
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description="Simple search system")
+    parser.add_argument("--metrics", help="enable the instrumentation and write the metrics to this file at exit "
+                                          "(Prometheus text for .prom/.txt, JSON otherwise)")
+    parser.add_argument("--profile", type=float, default=0.0, help="fraction of the queries profiled with cProfile")
+    parser.add_argument("--slow-ms", type=float, help="keep the traces of the queries slower than this")
+    parser.add_argument("--correct-spelling", action="store_true",
+                        help="replace the query words that are not in the index with their nearest term")
+    commands = parser.add_subparsers(dest="command")
+
+    commands.add_parser("ranked", help="interactive ranked (free text, phrase, proximity) queries (default)")
+    commands.add_parser("boolean", help="interactive boolean queries")
+
+    serve = commands.add_parser("serve", help="JSON query server over HTTP")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8080)
+    serve.add_argument("--unix", help="unix socket path instead of TCP")
+    serve.add_argument("--workers", type=int, help="number of worker processes (cpu count by default)")
+    serve.add_argument("--max-pending", type=int, default=64, help="max number of running and waiting queries")
+    serve.add_argument("--deadline", type=float, default=10.0, help="default deadline of a query in seconds")
+
+    batch = commands.add_parser("batch", help="run the queries of a JSONL file and write JSONL results")
+    batch.add_argument("input", nargs="?", default="-", help="JSONL query file (stdin by default)")
+    batch.add_argument("--output", "-o", default="-", help="JSONL result file (stdout by default)")
+    batch.add_argument("--workers", type=int, default=1, help="number of worker processes")
+    batch.add_argument("--mode", choices=("boolean", "ranked"), default="ranked", help="mode of the lines without a mode")
+    batch.add_argument("--top-k", type=int, help="top_k of the ranked lines without a top_k")
+    batch.add_argument("--trace", action="store_true", help="add the span tree of each query to its result")
+
+    bench = commands.add_parser("bench", help="benchmark with a synthetic corpus")
+    bench.add_argument("--docs", type=int, default=10000, help="number of synthetic documents")
+    bench.add_argument("--vocabulary", type=int, default=50000, help="number of distinct words")
+    bench.add_argument("--zipf", type=float, default=1.0, help="exponent of the Zipf distribution of the words")
+    bench.add_argument("--seed", type=int, default=7)
+    bench.add_argument("--queries", type=int, default=100, help="number of queries of each workload")
+    bench.add_argument("--repeat", type=int, default=3, help="number of measured runs of each workload")
+    bench.add_argument("--workers", type=int, default=1, help="number of processes of the index builds")
+    bench.add_argument("--directory", default="bench", help="folder of the corpus and the index files")
+    bench.add_argument("--regenerate", action="store_true", help="write the corpus again if it exists")
+    bench.add_argument("--output", default="bench/results.json", help="JSON result file")
+    bench.add_argument("--baseline", help="JSON result file of a baseline run to compare with")
+    bench.add_argument("--tolerance", type=float, default=default_tolerance, help="allowed change before a regression")
+
+    return parser.parse_args(args)
+
 if __name__ == "__main__":
-    
-    #run_boolean_query_processor
-    run_query_processor()
\ No newline at end of file
+    args = parse_args()
+    if args.metrics or args.profile or args.slow_ms is not None:
+        instrumentation.enable(profile=args.profile, slow_ms=args.slow_ms)
+
+    try:
+        if args.command == "serve":
+            QueryServer(args.host, args.port, args.unix, args.workers, args.max_pending, args.deadline,
+                        correct_spelling=args.correct_spelling).run()
+        elif args.command == "batch":
+            run_batch(args.input, args.output, args.workers, args.mode, args.top_k,
+                      args.trace or args.profile > 0, args.profile, args.correct_spelling)
+        elif args.command == "bench":
+            regressions = run_benchmark(args.output, args.baseline, args.tolerance, docs=args.docs,
+                                        vocabulary_size=args.vocabulary, zipf_exponent=args.zipf, seed=args.seed,
+                                        queries=args.queries, repeat=args.repeat, workers=args.workers, directory=args.directory,
+                                        regenerate=args.regenerate)
+            if regressions:
+                raise SystemExit(1)
+        elif args.command == "boolean":
+            run_boolean_query_processor(args.correct_spelling)
+        else:
+            run_query_processor(args.correct_spelling)
+    finally:
+        if args.metrics:
+            instrumentation.export(args.metrics)
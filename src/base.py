@@ -10,6 +10,7 @@ import string
 from abc import abstractmethod
 from typing import List
 
+from src.postings import CompressedPosting
 
 """
 Here are some global variables
@@ -52,6 +53,8 @@ class BaseTextProcessor():
     def __init__(self) -> None:
         self.data = BaseDataAccess()
         self._text = None
+        self._stopwords = None
+        self._stopword_pattern = None
     
     def tokenize(self, text=None) -> List[str]:
         """
@@ -62,25 +65,32 @@ class BaseTextProcessor():
         else:
             return self._text.split()
     
-    def punctuation_remove(self):
+    def punctuation_remove(self, keep=""):
         """
         Punctuation remove operation with using string maketrans
 
+        - keep -> punctuation characters that are not removed (e.g. "*" of the wildcard queries)
+
         Info: 
         - maketrans creates a mapping table.
         - In this example it will map the characters in third arg with None
         - src: https://docs.python.org/3.3/library/stdtypes.html?highlight=maketrans#str.maketrans
         """
         to_remove = string.punctuation + "\n"
+        if keep:
+            to_remove = "".join(char for char in to_remove if char not in keep)
         mapper = str.maketrans('', '', to_remove)
         self._text = self._text.translate(mapper)
 
     @property
     def stopwords(self) -> List:
         """
-        Property for read and split stopwords
+        Property for read and split stopwords.
+        The file is read only once, then the list is kept in self._stopwords
         """
-        return self.data.read(stopword_path).split() if stopword_path else None
+        if self._stopwords is None and stopword_path:
+            self._stopwords = self.data.read(stopword_path).split()
+        return self._stopwords
 
     def stopword_remove(self, text = None) -> List:
         """
@@ -89,11 +99,13 @@ class BaseTextProcessor():
         Returns a text that does not include stopwords
         If the given text is None, then the function will use the class variable _text
         """
-        remove_pattern = re.compile(r'\b(' + r'|'.join(self.stopwords) + r')\b\s*')
+        # Compile the pattern once and reuse it for every call
+        if self._stopword_pattern is None:
+            self._stopword_pattern = re.compile(r'\b(' + r'|'.join(self.stopwords) + r')\b\s*')
         if not text:
-            return remove_pattern.sub('', self._text)
+            return self._stopword_pattern.sub('', self._text)
         else:
-            return remove_pattern.sub('', text)
+            return self._stopword_pattern.sub('', text)
 
     def case_folding(self):
         """
@@ -117,7 +129,7 @@ class BaseInvertedIndex:
     For map keys represent the tokens(words) and values represent the 
     posting lists that keep document ids.
     keys: string
-    values: list of integer
+    values: list of integer (InvertedIndex keeps them as CompressedPosting)
 
     Key points:
     - Posting lists are sorted in ascending order.
@@ -172,6 +184,11 @@ class BaseInvertedIndex:
         """
         
         posting = self.dictionary.get(key)
+
+        # Compressed postings are immutable, so decode them to a list first
+        if isinstance(posting, CompressedPosting):
+            posting = posting.tolist()
+            self._update(key, posting)
         
         # Find the index that showing where this id should be added
         start = 0
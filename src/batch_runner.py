@@ -0,0 +1,260 @@
+"""
+Batch (offline) query runner, e.g. for nightly replays of query logs.
+
+Queries are read from a JSONL file (or stdin), one query per line:
+    {"query": "oil AND price", "mode": "boolean"}
+    {"id": 17, "query": "hate love cry", "mode": "ranked", "top_k": 10}
+    {"query": "oil OR price", "mode": "boolean", "top_k": 10, "offset": 20}
+    "hate love cry"                                 # JSON string, default mode
+A line that is not JSON is taken as the query text.
+
+The results are written as JSONL in the order of the input, while the next queries
+are still running:
+    {"line": 1, "query": ..., "mode": ..., "results": [...], "took_ms": ...}
+    {"line": 2, "query": ..., "mode": ..., "error": "...", "took_ms": ...}
+A query that fails (an invalid query or any other error) gets an error record, the
+other queries of the batch still run.
+With trace, every record also has the span tree of its query (see src.instrumentation).
+
+With workers > 1 the missing indexes are built once, then the queries run in a
+process pool and every worker loads the indexes once. At the end a summary (queries/sec, p50/p95/p99 latency) is printed.
+"""
+import sys
+import json
+import math
+import time
+from collections import deque
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor
+
+from src.query_worker import modes, prepare_indexes, load_processors, run_query
+import src.instrumentation as instrumentation
+
+"""
+Here are some global variables
+"""
+percentiles = (50, 95, 99)
+# Number of queries sent to a worker at once
+chunk_size = 64
+
+class BatchRunner:
+    """
+    Run the queries of a JSONL stream and write the results as JSONL.
+
+    Usage:
+        with open("queries.jsonl") as queries, open("results.jsonl", "w") as output:
+            summary = BatchRunner(workers=4).run(queries, output)
+    """
+
+    def __init__(self, workers=1, mode="ranked", top_k=None, trace=False, profile=0.0, correct_spelling=False) -> None:
+        """
+        - workers -> number of worker processes, 1 runs the queries in this process
+        - mode -> mode of the lines without "mode" ("boolean" or "ranked")
+        - top_k -> top_k of the ranked lines without "top_k"
+        - trace -> add the span tree of each query to its record
+        - profile -> fraction of the traced queries that are profiled with cProfile
+        - correct_spelling -> spelling correct the unknown query words (see src.spelling)
+        """
+        if mode not in modes:
+            raise ValueError(f"mode must be one of {list(modes)}")
+        self.workers = workers
+        self.mode = mode
+        self.top_k = top_k
+        self.trace = trace
+        self.profile = profile
+        self.correct_spelling = correct_spelling
+
+    def run(self, lines, output):
+        """
+        Run the queries of the lines and write a JSONL result of each line to output.
+        Returns the summary (see summarize).
+        """
+        start = time.perf_counter()
+        latencies = []
+        queries = errors = 0
+
+        for record in self.results(lines):
+            queries += 1
+            if "error" in record:
+                errors += 1
+            if "took_ms" in record:
+                latencies.append(record["took_ms"])
+            output.write(json.dumps(record) + "\n")
+        output.flush()
+
+        return summarize(latencies, queries, errors, time.perf_counter() - start)
+
+    def results(self, lines):
+        """
+        Result records of the lines, in the order of the lines
+        """
+        requests = (self._parse(number, line) for number, line in enumerate(lines, 1) if line.strip())
+
+        if self.workers <= 1:
+            if self.trace:
+                instrumentation.enable(profile=self.profile)
+            load_processors((self.mode,), self.correct_spelling)
+            for request in requests:
+                yield self._record(request, _run_chunk([request], self.trace)[0] if "error" not in request else None)
+            return
+
+        # A missing index is built here once, not by every worker. A line can have
+        # any mode, so the indexes of all the modes are prepared.
+        prepare_indexes(modes, self.correct_spelling)
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_load_worker,
+                                 initargs=((self.mode,), self.trace, self.profile, self.correct_spelling)) as executor:
+            # A few chunks per worker are running or waiting, so a long input is not read at once
+            pending = deque()
+            for chunk in _chunks(requests, chunk_size):
+                pending.append((chunk, executor.submit(_run_chunk, chunk, self.trace)))
+                if len(pending) >= 2 * self.workers:
+                    yield from self._records(*pending.popleft())
+            while pending:
+                yield from self._records(*pending.popleft())
+
+    def _records(self, chunk, future):
+        try:
+            answers = iter(future.result())
+        except Exception as e:
+            # The chunk did not come back (e.g. its worker died), all its queries are errors
+            answers = iter([(False, _error_message(e), 0.0)] * len(chunk))
+        for request in chunk:
+            yield self._record(request, next(answers) if "error" not in request else None)
+
+    def _record(self, request, answer):
+        if answer is None:
+            return request
+        ok, value, seconds = answer[:3]
+        record = dict(request)
+        record["results" if ok else "error"] = value
+        record["took_ms"] = seconds * 1000
+        if len(answer) > 3:
+            record["trace"] = answer[3]
+        return record
+
+    def _parse(self, number, line):
+        """
+        Request of a line: {"line", ["id"], "query", "mode", ["top_k"], ["offset"]} or {"line", "error"}
+        """
+        try:
+            request = json.loads(line)
+        except ValueError:
+            request = line.strip()
+        if isinstance(request, str):
+            request = {"query": request}
+        if not isinstance(request, dict):
+            return {"line": number, "error": "line must be a JSON object, a JSON string or a query"}
+
+        parsed = {"line": number}
+        if "id" in request:
+            parsed["id"] = request["id"]
+        parsed["query"] = request.get("query")
+        parsed["mode"] = request.get("mode", self.mode)
+        top_k = request.get("top_k", self.top_k)
+        offset = request.get("offset", 0)
+
+        if not isinstance(parsed["query"], str):
+            parsed["error"] = "query must be a string"
+        elif parsed["mode"] not in modes:
+            parsed["error"] = f"mode must be one of {list(modes)}"
+        elif top_k is not None and (not isinstance(top_k, int) or isinstance(top_k, bool) or top_k < 0):
+            parsed["error"] = "top_k must be a non-negative integer"
+        elif not isinstance(offset, int) or isinstance(offset, bool) or offset < 0:
+            parsed["error"] = "offset must be a non-negative integer"
+        else:
+            if top_k is not None and (parsed["mode"] == "ranked" or "top_k" in request):
+                parsed["top_k"] = top_k
+            if offset:
+                parsed["offset"] = offset
+        return parsed
+
+def summarize(latencies, queries=None, errors=0, seconds=0.0):
+    """
+    Summary of a batch: number of queries, errors, queries/sec and latency percentiles (ms)
+
+    - latencies -> run times of the queries in ms (invalid lines are not run)
+    - queries -> number of lines with a query, len(latencies) by default
+    """
+    latencies = sorted(latencies)
+    queries = len(latencies) if queries is None else queries
+    summary = {
+        "queries": queries,
+        "errors": errors,
+        "seconds": seconds,
+        "qps": queries / seconds if seconds > 0 else 0,
+    }
+    for p in percentiles:
+        summary[f"p{p}_ms"] = percentile(latencies, p)
+    return summary
+
+def percentile(values, p):
+    """
+    Nearest rank percentile of the sorted values (0 if there is no value)
+    """
+    if not values:
+        return 0
+    return values[max(math.ceil(p / 100 * len(values)) - 1, 0)]
+
+def run_batch(input_path=None, output_path=None, workers=1, mode="ranked", top_k=None, trace=False, profile=0.0,
+              correct_spelling=False):
+    """
+    Run the queries of a JSONL file (stdin if input_path is None or "-") and write the
+    results to output_path (stdout if None or "-"). The summary is printed to stderr
+    when the results go to stdout, so the output stays valid JSONL.
+    """
+    to_stdout = output_path in (None, "-")
+    output = sys.stdout if to_stdout else open(output_path, "w")
+    lines = sys.stdin if input_path in (None, "-") else open(input_path)
+    log = sys.stderr if to_stdout else sys.stdout
+
+    try:
+        # Messages of the index loading go to the log, not to the results
+        with redirect_stdout(log):
+            summary = BatchRunner(workers, mode, top_k, trace, profile, correct_spelling).run(lines, output)
+    finally:
+        if lines is not sys.stdin:
+            lines.close()
+        if output is not sys.stdout:
+            output.close()
+
+    print(f"[Done] {summary['queries']} queries ({summary['errors']} errors) in {summary['seconds']:0.4f} seconds, "
+          f"{summary['qps']:0.1f} queries/sec, "
+          + ", ".join(f"p{p} {summary[f'p{p}_ms']:0.2f} ms" for p in percentiles), file=log)
+    return summary
+
+def _load_worker(modes, trace=False, profile=0.0, correct_spelling=False):
+    # The stdout of a worker may be the result stream, so its messages go to stderr
+    sys.stdout = sys.stderr
+    if trace:
+        instrumentation.enable(profile=profile)
+    load_processors(modes, correct_spelling)
+
+def _run_chunk(requests, trace=False):
+    """
+    Worker function: (ok, results or error, seconds[, trace]) of each valid request.
+    An unexpected error of a query is its error answer, so it does not stop the chunk.
+    """
+    answers = []
+    for request in requests:
+        if "error" in request:
+            continue
+        start = time.perf_counter()
+        try:
+            answer = run_query(request["mode"], request["query"], request.get("top_k"), request.get("offset", 0))
+        except Exception as e:
+            answer = False, _error_message(e), time.perf_counter() - start
+        answers.append(answer + (instrumentation.last_trace(),) if trace else answer)
+    return answers
+
+def _error_message(e):
+    return f"{type(e).__name__}: {e}"
+
+def _chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
@@ -0,0 +1,315 @@
+"""
+Reproducible benchmark of the search system.
+
+It writes a synthetic corpus (src.corpus_generator), then measures:
+- parse -> parsing and preprocessing of the sgm files
+- build / save / load -> times of both indexes, their file sizes
+- peak RSS of the benchmark process and of its worker processes
+- fixed query workloads (boolean AND / OR / NOT, phrase, ranked, ranked top 10)
+  with queries/sec and p50/p95/p99 latencies
+
+The results are written as JSON. A result file can be compared with a baseline
+run of the same configuration, the metrics that got worse than the tolerance are
+reported as regressions.
+
+Usage:
+    python main.py bench --docs 10000 --output bench/results.json
+    python main.py bench --docs 10000 --baseline bench/baseline.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import platform
+
+from src.corpus_generator import CorpusGenerator
+from src.sgm_preprocessor import SGMPreprocessor
+from src.inverted_intex import InvertedIndex
+from src.positional_inverted_index import PositionalInvertedIndex
+from src.boolean_query_processor import BooleanQueryProcessor
+from src.query_processor import QueryProcessor
+from src.batch_runner import summarize
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+"""
+Here are some global variables
+"""
+result_version = 1
+default_tolerance = 0.10
+
+# Metrics that are better when they are higher, all other metrics are better when lower
+higher_is_better = ("qps", "docs_per_second")
+
+class Benchmark:
+    """
+    One benchmark run.
+
+    Usage:
+        results = Benchmark(docs=10000, directory="bench").run()
+    """
+
+    def __init__(self, docs=10000, vocabulary_size=50000, zipf_exponent=1.0, seed=7, queries=100, repeat=3,
+                 workers=1, directory="bench", regenerate=False) -> None:
+        """
+        - docs, vocabulary_size, zipf_exponent, seed -> corpus of the run (see CorpusGenerator)
+        - queries -> number of queries of each workload
+        - repeat -> number of measured runs of each workload (after one warm up run)
+        - workers -> number of processes of the index builds
+        - directory -> folder of the corpus and the index files
+        - regenerate -> write the corpus again even if it exists
+        """
+        self.config = {
+            "docs": docs,
+            "vocabulary_size": vocabulary_size,
+            "zipf_exponent": zipf_exponent,
+            "seed": seed,
+            "queries": queries,
+            "repeat": repeat,
+            "workers": workers,
+        }
+        self.directory = directory
+        self.corpus = os.path.join(directory, f"corpus_{docs}_{vocabulary_size}_{zipf_exponent}_{seed}")
+        self.regenerate = regenerate
+        self.generator = CorpusGenerator(docs, vocabulary_size, zipf_exponent, seed=seed)
+
+    def run(self):
+        """
+        Run all steps and return the results dict
+        """
+        results = {
+            "version": result_version,
+            "config": self.config,
+            "environment": {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+            },
+        }
+        results["corpus"] = self.write_corpus()
+        results["parse"] = self.measure_parse()
+
+        boolean_index, results["boolean_index"] = self.measure_index(InvertedIndex, "dictionary")
+        positional_index, results["positional_index"] = self.measure_index(PositionalInvertedIndex, "positional_dictionary")
+
+        results["workloads"] = self.run_workloads(boolean_index, positional_index)
+        results["peak_rss_bytes"] = peak_rss()
+        return results
+
+    def write_corpus(self):
+        start = time.perf_counter()
+        if self.regenerate or not os.path.isdir(self.corpus):
+            self.generator.write(self.corpus)
+        files = sorted(path for path in os.listdir(self.corpus) if path.endswith("sgm"))
+        return {
+            "files": len(files),
+            "bytes": sum(os.path.getsize(os.path.join(self.corpus, path)) for path in files),
+            "seconds": time.perf_counter() - start,
+        }
+
+    def measure_parse(self):
+        """
+        Parse and preprocess all documents of the corpus
+        """
+        start = time.perf_counter()
+        docs = sum(1 for _ in SGMPreprocessor(dataset=self.corpus).iter_documents())
+        seconds = time.perf_counter() - start
+        return {"docs": docs, "seconds": seconds, "docs_per_second": docs / seconds if seconds else 0}
+
+    def measure_index(self, index_class, name):
+        """
+        Build, save and load an index. Returns the loaded index and its metrics.
+        """
+        index = self._index(index_class, name)
+        start = time.perf_counter()
+        index.build(save=False)
+        build_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        index.save()
+        save_seconds = time.perf_counter() - start
+
+        paths = [index.index_path] + ([index.statistics_path] if hasattr(index, "statistics_path") else [])
+        sizes = {os.path.basename(path): os.path.getsize(path) for path in paths}
+
+        index = self._index(index_class, name)
+        start = time.perf_counter()
+        index.load()
+        if hasattr(index, "statistics"):
+            index.statistics()
+        load_seconds = time.perf_counter() - start
+
+        return index, {
+            "build_seconds": build_seconds,
+            "save_seconds": save_seconds,
+            "load_seconds": load_seconds,
+            "file_bytes": sizes,
+            "peak_rss_bytes": peak_rss(),
+        }
+
+    def workloads(self):
+        """
+        Fixed query sets, they only depend on the configuration: {name: (mode, [query, ...])}
+        """
+        rng = random.Random(self.config["seed"])
+        vocabulary = self.generator.vocabulary
+        count = self.config["queries"]
+
+        # Frequent, medium and rare words (the stopwords are skipped)
+        first = self.generator.stopword_count
+        head = vocabulary[first:first + 100] or vocabulary
+        torso = vocabulary[first + 100:first + 2000] or head
+        tail = vocabulary[first + 2000:] or torso
+
+        def pick(*groups):
+            return [rng.choice(group) for group in groups]
+
+        phrases = self._phrases(rng, count)
+        # The same broad OR queries are run with and without top_k, so the two can be compared
+        broad = [" ".join(pick(head, head, torso, torso, torso, torso, tail, tail)) for _ in range(count)]
+        return {
+            "boolean_and": ("boolean", [" AND ".join(pick(head, torso)) for _ in range(count)]),
+            "boolean_or": ("boolean", [" OR ".join(pick(torso, torso, tail)) for _ in range(count)]),
+            "boolean_not": ("boolean", ["{} AND {} NOT {}".format(*pick(head, torso, head)) for _ in range(count)]),
+            "phrase": ("phrase", phrases),
+            "ranked": ("ranked", [" ".join(pick(head, torso, torso, tail)) for _ in range(count)]),
+            "ranked_top10": ("ranked_top10", [" ".join(pick(head, torso, torso, tail)) for _ in range(count)]),
+            "ranked_broad": ("ranked", broad),
+            "ranked_broad_top10": ("ranked_top10", broad),
+        }
+
+    def run_workloads(self, boolean_index, positional_index):
+        """
+        Run the queries of the workloads (no cache) and summarize the latencies.
+        The first run warms up the page cache of the index files and is not measured.
+        """
+        boolean = BooleanQueryProcessor(index=boolean_index)
+        ranked = QueryProcessor(index=positional_index)
+        run = {
+            "boolean": boolean.process,
+            "phrase": ranked.process,
+            "ranked": ranked.process,
+            "ranked_top10": lambda q: ranked.process(q, 10),
+        }
+
+        results = {}
+        for name, (mode, queries) in self.workloads().items():
+            matches = sum(len(run[mode](q)) for q in queries)
+
+            latencies = []
+            start = time.perf_counter()
+            for _ in range(self.config["repeat"]):
+                for q in queries:
+                    query_start = time.perf_counter()
+                    run[mode](q)
+                    latencies.append((time.perf_counter() - query_start) * 1000)
+            results[name] = summarize(latencies, seconds=time.perf_counter() - start)
+            results[name]["matches"] = matches
+            print(f"[Done] {name}: {results[name]['qps']:0.1f} queries/sec, p50 {results[name]['p50_ms']:0.2f} ms, "
+                  f"p99 {results[name]['p99_ms']:0.2f} ms")
+        return results
+
+    def _phrases(self, rng, count):
+        """
+        Phrase queries of 2 or 3 consecutive words of the first documents, so they match
+        """
+        bodies = []
+        for _, _, body in self.generator.documents():
+            bodies.append(body.replace(".", "").lower().split())
+            if len(bodies) == 1000:
+                break
+
+        phrases = []
+        for _ in range(count):
+            words = rng.choice(bodies)
+            length = rng.randint(2, 3)
+            start = rng.randrange(max(len(words) - length, 1))
+            phrases.append('"{}"'.format(" ".join(words[start:start + length])))
+        return phrases
+
+    def _index(self, index_class, name):
+        index = index_class(workers=self.config["workers"], dataset=self.corpus)
+        index.index_path = os.path.join(self.directory, name + ".idx")
+        index.pickle_path = os.path.join(self.directory, name + ".pkl")
+        index.spelling_path = os.path.join(self.directory, name + ".spelling")
+        if hasattr(index, "statistics_path"):
+            index.statistics_path = os.path.join(self.directory, "statistics.bin")
+        return index
+
+def peak_rss():
+    """
+    Peak resident set size in bytes of this process and of its (finished) children.
+    None if it cannot be measured on this platform.
+    """
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux, in bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale,
+    }
+
+def flatten(results, prefix=""):
+    """
+    Numeric metrics of a results dict with dotted names, e.g. {"workloads.ranked.p99_ms": 1.2}
+    """
+    metrics = {}
+    for key, value in results.items():
+        name = prefix + key
+        if isinstance(value, dict):
+            metrics.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            metrics[name] = value
+    return metrics
+
+def compare(results, baseline, tolerance=default_tolerance):
+    """
+    Compare the metrics of a run with a baseline run.
+    Returns (name, baseline value, value, change) of the metrics that are worse than the tolerance.
+    """
+    if results.get("config") != baseline.get("config"):
+        print("[LOG] The configuration of the baseline is different, the results may not be comparable!")
+
+    current, base = flatten(results), flatten(baseline)
+    regressions = []
+    for name, value in sorted(current.items()):
+        # Only the measurements are compared (the run time of a workload is the same as its qps)
+        if name.startswith(("version", "config.", "environment.", "corpus.")):
+            continue
+        if name.endswith((".matches", ".queries", ".errors")) or (name.startswith("workloads.") and name.endswith(".seconds")):
+            continue
+        if name not in base or not base[name]:
+            continue
+
+        change = (value - base[name]) / base[name]
+        worse = -change if name.endswith(higher_is_better) else change
+        if worse > tolerance:
+            regressions.append((name, base[name], value, change))
+    return regressions
+
+def run_benchmark(output="bench/results.json", baseline=None, tolerance=default_tolerance, **config):
+    """
+    Run a benchmark, write its results to output and compare them with the baseline file.
+    Returns the list of regressions (empty without a baseline).
+    """
+    results = Benchmark(**config).run()
+
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"[Done] Benchmark results are written to {output}")
+
+    if baseline is None:
+        return []
+
+    with open(baseline) as f:
+        regressions = compare(results, json.load(f), tolerance)
+    for name, old, new, change in regressions:
+        print(f"[LOG] Regression {name}: {old:.4g} -> {new:.4g} ({change:+.1%})")
+    print(f"[Done] {len(regressions)} regressions against {baseline} (tolerance {tolerance:.0%})")
+    return regressions
@@ -0,0 +1,112 @@
+"""
+Sort based bulk index construction (BSBI).
+
+Instead of inserting every (token, doc) pair into a sorted posting list one by one,
+the builder collects (term, doc_id, position) tuples in a block. When the block is
+full it is sorted and spilled to a temporary run file. At the end, the sorted runs
+are k-way merged and grouped into posting lists.
+
+Building is O(N logN) for N tuples, and only one block is kept in memory.
+A builder without positions (for the boolean index) collects (term, doc_id) pairs,
+so no positions are stored, sorted or grouped.
+The indexes give term ids of a Lexicon (src.lexicon) as terms, so the tuples hold
+small shared integers instead of a token string for each occurrence.
+"""
+import heapq
+import pickle
+import tempfile
+from itertools import groupby
+from operator import itemgetter
+
+"""
+Here are some global variables
+"""
+default_memory_budget = 5_000_000 # max number of tuples kept in memory
+spill_batch_size = 10_000 # number of tuples pickled at once to a run file
+
+class BlockSortIndexBuilder:
+    """
+    Collects (term, doc_id, position) tuples and gives them back as sorted postings.
+
+    functions:
+    - add: add a tuple to the current block
+    - postings: generator of (term, [(doc_id, [positions]), ...]) sorted by term,
+                or (term, [doc_id, ...]) if the positions are not kept
+    """
+
+    def __init__(self, memory_budget=default_memory_budget, temp_dir=None, positions=True) -> None:
+        """
+        - memory_budget -> max number of tuples kept in memory before spilling to disk
+        - temp_dir -> the folder of the temporary run files (None is system default)
+        - positions -> keep the positions, otherwise (term, doc_id) pairs are collected
+        """
+        self._memory_budget = memory_budget
+        self._temp_dir = temp_dir
+        self._positions = positions
+        self._block = []
+        self._runs = [] # temporary run files
+
+    def add(self, term, doc_id, position=0) -> None:
+        """
+        Add the given tuple to the block. Spill the block if it reaches the memory budget.
+        The position is ignored by a builder without positions.
+        """
+        self._block.append((term, doc_id, position) if self._positions else (term, doc_id))
+        if len(self._block) >= self._memory_budget:
+            self._spill()
+
+    def _spill(self) -> None:
+        """
+        Sort the current block and write it to a new temporary run file
+        """
+        self._block.sort()
+        run = tempfile.TemporaryFile(dir=self._temp_dir)
+        for i in range(0, len(self._block), spill_batch_size):
+            pickle.dump(self._block[i:i + spill_batch_size], run, pickle.HIGHEST_PROTOCOL)
+        run.seek(0)
+
+        self._runs.append(run)
+        self._block = []
+
+    def _read_run(self, run):
+        """
+        Generator that reads the tuples of the given run file batch by batch
+        """
+        try:
+            while True:
+                yield from pickle.load(run)
+        except EOFError:
+            run.close()
+
+    def _sorted_tuples(self):
+        """
+        Return all the tuples in sorted order.
+        If there is no spilled run, the block is sorted in memory.
+        Otherwise all runs are k-way merged with heapq.merge
+        """
+        self._block.sort()
+        if not self._runs:
+            return iter(self._block)
+
+        runs = [self._read_run(run) for run in self._runs]
+        return heapq.merge(*runs, iter(self._block))
+
+    def postings(self):
+        """
+        Generator of the posting lists in the order of terms.
+        Each posting is a list of (doc_id, positions) and sorted by doc_id.
+        Without positions, each posting is a sorted list of distinct doc ids.
+        """
+        if not self._positions:
+            for term, group in groupby(self._sorted_tuples(), key=itemgetter(0)):
+                # The pairs are sorted, so the same doc ids are next to each other
+                yield term, [doc_id for doc_id, _ in groupby(map(itemgetter(1), group))]
+        else:
+            for term, group in groupby(self._sorted_tuples(), key=itemgetter(0)):
+                posting = []
+                for doc_id, tuples in groupby(group, key=itemgetter(1)):
+                    posting.append((doc_id, [position for _, _, position in tuples]))
+                yield term, posting
+
+        self._block = []
+        self._runs = []
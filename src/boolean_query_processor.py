@@ -1,16 +1,39 @@
+import re
 from typing import List
 from src.inverted_intex import InvertedIndex
 from src.base import BaseTextProcessor
+from src.query_parser import QueryParser, QuerySyntaxError, Term, Not, Or, lex
+from src.term_dictionary import TermDictionary, wildcard, default_max_expansions
+from src.spelling import SpellingIndex, default_suggestions
+from src.postings import posting_cursor
+from src.query_cursors import AndCursor, DifferenceCursor, union_cursor, page
+from src.query_cursors import count as count_cursor
+from src.instrumentation import span, count, observe, query_trace
+
+"""
+Here are some global variables
+"""
+# Query words that are operators, they are not spelling corrected
+operator_pattern = re.compile(r"AND|OR|NOT|O?NEAR\d+")
 
 class BooleanQueryProcessor:
-    def __init__(self) -> None:
+    def __init__(self, cache=None, index=None, max_expansions=default_max_expansions, correct_spelling=False) -> None:
+        """
+        - cache -> QueryCache for the results (see src.query_cache), None disables caching
+        - index -> index to search (e.g. SegmentedIndex), the saved InvertedIndex by default
+        - max_expansions -> max number of terms of a wildcard token like oil* (None -> no limit)
+        - correct_spelling -> replace the query terms that are not in the index with their
+                              nearest term (see src.spelling)
+        """
 
         # First creat the inverted index and load the dictionary
-        self._index = InvertedIndex()
-        
-        # If dictionary cannot load, then build
-        if not self._index.load():
-            self._index.build()
+        if index is None:
+            index = InvertedIndex()
+
+            # If dictionary cannot load, then build
+            if not index.load():
+                index.build()
+        self._index = index
         
         # Creat text processor for process the query
         self._preprocessor = BaseTextProcessor()
@@ -18,47 +41,349 @@ class BooleanQueryProcessor:
         # Define operands
         self._operands = ["AND", "OR", "NOT"]
 
-    def process(self, q) -> List:
+        # Results of the queries, keyed by the query tokens
+        self.cache = cache
+
+        # Sorted terms of the index for the wildcard tokens, it is created on first use
+        self.max_expansions = max_expansions
+        self._term_dictionary = None
+        self._term_generation = None
+        # Pattern -> terms given by a coordinator of shards (see src.sharding), they are
+        # used instead of the terms of this index
+        self.expansions = {}
+
+        # Spelling index of the index terms, it is loaded on first use
+        self.correct_spelling = correct_spelling
+        self._spelling = None
+        self._spelling_generation = None
+
+    def process(self, q, limit=None, offset=0) -> List:
         """
         Process function for parse and run the query
 
         It takes as input a query
         It returns the IDs of the matching documents sorted in ascending order.
+        It raises QueryError (e.g. QuerySyntaxError) if the query is not valid.
+
+        - limit, offset -> only the documents after the first offset ones, at most limit
+                           of them. They are found document at a time with cursors
+                           (see src.query_cursors), the rest of the result is not created.
+        """
+        with query_trace("boolean", q):
+            tokens = lex(q, self._preprocess)
+            key = ("boolean", tuple(tokens))
+            if limit is None and not offset:
+                return self._cached(key, lambda: list(self._evaluate(QueryParser(tokens).parse(), {})))
+
+            # A cached full result has all pages
+            result = self.cache.get(key, self._index.generation, id(self._index)) if self.cache is not None else None
+            if result is not None:
+                return list(result[offset:None if limit is None else offset + limit])
+
+            with span("boolean.page", offset=offset, limit=limit) as paging:
+                result = page(self._cursor(QueryParser(tokens).parse(), {}), offset, limit)
+                paging.set(result_size=len(result))
+            return result
+
+    def count(self, q) -> int:
+        """
+        Number of the documents that match the query, the result list is not created.
+        A term (or NOT term) is counted from its posting length, other queries by walking
+        their cursor (see src.query_cursors), so no result posting is created.
+        """
+        with query_trace("boolean.count", q):
+            tokens = lex(q, self._preprocess)
+            result = self.cache.get(("boolean", tuple(tokens)), self._index.generation, id(self._index)) if self.cache is not None else None
+            if result is not None:
+                return len(result)
+            return self._count(QueryParser(tokens).parse(), {})
+
+    def _count(self, node, postings) -> int:
+        if isinstance(node, Term):
+            return len(self._posting(node.token, postings))
+        elif isinstance(node, Not):
+            return len(self._index.universe()) - self._count(node.child, postings)
+        return count_cursor(self._cursor(node, postings))
+
+    def parse(self, q):
+        """
+        Parse the query to a tree of Term, And, Or and Not nodes (see src.query_parser)
+        """
+        return QueryParser(lex(q, self._preprocess)).parse()
+
+    def _cached(self, key, run) -> List:
+        """
+        Return the cached result of the key, or run the query and cache its result.
+        The key starts with the query type, so different query types never share a result.
         """
+        if self.cache is None:
+            return run()
 
-        q_tokens = self._preprocess(q)
+        result = self.cache.get(key, self._index.generation, id(self._index))
+        if result is None:
+            result = run()
+            self.cache.put(key, result, self._index.generation, id(self._index))
 
-        bag = []      
-        operand = None
+        # A copy, so the caller cannot change the cached result
+        return list(result)
 
-        for token in q_tokens:
-            if token in self._operands:
-                if not bag:
-                    print("Please correct your query!")
-                    exit()
-                operand = token
+    def _posting(self, token, postings) -> List:
+        """
+        Get the posting of the token. The postings dict keeps the fetched postings
+        during one query, so a posting is fetched only once.
+        """
+        if token not in postings:
+            postings[token] = self._fetch_token(token)
+        return postings[token]
+
+    def _fetch_token(self, token):
+        """
+        Get the posting of a query token. A wildcard token (e.g. oil*, *ing) gets
+        the union of the postings of its terms.
+        """
+        token = token.casefold()
+        if wildcard not in token:
+            return self._fetch(token)
+
+        terms = self._expand(token)
+        if not terms:
+            # A pattern is never a term, so it gives an empty posting of the index
+            return self._index.get(token)
+        with span("wildcard.union", terms=len(terms)):
+            return self._union_all([self._fetch(term) for term in terms])
+
+    def _union_all(self, postings):
+        """
+        Union of the postings, from the smallest to the biggest one like an OR node
+        """
+        postings = sorted(postings, key=len)
+        result = postings[0]
+        for posting in postings[1:]:
+            result = self._index.union(result, posting)
+        return result
+
+    def _expand(self, pattern) -> List:
+        """
+        Terms of the index that match the (case folded) wildcard pattern.
+        It raises WildcardError if there are more than max_expansions terms.
+        """
+        with span("wildcard.expand", pattern=pattern) as expand:
+            if pattern in self.expansions:
+                terms = self.expansions[pattern]
             else:
-                bag.append(self._index.get(token.casefold()))
-                if len(bag) > 1 and operand != None:
-                    sub_result = self._operation(bag, operand)
-                    if sub_result == None:
-                        exit()
-                    bag.append(sub_result)
-                elif len(bag) > 2 and operand == None:
-                    print("Please correct your query, there is no operand!")
-                    exit()
+                terms = self.term_dictionary().expand(pattern, self.max_expansions)
+            expand.set(terms=len(terms))
+        observe("wildcard.expansions", len(terms))
+        return terms
+
+    def wildcard_terms(self, queries) -> dict:
+        """
+        Pattern -> all terms of this index that match it, for the wildcard tokens of the
+        queries (without the max_expansions limit). A coordinator of shards joins them.
+        """
+        patterns = {token.casefold() for q in queries for token in self._tokens(q) if wildcard in token}
+        return {pattern: self.term_dictionary().expand(pattern, None) for pattern in patterns}
 
+    def term_dictionary(self) -> TermDictionary:
+        """
+        Sorted terms of the index, they are read again if the index changes.
+        The keys of an index are sorted, so they are not sorted again (the keys
+        of a binary index are its mapped lexicon, they are not read at all).
+        """
+        if self._term_dictionary is None or self._term_generation != self._index.generation:
+            with span("wildcard.dictionary"):
+                self._term_dictionary = TermDictionary(self._index.keys(), presorted=True)
+            self._term_generation = self._index.generation
+        return self._term_dictionary
 
-        return bag.pop()
+    def _fetch(self, token):
+        """
+        Get the posting of the (case folded) token from the index
+        """
+        with span("posting.fetch", token=token) as fetch:
+            posting = self._index.get(token)
+            fetch.set(length=len(posting))
+        observe("posting.length", len(posting))
+        return posting
+
+    def _estimate(self, node, postings) -> int:
+        """
+        Estimated number of documents of the node.
+        It is the document frequency for a term, the smallest child for AND
+        and the sum of the children for OR.
+        """
+        if isinstance(node, Term):
+            return len(self._posting(node.token, postings))
+        elif isinstance(node, Not):
+            return len(self._index.universe()) - self._estimate(node.child, postings)
+        elif isinstance(node, Or):
+            return sum(self._estimate(child, postings) for child in node.children)
+
+        positives = [child for child in node.children if not isinstance(child, Not)]
+        if not positives:
+            return len(self._index.universe())
+        return min(self._estimate(child, postings) for child in positives)
+
+    def _evaluate(self, node, postings) -> List:
+        """
+        Evaluate the query tree.
+
+        - AND: the children are intersected from the smallest to the biggest one and
+               the NOT children are applied last. It stops when the result is empty.
+        - OR: the children are joined from the smallest to the biggest one.
+        - NOT: all documents - child
+        """
+        if isinstance(node, Term):
+            return self._posting(node.token, postings)
+        elif isinstance(node, Not):
+            child = self._evaluate(node.child, postings)
+            with span("boolean.not"):
+                result = self._index.difference(self._index.universe(), child)
+            observe("boolean.not.result_size", len(result))
+            return result
+        elif isinstance(node, Or):
+            results = sorted((self._evaluate(child, postings) for child in node.children), key=len)
+            with span("boolean.or"):
+                result = results[0]
+                for posting in results[1:]:
+                    result = self._index.union(result, posting)
+            observe("boolean.or.result_size", len(result))
+            return result
+
+        with span("boolean.and") as operator:
+            result = self._evaluate_and(node, postings)
+            operator.set(result_size=len(result))
+        observe("boolean.and.result_size", len(result))
+        return result
+
+    def _evaluate_and(self, node, postings) -> List:
+        """
+        AND node of _evaluate (with its NOT children)
+        """
+        def estimate(child):
+            return self._estimate(child, postings)
+
+        positives = sorted((child for child in node.children if not isinstance(child, Not)), key=estimate)
+        negatives = sorted((child.child for child in node.children if isinstance(child, Not)), key=estimate, reverse=True)
+
+        result = self._evaluate(positives[0], postings) if positives else self._index.universe()
+        for child in positives[1:]:
+            if not result:
+                return []
+            result = self._index.merge(result, self._evaluate(child, postings))
+
+        for child in negatives:
+            if not result:
+                return []
+            result = self._index.difference(result, self._evaluate(child, postings))
+
+        return result
+
+    def suggest(self, q, limit=default_suggestions) -> dict:
+        """
+        Spelling suggestions of the query words that are not in the index:
+        {word: [(term, distance, df), ...]}, the nearest and most frequent terms first
+        """
+        spelling = self.spelling_index()
+        suggestions = {}
+        for token in self._tokens(q):
+            if operator_pattern.fullmatch(token) or wildcard in token or token.casefold() in spelling:
+                continue
+            suggestions[token] = spelling.suggest(token.casefold(), limit=limit)
+        return suggestions
+
+    def spelling_index(self) -> SpellingIndex:
+        """
+        Spelling index of the index terms. An InvertedIndex loads it from its file
+        (see InvertedIndex.spelling), for other indexes it is computed here.
+        """
+        if self._spelling is None or self._spelling_generation != self._index.generation:
+            spelling = getattr(self._index, "spelling", None)
+            with span("spelling.index"):
+                self._spelling = spelling() if spelling is not None else SpellingIndex.from_index(self._index)
+            self._spelling_generation = self._index.generation
+        return self._spelling
+
+    def _correct(self, tokens) -> List:
+        """
+        Replace the tokens that are not in the index with their best spelling suggestion.
+        Operators, wildcard tokens and tokens without a suggestion are kept.
+        """
+        spelling = self.spelling_index()
+        corrected = []
+        for token in tokens:
+            if operator_pattern.fullmatch(token) or wildcard in token or token.casefold() in spelling:
+                corrected.append(token)
+                continue
+
+            term = spelling.correct(token.casefold())
+            if term is None:
+                corrected.append(token)
+            else:
+                corrected.append(term)
+                count("spelling.corrections")
+        return corrected
+
+    def _cursor(self, node, postings):
+        """
+        Cursor of the documents of the query tree (document at a time evaluation).
+        Like _evaluate, the AND children are ordered from the smallest one and the
+        NOT children are excluded from the result of the others.
+        """
+        if isinstance(node, Term):
+            return posting_cursor(self._posting(node.token, postings))
+        elif isinstance(node, Not):
+            return DifferenceCursor(posting_cursor(self._index.universe()), self._cursor(node.child, postings))
+        elif isinstance(node, Or):
+            return union_cursor([self._cursor(child, postings) for child in node.children])
+
+        def estimate(child):
+            return self._estimate(child, postings)
+
+        positives = sorted((child for child in node.children if not isinstance(child, Not)), key=estimate)
+        negatives = [child.child for child in node.children if isinstance(child, Not)]
+
+        if not positives:
+            cursor = posting_cursor(self._index.universe())
+        elif len(positives) == 1:
+            cursor = self._cursor(positives[0], postings)
+        else:
+            cursor = AndCursor([self._cursor(child, postings) for child in positives])
+
+        if negatives:
+            cursor = DifferenceCursor(cursor, union_cursor([self._cursor(child, postings) for child in negatives]))
+        return cursor
 
     def _preprocess(self, q) -> str:
         """
-        Function for preprocess the query before process
+        Function for preprocess the query before process.
+        The unknown tokens are spelling corrected if correct_spelling is set.
+        """
+        tokens = self._tokens(q)
+        if self.correct_spelling and tokens:
+            return self._correct(tokens)
+        return tokens
+
+    def _tokens(self, q) -> List:
+        """
+        Punctuation and stopword removal and tokenization of the query.
+
+        The "*" of the wildcard tokens is kept, and the stopwords are not removed
+        from them (e.g. the* is not a stopword).
         """
         self._preprocessor._text = q
-        self._preprocessor.punctuation_remove()
-        text = self._preprocessor.stopword_remove()
-        return self._preprocessor.tokenize(text)
+        self._preprocessor.punctuation_remove(keep=wildcard)
+        if wildcard not in self._preprocessor._text:
+            text = self._preprocessor.stopword_remove()
+            return self._preprocessor.tokenize(text)
+
+        tokens = []
+        for word in self._preprocessor.tokenize():
+            if wildcard in word:
+                tokens.append(word)
+            else:
+                tokens.extend(self._preprocessor.stopword_remove(word).split())
+        return tokens
 
     def _operation(self, bag, operand) -> List:
         """
@@ -77,5 +402,4 @@ class BooleanQueryProcessor:
         elif operand == 'NOT':
             return self._index.difference(bag.pop(0), bag.pop(0))
         else:
-            print("Wrong operator!")
-            return None
+            raise QuerySyntaxError(f"Wrong operator: {operand}!")
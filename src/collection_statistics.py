@@ -0,0 +1,213 @@
+"""
+Collection statistics of the positional index, kept apart from the postings.
+
+They are used only for ranking, so a boolean query processor never loads them.
+All values are kept in compact arrays:
+- per term (term id from the terms lexicon) -> df, idf, bound (max weight / document norm)
+- per document (indexed directly by doc id) -> length (number of tokens), norm (tf-idf vector length)
+
+File layout: header (magic, version, N, counts, checksums), then the arrays and the
+terms (utf-8, separated by \\0). The header keeps the checksum of the index file that the
+statistics belong to, so statistics of another (older) index are not used.
+"""
+import os
+import math
+import struct
+import sys
+import zlib
+from array import array
+
+from src.metrics import calculate_tf, calculate_idf
+from src.disk_index import IndexFormatError
+from src.lexicon import Lexicon
+
+"""
+Here are some global variables
+"""
+magic = b"TSESTAT\x00"
+format_version = 2
+
+# magic, version, N, term count, doc slots, terms length, checksum of the source index, data checksum
+header_struct = struct.Struct("<8sIQQQQII")
+
+class CollectionStatistics:
+    """
+    N, df/idf of the terms and lengths/norms of the documents.
+
+    functions:
+    - from_postings: compute the statistics from the postings of an index
+    - save / load: binary file of the statistics
+    - df, idf, bound: statistics of a term (0 if the term is not in the collection)
+    - term_id: id of a term in the arrays, a query token is translated once and then
+               its values are read directly (dfs[term_id], idfs[term_id], bounds[term_id])
+    - length, norm: statistics of a document (0 if the document is not in the collection)
+    """
+
+    def __init__(self) -> None:
+        self.N = 0
+        self.terms = Lexicon()
+        self.dfs = array("I")
+        self.idfs = array("d")
+        self.bounds = array("d")
+        self.lengths = array("I")
+        self.norms = array("d")
+
+        # Checksum of the index file of the postings (0 -> not saved index)
+        self.source_checksum = 0
+
+    @classmethod
+    def from_postings(cls, items, N, doc_lengths=None, dfs=None):
+        """
+        - items -> (token, PositionalPosting) pairs of the index (without pseudo-terms)
+        - N -> number of documents
+        - doc_lengths -> {doc_id: number of tokens} counted while indexing.
+                         If it is not given, lengths are summed from the postings.
+        - dfs -> {token: df} of the whole collection, if the postings are only a part
+                 of it (a shard). N must be the number of documents of the whole collection.
+
+        Postings are traversed twice: once for the norms, once for the bounds
+        (they need the norms of the whole collection).
+        """
+        statistics = cls()
+        statistics.N = N
+        postings = []
+        squares = array("d")
+
+        for token, posting in items:
+            df = len(posting) if dfs is None else dfs[token]
+            statistics.terms.add(token)
+            statistics.dfs.append(df)
+            idf = calculate_idf(N, df)
+            statistics.idfs.append(idf)
+            postings.append(posting)
+
+            offsets = posting.offsets
+            for i, doc_id in enumerate(posting.doc_ids):
+                if doc_id >= len(squares):
+                    squares.extend([0.0] * (doc_id + 1 - len(squares)))
+                    if doc_lengths is None:
+                        statistics.lengths.extend([0] * (doc_id + 1 - len(statistics.lengths)))
+                weight = calculate_tf(offsets[i + 1] - offsets[i]) * idf
+                squares[doc_id] += weight * weight
+                if doc_lengths is None:
+                    statistics.lengths[doc_id] += offsets[i + 1] - offsets[i]
+
+        statistics.norms = array("d", (math.sqrt(square) for square in squares))
+
+        if doc_lengths is not None:
+            size = max(len(squares), max(doc_lengths, default=-1) + 1)
+            statistics.lengths = array("I", [0] * size)
+            statistics.norms.extend([0.0] * (size - len(statistics.norms)))
+            for doc_id, length in doc_lengths.items():
+                statistics.lengths[doc_id] = length
+
+        norms = statistics.norms
+        for term_id, posting in enumerate(postings):
+            idf = statistics.idfs[term_id]
+            offsets = posting.offsets
+            bound = 0
+            for i, doc_id in enumerate(posting.doc_ids):
+                if norms[doc_id]:
+                    bound = max(bound, calculate_tf(offsets[i + 1] - offsets[i]) * idf / norms[doc_id])
+            statistics.bounds.append(bound)
+
+        # Tokens of the other parts of the collection, the query weights need their idf
+        if dfs is not None:
+            for token, df in dfs.items():
+                if token not in statistics.terms:
+                    statistics.terms.add(token)
+                    statistics.dfs.append(df)
+                    statistics.idfs.append(calculate_idf(N, df))
+                    statistics.bounds.append(0)
+
+        return statistics
+
+    def term_id(self, token):
+        """
+        Id of the token in the term arrays, None if the token is not in the collection
+        """
+        return self.terms.get(token)
+
+    def df(self, token) -> int:
+        term_id = self.terms.get(token)
+        return 0 if term_id is None else self.dfs[term_id]
+
+    def idf(self, token) -> float:
+        term_id = self.terms.get(token)
+        return 0 if term_id is None else self.idfs[term_id]
+
+    def bound(self, token) -> float:
+        """
+        Maximum weight / document norm of the token in a document (used by top k pruning)
+        """
+        term_id = self.terms.get(token)
+        return 0 if term_id is None else self.bounds[term_id]
+
+    def length(self, doc_id) -> int:
+        return self.lengths[doc_id] if 0 <= doc_id < len(self.lengths) else 0
+
+    def norm(self, doc_id) -> float:
+        return self.norms[doc_id] if 0 <= doc_id < len(self.norms) else 0
+
+    def _sections(self):
+        sections = [array(typecode, values) for typecode, values in
+                    (("I", self.dfs), ("d", self.idfs), ("d", self.bounds), ("I", self.lengths), ("d", self.norms))]
+        if sys.byteorder == "big":
+            for section in sections:
+                section.byteswap()
+        return [section.tobytes() for section in sections] + [self.terms.to_bytes()]
+
+    def save(self, path):
+        """
+        Save the statistics to path in binary format
+        """
+        sections = self._sections()
+        checksum = 0
+        for section in sections:
+            checksum = zlib.crc32(section, checksum)
+
+        header = header_struct.pack(magic, format_version, self.N, len(self.terms),
+                                    len(self.lengths), len(sections[-1]), self.source_checksum, checksum)
+        # Readers may load the file at any time, so it is replaced atomically, not rewritten
+        with open(path + ".tmp", "wb") as f:
+            f.write(header)
+            for section in sections:
+                f.write(section)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load the statistics of save(path).
+        Raises FileNotFoundError or IndexFormatError (not valid file)
+        """
+        with open(path, "rb") as f:
+            data = f.read()
+
+        if len(data) < header_struct.size:
+            raise IndexFormatError(f"{path} is not a statistics file")
+        (file_magic, version, N, term_count, doc_slots, terms_length,
+         source_checksum, checksum) = header_struct.unpack_from(data)
+        if file_magic != magic:
+            raise IndexFormatError(f"{path} is not a statistics file")
+        if version != format_version:
+            raise IndexFormatError(f"{path} has format version {version}, expected {format_version}")
+        if zlib.crc32(data[header_struct.size:]) != checksum:
+            raise IndexFormatError(f"{path} has a wrong checksum")
+
+        statistics = cls()
+        statistics.N = N
+        statistics.source_checksum = source_checksum
+        start = header_struct.size
+        for name, typecode, count in (("dfs", "I", term_count), ("idfs", "d", term_count), ("bounds", "d", term_count),
+                                      ("lengths", "I", doc_slots), ("norms", "d", doc_slots)):
+            values = array(typecode)
+            end = start + count * values.itemsize
+            values.frombytes(data[start:end])
+            if sys.byteorder == "big":
+                values.byteswap()
+            setattr(statistics, name, values)
+            start = end
+
+        statistics.terms = Lexicon.from_bytes(data[start:start + terms_length], term_count)
+        return statistics
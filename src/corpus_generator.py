@@ -0,0 +1,138 @@
+"""
+Synthetic Reuters-style corpus for benchmarks (no download is needed).
+
+The documents are written to reut2-NNN.sgm files in the same SGML layout as the
+Reuters-21578 collection (<REUTERS NEWID=...> with <TITLE> and <BODY>), so they
+are parsed by SGMPreprocessor like the real files.
+
+Words are drawn from a Zipfian distribution (the frequency of the word of rank r
+is proportional to 1 / r^s), like the words of natural text. The most frequent
+ranks are the stopwords, then come generated words. The same seed always writes
+the same corpus.
+"""
+import os
+import time
+import random
+from bisect import bisect_left
+from itertools import accumulate
+
+from src.base import BaseTextProcessor
+
+"""
+Here are some global variables
+"""
+docs_per_file = 1000
+syllables = [c + v for c in "bcdfghjklmnprstvwz" for v in "aeiou"]
+
+class CorpusGenerator:
+    """
+    Writer of synthetic sgm files.
+
+    Usage:
+        CorpusGenerator(docs=10000, seed=7).write("bench/corpus")
+    """
+
+    def __init__(self, docs=10000, vocabulary_size=50000, zipf_exponent=1.0,
+                 min_length=20, max_length=200, seed=7) -> None:
+        """
+        - docs -> number of documents
+        - vocabulary_size -> number of distinct words (stopwords included)
+        - zipf_exponent -> s of the Zipf distribution, higher values make the head heavier
+        - min_length, max_length -> number of words of a document body
+        - seed -> seed of the random generator
+        """
+        self.docs = docs
+        self.vocabulary_size = vocabulary_size
+        self.zipf_exponent = zipf_exponent
+        self.min_length = min_length
+        self.max_length = max_length
+        self.seed = seed
+
+        # Number of the stopwords at the start of the vocabulary, it is set by _vocabulary
+        self.stopword_count = 0
+        self.vocabulary = self._vocabulary()
+        self._cumulative = list(accumulate(1 / rank ** zipf_exponent for rank in range(1, len(self.vocabulary) + 1)))
+
+    def words(self, rng, count):
+        """
+        Draw count words from the Zipf distribution
+        """
+        total = self._cumulative[-1]
+        cumulative = self._cumulative
+        vocabulary = self.vocabulary
+        return [vocabulary[bisect_left(cumulative, rng.random() * total)] for _ in range(count)]
+
+    def documents(self):
+        """
+        Generator of (doc_id, title, body) tuples
+        """
+        rng = random.Random(self.seed)
+        for doc_id in range(1, self.docs + 1):
+            title = " ".join(self.words(rng, rng.randint(2, 8))).upper()
+            sentences = []
+            words = self.words(rng, rng.randint(self.min_length, self.max_length))
+            while words:
+                length = rng.randint(5, 25)
+                sentence, words = words[:length], words[length:]
+                sentences.append(" ".join(sentence).capitalize() + ".")
+            yield doc_id, title, " ".join(sentences)
+
+    def write(self, directory):
+        """
+        Write the documents to reut2-NNN.sgm files (docs_per_file documents in each file).
+        Returns the list of written file names.
+        """
+        start_writing = time.perf_counter()
+        os.makedirs(directory, exist_ok=True)
+
+        files = []
+        f = None
+        for doc_id, title, body in self.documents():
+            if (doc_id - 1) % docs_per_file == 0:
+                if f is not None:
+                    f.close()
+                files.append(f"reut2-{len(files):03d}.sgm")
+                f = open(os.path.join(directory, files[-1]), "w", encoding="latin-1")
+                f.write('<!DOCTYPE lewis SYSTEM "lewis.dtd">\n')
+
+            f.write(f'<REUTERS TOPICS="YES" LEWISSPLIT="TRAIN" CGISPLIT="TRAINING-SET" OLDID="{doc_id}" NEWID="{doc_id}">\n'
+                    f'<DATE>26-FEB-1987 15:01:01.79</DATE>\n'
+                    f'<TEXT>&#2;\n<TITLE>{title}</TITLE>\n<BODY>{_wrap(body)}\n Reuter\n&#3;</BODY></TEXT>\n'
+                    f'</REUTERS>\n')
+        if f is not None:
+            f.close()
+
+        end_writing = time.perf_counter()
+        print(f"[Done] {self.docs} documents are written to {len(files)} sgm files in {end_writing - start_writing:0.4f} seconds")
+        return files
+
+    def _vocabulary(self):
+        """
+        Words ordered by rank: the stopwords, then unique generated words
+        """
+        rng = random.Random(self.seed)
+        vocabulary = list(dict.fromkeys(BaseTextProcessor().stopwords))[:self.vocabulary_size]
+        self.stopword_count = len(vocabulary)
+        seen = set(vocabulary)
+        while len(vocabulary) < self.vocabulary_size:
+            word = "".join(rng.choices(syllables, k=rng.randint(2, 4)))
+            if word not in seen:
+                seen.add(word)
+                vocabulary.append(word)
+        return vocabulary
+
+def _wrap(text, width=70):
+    """
+    Break the text to lines like the Reuters bodies
+    """
+    lines, line = [], []
+    size = 0
+    for word in text.split(" "):
+        if line and size + len(word) > width:
+            lines.append(" ".join(line))
+            line, size = [], 0
+        line.append(word)
+        size += len(word) + 1
+    if line:
+        lines.append(" ".join(line))
+    return "\n".join(lines)
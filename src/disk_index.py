@@ -0,0 +1,347 @@
+"""
+Versioned binary on-disk format of the inverted indexes.
+
+The whole file is opened with mmap, so loading only reads the header. A posting is
+decoded only when its token is asked, and processes that load the same file share
+the page cache instead of keeping private copies of the dictionary.
+
+File layout:
+- header: magic, format version, index kind, section offsets, checksums
+- lexicon: fixed size entries sorted by term -> (term offset, term length, posting offset, posting length,
+           skip pointers length, df)
+- terms: utf-8 bytes of all terms
+- postings: encoded posting lists (boolean postings are followed by their skip pointers)
+- extras: pickled pseudo-terms of the index (e.g. "ALL_DOCS"), loaded lazily
+
+Posting encodings (all numbers are varint, see src.postings):
+- boolean: doc id gaps
+- positional: for each doc -> doc id gap, number of positions, position gaps
+"""
+import os
+import mmap
+import pickle
+import struct
+import zlib
+from array import array
+
+from src.postings import CompressedPosting, PositionalPosting, encode_gaps
+
+"""
+Here are some global variables
+"""
+magic = b"TSEIDX\x00\x00"
+format_version = 2
+boolean_kind = 0
+positional_kind = 1
+
+# magic, version, kind, term count, lexicon/terms/postings/extras offsets, extras length, data checksum
+header_struct = struct.Struct("<8sIIQQQQQQI")
+# header checksum is written after the header fields
+header_size = header_struct.size + 4
+# term offset, term length, posting offset, posting length, skip pointers length, df
+entry_struct = struct.Struct("<QIQIII")
+
+class IndexFormatError(Exception):
+    """
+    Raised when an index file is not valid or its format version is not supported
+    """
+
+def _encode_varint(value, data):
+    while value >= 0x80:
+        data.append((value & 0x7F) | 0x80)
+        value >>= 7
+    data.append(value)
+
+def _decode_varint(data, i):
+    """
+    Decode one varint starting from index i. Returns the value and the next index.
+    """
+    value, shift = 0, 0
+    while True:
+        byte = data[i]
+        i += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, i
+        shift += 7
+
+def encode_positional(posting):
+    """
+    Encode PositionalPosting to bytes
+    """
+    data = bytearray()
+    last = 0
+    for doc_id, positions in posting:
+        _encode_varint(doc_id - last, data)
+        last = doc_id
+
+        _encode_varint(len(positions), data)
+        data += encode_gaps(positions)[0]
+    return bytes(data)
+
+def decode_positional(data):
+    """
+    Decode the bytes of encode_positional back to PositionalPosting
+    """
+    posting = PositionalPosting()
+    doc_ids, offsets, positions = posting.doc_ids, posting.offsets, array("I")
+    i, doc_id = 0, 0
+    while i < len(data):
+        gap, i = _decode_varint(data, i)
+        doc_id += gap
+        count, i = _decode_varint(data, i)
+
+        position = 0
+        for _ in range(count):
+            gap, i = _decode_varint(data, i)
+            position += gap
+            positions.append(position)
+        doc_ids.append(doc_id)
+        offsets.append(len(positions))
+    return PositionalPosting.from_arrays(doc_ids, offsets, positions)
+
+def write_index(path, dictionary, kind, pseudo_terms=()):
+    """
+    Write the given dictionary to path in binary format.
+
+    - kind -> boolean_kind or positional_kind
+    - pseudo_terms -> keys of the dictionary that are not posting lists,
+                      they are pickled to the extras section
+
+    The data is written to a temporary file that replaces path, so a process that has
+    the old file mapped keeps reading the old index.
+
+    Returns the data checksum of the file (MappedDictionary.checksum of it).
+    """
+    extras = {term: dictionary[term] for term in pseudo_terms if term in dictionary}
+    terms = sorted((term for term in dictionary if term not in extras), key=lambda t: t.encode("utf-8"))
+
+    lexicon = bytearray()
+    term_bytes = bytearray()
+    postings = bytearray()
+
+    for term in terms:
+        posting = dictionary[term]
+        skip_data = b""
+        if kind == positional_kind:
+            encoded = encode_positional(posting)
+        else:
+            if not isinstance(posting, CompressedPosting):
+                posting = CompressedPosting(posting)
+            encoded = posting.data
+            skip_data = posting.skip_data
+
+        encoded_term = term.encode("utf-8")
+        lexicon += entry_struct.pack(len(term_bytes), len(encoded_term), len(postings),
+                                     len(encoded), len(skip_data), len(posting))
+        term_bytes += encoded_term
+        postings += encoded
+        postings += skip_data
+
+    extras_data = pickle.dumps(extras, pickle.HIGHEST_PROTOCOL)
+
+    lexicon_offset = header_size
+    terms_offset = lexicon_offset + len(lexicon)
+    postings_offset = terms_offset + len(term_bytes)
+    extras_offset = postings_offset + len(postings)
+
+    checksum = 0
+    for section in (lexicon, term_bytes, postings, extras_data):
+        checksum = zlib.crc32(section, checksum)
+
+    header = header_struct.pack(magic, format_version, kind, len(terms), lexicon_offset,
+                                terms_offset, postings_offset, extras_offset, len(extras_data), checksum)
+
+    # The file may be mapped by readers, so it is replaced atomically, not rewritten
+    with open(path + ".tmp", "wb") as f:
+        f.write(header)
+        f.write(struct.pack("<I", zlib.crc32(header)))
+        for section in (lexicon, term_bytes, postings, extras_data):
+            f.write(section)
+    os.replace(path + ".tmp", path)
+    return checksum
+
+class MappedDictionary:
+    """
+    Read-only dictionary of an index file that is opened with mmap.
+
+    It has the dict functions used by the indexes (get, keys, items, in, len).
+    get(token) binary searches the sorted lexicon and decodes only that posting.
+    The extras (pseudo-terms) are unpickled at the first access.
+    """
+
+    def __init__(self, path, verify=False) -> None:
+        """
+        - path -> the index file
+        - verify -> check the data checksum of the whole file (reads all the file)
+        """
+        self._file = open(path, "rb")
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise IndexFormatError(f"{path} is empty")
+
+        if len(self._mm) < header_size:
+            self.close()
+            raise IndexFormatError(f"{path} is not an index file")
+
+        header = self._mm[:header_struct.size]
+        (file_magic, version, self.kind, self._term_count, self._lexicon_offset, self._terms_offset,
+         self._postings_offset, self._extras_offset, self._extras_length, self._checksum) = header_struct.unpack(header)
+
+        if file_magic != magic:
+            self.close()
+            raise IndexFormatError(f"{path} is not an index file")
+        if version != format_version:
+            self.close()
+            raise IndexFormatError(f"{path} has format version {version}, expected {format_version}")
+        if struct.unpack_from("<I", self._mm, header_struct.size)[0] != zlib.crc32(header):
+            self.close()
+            raise IndexFormatError(f"{path} has a corrupted header")
+        if verify and not self.verify():
+            self.close()
+            raise IndexFormatError(f"{path} has a wrong checksum")
+
+        self._extras = None
+
+    @property
+    def checksum(self) -> int:
+        """
+        Checksum of the data of the file, it changes when the index is saved again
+        """
+        return self._checksum
+
+    def verify(self) -> bool:
+        """
+        Compare the checksum in the header with the checksum of the data
+        """
+        return zlib.crc32(self._mm[header_size:]) == self._checksum
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+    @property
+    def extras(self):
+        if self._extras is None:
+            start = self._extras_offset
+            self._extras = pickle.loads(self._mm[start:start + self._extras_length])
+        return self._extras
+
+    def _entry(self, i):
+        return entry_struct.unpack_from(self._mm, self._lexicon_offset + i * entry_struct.size)
+
+    def _term(self, entry):
+        start = self._terms_offset + entry[0]
+        return self._mm[start:start + entry[1]]
+
+    def _find(self, token):
+        """
+        Binary search of the token in the lexicon. Returns the entry or None
+        """
+        key = token.encode("utf-8")
+        start, end = 0, self._term_count - 1
+
+        while start <= end:
+            middle = (start + end) // 2
+            entry = self._entry(middle)
+            term = self._term(entry)
+
+            if term == key:
+                return entry
+            elif term > key:
+                end = middle - 1
+            else:
+                start = middle + 1
+        return None
+
+    def _posting(self, entry):
+        start = self._postings_offset + entry[2]
+        data = self._mm[start:start + entry[3]]
+        if self.kind == positional_kind:
+            return decode_positional(data)
+        skip_data = self._mm[start + entry[3]:start + entry[3] + entry[4]]
+        return CompressedPosting.from_bytes(data, entry[5], skip_data)
+
+    def get(self, token, default=None):
+        if token in self.extras:
+            return self.extras[token]
+
+        entry = self._find(token)
+        return self._posting(entry) if entry else default
+
+    def df(self, token) -> int:
+        """
+        Document frequency of the token without decoding its posting
+        """
+        entry = self._find(token)
+        return entry[5] if entry else 0
+
+    def __getitem__(self, token):
+        value = self.get(token)
+        if value is None:
+            raise KeyError(token)
+        return value
+
+    def __contains__(self, token):
+        return token in self.extras or self._find(token) is not None
+
+    def __len__(self):
+        return self._term_count + len(self.extras)
+
+    def __iter__(self):
+        for i in range(self._term_count):
+            yield self._term(self._entry(i)).decode("utf-8")
+        yield from self.extras
+
+    def keys(self):
+        return iter(self)
+
+    def terms(self):
+        """
+        Sorted terms of the lexicon (without the extras) as a read-only sequence.
+        A term is decoded only when it is accessed.
+        """
+        return MappedTerms(self)
+
+    def values(self):
+        for _, value in self.items():
+            yield value
+
+    def items(self):
+        for i in range(self._term_count):
+            entry = self._entry(i)
+            yield self._term(entry).decode("utf-8"), self._posting(entry)
+        yield from self.extras.items()
+
+class MappedTerms:
+    """
+    Sorted terms of a MappedDictionary as a sequence (len, [i], [i:j], in, iter).
+    The lexicon is sorted by the utf-8 bytes of the terms, which is also the order
+    of the strings, so bisect works on it without reading all the terms.
+    """
+
+    def __init__(self, dictionary) -> None:
+        self._dictionary = dictionary
+
+    def __len__(self):
+        return self._dictionary._term_count
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        dictionary = self._dictionary
+        return dictionary._term(dictionary._entry(i)).decode("utf-8")
+
+    def __contains__(self, term):
+        return self._dictionary._find(term) is not None
+
+    def __iter__(self):
+        dictionary = self._dictionary
+        for i in range(len(self)):
+            yield dictionary._term(dictionary._entry(i)).decode("utf-8")
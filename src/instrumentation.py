@@ -0,0 +1,322 @@
+"""
+Metrics and tracing of the search system.
+
+Instrumented code records:
+- spans -> named timed sections, e.g. "index.save" or "boolean.and". Spans are nested,
+           the spans of one query make a tree (trace) that shows where its time is spent.
+- counters -> named totals, e.g. "ingest.documents"
+- values -> distributions of sizes, e.g. "posting.length" or "boolean.and.result_size"
+
+It is disabled by default. Then span() returns a shared empty object and count() /
+observe() return at once, so the instrumented code runs at almost the same speed.
+
+Usage:
+    instrumentation.enable(profile=0.01)            # cProfile 1% of the queries
+    qp.process("oil AND price")
+    instrumentation.last_trace()                     # span tree of the last query
+    instrumentation.to_prometheus()                  # all metrics in Prometheus text format
+
+The metrics are kept per process, every worker process has its own registry.
+"""
+import io
+import json
+import time
+import random
+import pstats
+import cProfile
+import threading
+from collections import deque
+
+"""
+Here are some global variables
+"""
+enabled = False
+
+# Fraction of the queries that are profiled with cProfile (0 -> none, 1 -> all)
+profile_rate = 0.0
+# Number of functions in the profile of a query
+profile_limit = 20
+# Queries slower than this (ms) are kept in slow_traces (None -> not kept)
+slow_query_ms = None
+# Number of the kept recent and slow query traces
+traces_kept = 100
+# Function that is called with the trace of every query, e.g. to log the slow ones
+on_query = None
+
+prometheus_prefix = "search"
+
+class _NoSpan:
+    """
+    Span of the disabled mode, it does nothing
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+_no_span = _NoSpan()
+
+class Span:
+    """
+    Timed section. It is recorded to the registry when it ends and it is added to
+    the children of the span that was open when it started.
+    """
+    __slots__ = ("name", "attrs", "children", "seconds", "_start")
+
+    def __init__(self, name, attrs) -> None:
+        self.name = name
+        self.attrs = attrs
+        self.children = []
+        self.seconds = 0.0
+        self._start = 0.0
+
+    def __enter__(self):
+        _stack().append(self)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.seconds = time.perf_counter() - self._start
+        stack = _stack()
+        stack.pop()
+        if stack:
+            stack[-1].children.append(self)
+        registry.record_span(self.name, self.seconds)
+        return False
+
+    def set(self, **attrs):
+        """
+        Add attributes to the span, e.g. span.set(result_size=12)
+        """
+        self.attrs.update(attrs)
+
+    def to_dict(self):
+        span = {"name": self.name, "ms": self.seconds * 1000}
+        if self.attrs:
+            span["attrs"] = self.attrs
+        if self.children:
+            span["children"] = [child.to_dict() for child in self.children]
+        return span
+
+class Registry:
+    """
+    Totals of the spans, counters and values of a process
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            # name -> [count, total seconds, max seconds]
+            self.spans = {}
+            self.counters = {}
+            # name -> [count, sum, min, max]
+            self.values = {}
+            self.recent_traces = deque(maxlen=traces_kept)
+            self.slow_traces = deque(maxlen=traces_kept)
+
+    def record_span(self, name, seconds):
+        with self._lock:
+            entry = self.spans.get(name)
+            if entry is None:
+                self.spans[name] = [1, seconds, seconds]
+            else:
+                entry[0] += 1
+                entry[1] += seconds
+                if seconds > entry[2]:
+                    entry[2] = seconds
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, value):
+        with self._lock:
+            entry = self.values.get(name)
+            if entry is None:
+                self.values[name] = [1, value, value, value]
+            else:
+                entry[0] += 1
+                entry[1] += value
+                entry[2] = min(entry[2], value)
+                entry[3] = max(entry[3], value)
+
+    def record_trace(self, trace):
+        with self._lock:
+            self.recent_traces.append(trace)
+            if slow_query_ms is not None and trace["ms"] >= slow_query_ms:
+                self.slow_traces.append(trace)
+
+    def snapshot(self):
+        """
+        All metrics as a JSON serializable dict
+        """
+        with self._lock:
+            return {
+                "spans": {name: {"count": count, "seconds": total, "max_seconds": longest}
+                          for name, (count, total, longest) in sorted(self.spans.items())},
+                "counters": dict(sorted(self.counters.items())),
+                "values": {name: {"count": count, "sum": total, "min": low, "max": high, "mean": total / count}
+                           for name, (count, total, low, high) in sorted(self.values.items())},
+                "slow_traces": list(self.slow_traces),
+            }
+
+    def to_prometheus(self, prefix=prometheus_prefix):
+        """
+        All metrics in the Prometheus text exposition format
+        """
+        snapshot = self.snapshot()
+        lines = [
+            f"# HELP {prefix}_span_seconds Time spent in the instrumented sections",
+            f"# TYPE {prefix}_span_seconds summary",
+        ]
+        for name, span in snapshot["spans"].items():
+            lines.append(f'{prefix}_span_seconds_sum{{span="{name}"}} {span["seconds"]!r}')
+            lines.append(f'{prefix}_span_seconds_count{{span="{name}"}} {span["count"]}')
+        lines += [f"# HELP {prefix}_span_max_seconds Longest run of the instrumented sections",
+                  f"# TYPE {prefix}_span_max_seconds gauge"]
+        for name, span in snapshot["spans"].items():
+            lines.append(f'{prefix}_span_max_seconds{{span="{name}"}} {span["max_seconds"]!r}')
+
+        lines += [f"# HELP {prefix}_events_total Counted events", f"# TYPE {prefix}_events_total counter"]
+        for name, value in snapshot["counters"].items():
+            lines.append(f'{prefix}_events_total{{name="{name}"}} {value}')
+
+        lines += [f"# HELP {prefix}_value Observed sizes (posting lengths, result sizes)",
+                  f"# TYPE {prefix}_value summary"]
+        for name, value in snapshot["values"].items():
+            lines.append(f'{prefix}_value_sum{{name="{name}"}} {value["sum"]}')
+            lines.append(f'{prefix}_value_count{{name="{name}"}} {value["count"]}')
+        lines += [f"# HELP {prefix}_value_max Largest observed sizes", f"# TYPE {prefix}_value_max gauge"]
+        for name, value in snapshot["values"].items():
+            lines.append(f'{prefix}_value_max{{name="{name}"}} {value["max"]}')
+
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+_local = threading.local()
+
+def _stack():
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+def enable(on=True, profile=None, slow_ms=None, hook=None):
+    """
+    Turn the instrumentation on (or off with on=False).
+
+    - profile -> fraction of the queries that are profiled with cProfile
+    - slow_ms -> queries slower than this are kept in the slow traces
+    - hook -> function that is called with the trace of every query
+    """
+    global enabled, profile_rate, slow_query_ms, on_query
+    enabled = on
+    if profile is not None:
+        profile_rate = profile
+    if slow_ms is not None:
+        slow_query_ms = slow_ms
+    if hook is not None:
+        on_query = hook
+
+def disable():
+    enable(False)
+
+def span(name, **attrs):
+    """
+    Context manager that times a section: with span("index.save"): ...
+    """
+    if not enabled:
+        return _no_span
+    return Span(name, attrs)
+
+def count(name, value=1):
+    if enabled:
+        registry.count(name, value)
+
+def observe(name, value):
+    if enabled:
+        registry.observe(name, value)
+
+def query_trace(kind, q):
+    """
+    Root span of a query. Its span tree (trace) is kept in the recent traces, and
+    the query is profiled with cProfile if it is sampled (see profile_rate).
+
+        with query_trace("boolean", q):
+            ...
+    """
+    if not enabled:
+        return _no_span
+    return _QueryTrace(kind, q)
+
+class _QueryTrace:
+    __slots__ = ("_span", "_profiler")
+
+    def __init__(self, kind, q) -> None:
+        self._span = Span("query." + kind, {"query": q})
+        self._profiler = None
+
+    def __enter__(self):
+        if profile_rate and random.random() < profile_rate:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        return self._span.__enter__()
+
+    def __exit__(self, *args):
+        if self._profiler is not None:
+            self._profiler.disable()
+        self._span.__exit__(*args)
+
+        trace = self._span.to_dict()
+        if self._profiler is not None:
+            trace["profile"] = _profile_text(self._profiler)
+        if args[0] is not None:
+            trace["error"] = repr(args[1])
+        registry.record_trace(trace)
+        count(self._span.name)
+        if on_query is not None:
+            on_query(trace)
+        return False
+
+def last_trace():
+    """
+    Trace of the last query (None if there is no traced query)
+    """
+    return registry.recent_traces[-1] if registry.recent_traces else None
+
+def snapshot():
+    return registry.snapshot()
+
+def to_json(indent=None):
+    return json.dumps(registry.snapshot(), indent=indent)
+
+def to_prometheus(prefix=prometheus_prefix):
+    return registry.to_prometheus(prefix)
+
+def reset():
+    registry.reset()
+
+def export(path):
+    """
+    Write the metrics to a file, in Prometheus format for .prom / .txt files and JSON otherwise
+    """
+    with open(path, "w") as f:
+        f.write(to_prometheus() if path.endswith((".prom", ".txt")) else to_json(indent=2))
+    print(f"[Done] Metrics are written to {path}")
+
+def _profile_text(profiler):
+    """
+    The functions with the highest cumulative time in the profile
+    """
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(profile_limit)
+    return out.getvalue()
@@ -1,7 +1,15 @@
 import time
+import heapq
 import pickle
+from concurrent.futures import ProcessPoolExecutor
 
 from src.base import BaseInvertedIndex
+from src.block_sort_builder import BlockSortIndexBuilder, default_memory_budget
+from src.postings import CompressedPosting, posting_size_report, posting_cursor, gallop_ratio
+from src.disk_index import MappedDictionary, IndexFormatError, write_index, boolean_kind
+from src.instrumentation import span, count
+from src.lexicon import Lexicon
+from src.spelling import SpellingIndex
 import src.sgm_preprocessor as sp
 
 class InvertedIndex(BaseInvertedIndex):
@@ -9,80 +17,307 @@ class InvertedIndex(BaseInvertedIndex):
     Inverted Index class with high level functions.
 
     functions:
-    - build: to build a dictionary
+    - build: to build a dictionary (serial or with worker processes)
     - save: to save the dictionary
     - load: to load the saved dictionary if exist
     - merge: intersection operation
     - uninon: union operation
     - difference: difference operation
+    - universe: posting of all documents (left side of a leading NOT)
+    - spelling: spelling correction index of the terms (saved to spelling_path)
+    - size_report: memory usage of compressed postings against python lists
+
+    Posting lists are kept as CompressedPosting (varint encoded gaps).
+    The set operations walk on the postings with iterators, so they work on both
+    CompressedPosting and plain lists (e.g. older pickles).
     """
-    def __init__(self) -> None:
+    # Files of the index and the kind of the postings in binary format
+    index_path = "dictionary.idx"
+    pickle_path = "dictionary.pkl"
+    spelling_path = "spelling.bin"
+    index_kind = boolean_kind
+
+    # Posting of all document ids. Tokens are case folded, so it cannot be a token.
+    universe_term = "ALL_DOCS"
+
+    # Keys of the dictionary that are not posting lists
+    pseudo_terms = (universe_term,)
+
+    def __init__(self, workers=1, memory_budget=default_memory_budget, dataset=None) -> None:
+        """
+        - workers -> number of processes used by build. 1 means serial build.
+        - memory_budget -> max number of postings kept in memory by the (block sort) build
+        - dataset -> folder of the sgm files (sgm_preprocessor.dataset_path by default)
+        """
         super().__init__()
-        self.sgmp = sp.SGMPreprocessor()
+        self.sgmp = sp.SGMPreprocessor(dataset=dataset)
+        self.workers = workers
+        self.memory_budget = memory_budget
+
+        # It changes when the index is rebuilt or reloaded (cached query results are dropped)
+        self.generation = 0
+
+        # Spelling index of the terms, it is loaded (or computed) at the first use
+        self._spelling = None
+        self._spelling_generation = None
         
 
-    def build(self):
+    def build(self, save=True):
         """
         Building inverted intex with using SGM Preprocessor
+
+        - save -> save the index after it is built
         """
+        self.generation += 1
 
-        # First run the SGMPreprocessor to build the doc list.
-        self.sgmp.run()
+        if self.workers > 1:
+            self._parallel_build()
+            if save:
+                self.save()
+            return
 
         start_building = time.perf_counter()
 
-        for doc in self.sgmp.docs:
-            # Get the token list and append
-            tokens = self.sgmp.tokenize(doc.content)
-            tokens = list(set(tokens) - set(self.sgmp.stopwords))
-
-            for token in tokens:
-                self.add(token, doc.id)
+        # Documents are streamed from the SGMPreprocessor, so they are not kept in memory
+        N = self._index_documents(self.sgmp.iter_documents())
         
         end_building = time.perf_counter()
-        print(f"[Done] Inverted Index is builded in {end_building - start_building:0.4f} seconds")
+        print(f"[Done] Inverted Index is builded from {N} documents in {end_building - start_building:0.4f} seconds")
         
-        self.save()
+        if save:
+            self.save()
+
+    def _index_documents(self, docs):
+        """
+        Add the tokens of the given (preprocessed) documents to the dictionary.
+        The docs can be any iterable, e.g. SGMPreprocessor.iter_documents()
+
+        Returns the number of indexed documents.
+        """
+        stopwords = set(self.sgmp.stopwords)
+        builder = BlockSortIndexBuilder(self.memory_budget, positions=False)
+        lexicon = Lexicon()
+        doc_ids = []
+
+        for doc in docs:
+            doc_ids.append(doc.id)
+            # Get the token list and append
+            with span("preprocess.tokenize"):
+                tokens = self.sgmp.tokenize(doc.content)
+                tokens = list(set(tokens) - stopwords)
+
+            # The builder keeps the term ids, so a token string is kept once (in the lexicon)
+            with span("index.insert"):
+                for term_id in lexicon.add_all(tokens):
+                    builder.add(term_id, doc.id)
+            count("index.postings", len(tokens))
+
+        with span("index.finish"):
+            self._add_postings(builder, lexicon)
+            self._update(self.universe_term, CompressedPosting(sorted(doc_ids)))
+        return len(doc_ids)
+
+    def _add_postings(self, builder, lexicon):
+        """
+        Add the postings of the given BlockSortIndexBuilder (sorted by term id) to the
+        dictionary, the term ids are translated back with the lexicon of the build
+        """
+        for term_id, entries in builder.postings():
+            self._update(lexicon.term(term_id), self._posting_from_entries(entries))
+
+    def _posting_from_entries(self, entries):
+        """
+        Create the posting list from the entries of the builder. The builder of the
+        inverted index does not keep positions, so the entries are sorted doc ids.
+        """
+        return CompressedPosting(entries)
+
+    def _build_partial(self, sgm_files):
+        """
+        Parse, preprocess and index only the given sgm files.
+        Returns the partial dictionary. (It runs in a worker process)
+        """
+        self._index_documents(self.sgmp.iter_documents(sgm_files))
+        return self.dictionary
+
+    def _parallel_build(self):
+        """
+        Split the sgm files between the workers. Each worker builds a partial
+        index of its own files, then the partial indexes are merged.
+
+        Each worker gets a contiguous range of the (sorted) files, so the partial
+        postings have disjoint, ordered ranges of doc ids and they are joined
+        one after another. The ranges have similar number of files.
+        """
+        start_building = time.perf_counter()
+
+        sgm_files = self.sgmp.sgm_files()
+        workers = min(self.workers, len(sgm_files)) or 1
+        shares = [sgm_files[len(sgm_files) * i // workers:len(sgm_files) * (i + 1) // workers] for i in range(workers)]
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            partials = list(executor.map(_build_partial, [type(self)] * workers, [self.memory_budget] * workers,
+                                         [self.sgmp.dataset] * workers, shares))
+
+        self._merge_partials(partials)
+
+        end_building = time.perf_counter()
+        print(f"[Done] {type(self).__name__} is builded with {workers} workers in {end_building - start_building:0.4f} seconds")
+
+    def _merge_partials(self, partials):
+        """
+        Merge the partial dictionaries (in the order of the file ranges) into self.dictionary.
+
+        If the doc ids of each partial are bigger than the ones of the previous partial,
+        the posting lists are concatenated. Otherwise (the doc ids of the files are not
+        ordered) a k-way merge (heapq.merge) gives the sorted posting lists.
+        Both give the same posting lists as the serial build.
+        """
+        universes = [partial.pop(self.universe_term) for partial in partials]
+        universes = [universe for universe in universes if len(universe)]
+        ordered = all(universes[i].last() < next(iter(universes[i + 1])) for i in range(len(universes) - 1))
+        if ordered:
+            self._update(self.universe_term, CompressedPosting.concatenate(universes))
+        else:
+            self._update(self.universe_term, CompressedPosting(heapq.merge(*universes)))
+
+        postings = {}
+        for partial in partials:
+            for token, posting in partial.items():
+                postings.setdefault(token, []).append(posting)
+
+        for token, lists in postings.items():
+            self._update(token, self._merge_postings(lists, ordered))
+
+    def _merge_postings(self, lists, ordered=False):
+        """
+        Merge sorted posting lists of the same token into one sorted posting list
+
+        - ordered -> all doc ids of a list are smaller than the ones of the next list
+        """
+        if len(lists) == 1:
+            return lists[0]
+        if ordered:
+            return CompressedPosting.concatenate(lists)
+        return CompressedPosting(heapq.merge(*lists))
             
-    def save(self):
-        with open("dictionary.pkl", "wb") as f:
-            pickle.dump(self.dictionary, f)
-            f.close()
+    def save(self, binary=True):
+        """
+        Save the dictionary. The binary (mmap) format is used by default,
+        binary=False saves the old pickle format.
+
+        Returns the checksum of the binary index file (None for pickle).
+        """
+        checksum = None
+        with span("index.save"):
+            if binary:
+                checksum = write_index(self.index_path, self.dictionary, self.index_kind, self.pseudo_terms)
+            else:
+                with open(self.pickle_path, "wb") as f:
+                    pickle.dump(self.dictionary, f)
+                    f.close()
         print("[Done] Dictionary is saved!")
+        return checksum
 
-    def load(self) -> bool:
-        try:
-            with open("dictionary.pkl", "rb") as f:
-                self.dictionary = pickle.load(f)
-                f.close
-            print("[Done] Dictionary is loaded!")
-            return True
-        except(FileNotFoundError):
-            print("[LOG] Dictionary not found!")
-            return False
+    def load(self, verify=False) -> bool:
+        """
+        Load the saved dictionary. The binary format is preferred, it is opened
+        with mmap and postings are decoded only when they are asked.
+        If there is no binary index, the pickle is loaded.
+
+        - verify -> check the checksum of the whole binary index
+        """
+        with span("index.load"):
+            try:
+                dictionary = MappedDictionary(self.index_path, verify)
+                if dictionary.kind != self.index_kind:
+                    dictionary.close()
+                    raise IndexFormatError(f"{self.index_path} is not a {type(self).__name__}")
+                self._close_dictionary()
+                self.dictionary = dictionary
+                self.generation += 1
+                print("[Done] Dictionary is loaded!")
+                return True
+            except FileNotFoundError:
+                pass
+            except IndexFormatError as e:
+                print(f"[LOG] {e}")
+                return False
+
+            try:
+                with open(self.pickle_path, "rb") as f:
+                    dictionary = pickle.load(f)
+                self._close_dictionary()
+                self.dictionary = dictionary
+                self.generation += 1
+                print("[Done] Dictionary is loaded!")
+                return True
+            except(FileNotFoundError):
+                print("[LOG] Dictionary not found!")
+                return False
+
+    def _close_dictionary(self):
+        """
+        Close the mmap and the file of a loaded binary dictionary before it is replaced
+        """
+        if isinstance(self.dictionary, MappedDictionary):
+            self.dictionary.close()
+
+    def size_report(self):
+        """
+        Print and return the memory usage of the postings as python lists
+        and as compressed postings
+        """
+        report = posting_size_report(self.dictionary)
+        print(f"[Size] {report['ids']} ids: list form {report['list_bytes']} bytes, "
+              f"compressed form {report['compressed_bytes']} bytes ({report['ratio']:0.1f}x smaller)")
+        return report
 
     def merge(self, l, r):
         """
         Return the intersection of the left(l) and right(r) postings
 
         It represents the AND operation.
+
+        If one posting is much longer than the other one (see gallop_ratio), each id of
+        the short posting is searched in the long one with a cursor (skip pointers or
+        galloping search), so the cost depends on the short posting.
+        Otherwise a linear merge is used.
         """
-        # Initialize indexes and result as an empty list
-        # i represents the pointer of long list and j belongs to short one
-        i, j = 0, 0
+        short, long = (l, r) if len(l) < len(r) else (r, l)
+        if len(short) * gallop_ratio < len(long):
+            return self._skip_merge(short, long)
+
+        # Walk on both postings with iterators, so compressed postings
+        # are decoded lazily. x and y are the current ids.
         result = []
+        l, r = iter(l), iter(r)
+        x, y = next(l, None), next(r, None)
 
-        short, long = (l, r) if len(l) < len(r) else (r, l)
-        while i < len(long) and j < len(short):
-            if long[i] == short[j]:
-                result.append(long[i])
-                j += 1
-                i += 1
-            elif long[i] > short[j]:
-                j += 1
+        while x is not None and y is not None:
+            if x == y:
+                result.append(x)
+                x, y = next(l, None), next(r, None)
+            elif x > y:
+                y = next(r, None)
             else:
-                i += 1
-            
+                x = next(l, None)
+
+        return result
+
+    def _skip_merge(self, short, long):
+        """
+        Intersection that searches each id of the short posting in the long posting
+        """
+        result = []
+        cursor = posting_cursor(long)
+
+        for id in short:
+            doc_id = cursor.advance_to(id)
+            if doc_id is None:
+                break
+            if doc_id == id:
+                result.append(id)
 
         return result
 
@@ -92,38 +327,115 @@ class InvertedIndex(BaseInvertedIndex):
 
         It represents the OR operation.
         """
-        # Initialize indexes and result as an empty list
-        # i represents the pointer of long list and j belongs to short one
-        i, j = 0, 0
+        # Walk on both postings with iterators, so compressed postings
+        # are decoded lazily. x and y are the current ids.
         result = []
+        l, r = iter(l), iter(r)
+        x, y = next(l, None), next(r, None)
 
-        short, long = (l, r) if len(l) < len(r) else (r, l)
-
-        # This loop ends when short list traversed
-        while i < len(long) and j < len(short):
-            if long[i] <= short[j]:
-                result.append(long[i])
-                if long[i] == short[j]:
-                    j += 1
-                i += 1
+        # This loop ends when one of the postings traversed
+        while x is not None and y is not None:
+            if x <= y:
+                result.append(x)
+                if x == y:
+                    y = next(r, None)
+                x = next(l, None)
             else:
-                result.append(short[j])
-                j += 1
+                result.append(y)
+                y = next(r, None)
         
-        # We may still have elements in long or short list.
+        # We may still have elements in one of the postings.
         # These remain elements are added to result
-        return result + long[i:] + short[j:]
+        if x is not None:
+            result.append(x)
+            result.extend(l)
+        if y is not None:
+            result.append(y)
+            result.extend(r)
+        return result
 
     def difference(self, l, r):
         """
         Return the difference of the left(l) and right(r) postings
 
         It represents the NOT operation. (l-r or l/r)
+
+        Each id of l is searched in r with a cursor, so it is a linear merge
+        (and faster if r is much longer than l).
         """
-        result = l.copy()
+        result = []
+        cursor = posting_cursor(r)
 
-        for i in r:
-            if i in result:
-                result.remove(i)
+        for id in l:
+            doc_id = cursor.advance_to(id)
+            if doc_id != id:
+                result.append(id)
         
-        return result
\ No newline at end of file
+        return result
+
+    def keys(self):
+        """
+        Sorted tokens of the index (without the pseudo-terms). A loaded binary index
+        gives its lexicon as a sequence, so the tokens are not read and sorted again.
+        """
+        if isinstance(self.dictionary, MappedDictionary):
+            return self.dictionary.terms()
+        return sorted(token for token in self.dictionary.keys() if token not in self.pseudo_terms)
+
+    def df(self, token) -> int:
+        """
+        Document frequency of the token. A loaded binary index reads it from the
+        lexicon without decoding the posting.
+        """
+        if isinstance(self.dictionary, MappedDictionary):
+            return self.dictionary.df(token)
+        return len(self.get(token))
+
+    def spelling(self) -> SpellingIndex:
+        """
+        Return the spelling index of the terms (see src.spelling).
+
+        For a loaded binary index it is loaded from spelling_path, if it was made from
+        the same index file (same checksum). Otherwise it is computed from the terms,
+        and saved if the index is a loaded binary index.
+        """
+        if self._spelling is not None and self._spelling_generation == self.generation:
+            return self._spelling
+
+        checksum = self.dictionary.checksum if isinstance(self.dictionary, MappedDictionary) else None
+        spelling = None
+        if checksum is not None:
+            try:
+                with span("spelling.load"):
+                    spelling = SpellingIndex.load(self.spelling_path)
+                if spelling.source_checksum != checksum:
+                    spelling = None
+            except (FileNotFoundError, IndexFormatError) as e:
+                if not isinstance(e, FileNotFoundError):
+                    print(f"[LOG] {e}")
+
+        if spelling is None:
+            with span("spelling.compute"):
+                spelling = SpellingIndex.from_index(self)
+            if checksum is not None:
+                spelling.source_checksum = checksum
+                with span("spelling.save"):
+                    spelling.save(self.spelling_path)
+
+        self._spelling, self._spelling_generation = spelling, self.generation
+        return spelling
+
+    def universe(self):
+        """
+        Return the posting list of all documents.
+        A query that starts with NOT is evaluated as universe - posting.
+        """
+        return self.get(self.universe_term)
+
+
+def _build_partial(index_class, memory_budget, dataset, sgm_files):
+    """
+    Worker function for the parallel build.
+    It is in module level, because worker processes must be able to pickle it.
+    """
+    return index_class(memory_budget=memory_budget, dataset=dataset)._build_partial(sgm_files)
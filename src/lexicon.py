@@ -0,0 +1,86 @@
+"""
+Lexicon: dense integer ids of the terms.
+
+Every distinct term string is kept once and gets the next id (0, 1, 2, ...), so
+the structures that refer to terms (index build tuples, statistics arrays) keep
+small integers instead of repeating the strings. Ids are array indexes, the
+statistics of a term are found with one dict lookup of its string and then
+direct array access.
+"""
+
+class Lexicon:
+    """
+    Two way mapping of terms and their ids.
+
+    functions:
+    - add / add_all: id of a term, a new id is given to a new term
+    - get: id of a term, None if it is not in the lexicon
+    - term: term of an id
+    - to_bytes / from_bytes: utf-8 terms in id order, separated by \\0
+    """
+
+    def __init__(self, terms=()) -> None:
+        self._ids = {}
+        self._terms = []
+        for term in terms:
+            self.add(term)
+
+    def add(self, term) -> int:
+        term_id = self._ids.get(term)
+        if term_id is None:
+            term_id = self._ids[term] = len(self._terms)
+            self._terms.append(term)
+        return term_id
+
+    def add_all(self, terms) -> list:
+        """
+        Ids of the terms (in the same order), new terms are added
+        """
+        ids = self._ids
+        result = []
+        for term in terms:
+            term_id = ids.get(term)
+            if term_id is None:
+                term_id = ids[term] = len(self._terms)
+                self._terms.append(term)
+            result.append(term_id)
+        return result
+
+    def get(self, term, default=None):
+        return self._ids.get(term, default)
+
+    def term(self, term_id) -> str:
+        return self._terms[term_id]
+
+    def terms(self) -> list:
+        """
+        Terms in id order
+        """
+        return list(self._terms)
+
+    def to_bytes(self) -> bytes:
+        return "\x00".join(self._terms).encode("utf-8")
+
+    @classmethod
+    def from_bytes(cls, data, count=None):
+        """
+        - count -> number of terms, it is needed to tell an empty lexicon from one empty term
+        """
+        lexicon = cls()
+        if count == 0 or (count is None and not data):
+            return lexicon
+        lexicon._terms = data.decode("utf-8").split("\x00")
+        lexicon._ids = {term: term_id for term_id, term in enumerate(lexicon._terms)}
+        return lexicon
+
+    def __len__(self):
+        return len(self._terms)
+
+    def __contains__(self, term):
+        return term in self._ids
+
+    def __iter__(self):
+        return iter(self._terms)
+
+    def __eq__(self, other):
+        return isinstance(other, Lexicon) and self._terms == other._terms
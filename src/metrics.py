@@ -15,6 +15,14 @@ def cosine(v1, v2):
     cosine = prod / (len1 * len2)
     return f"{cosine:.3f}"
 
+def cosine_from_norms(prod, len1, len2):
+    """
+    Cosine similarity from the dot product and the (precomputed) lengths of two vectors.
+    It is 0 if one of the vectors is a zero vector.
+    """
+    cosine = prod / (len1 * len2) if len1 and len2 else 0
+    return f"{cosine:.3f}"
+
 def calculate_idf(N, df):
     """
     N is the total number of documents in the collection
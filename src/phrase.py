@@ -0,0 +1,151 @@
+"""
+Phrase and proximity matching over positional postings.
+
+First the documents that include all terms are found (n-ary intersection that
+drives on the shortest posting and gallops on the others). Then, for each document,
+the position lists of all terms are walked together in one linear merge.
+
+Matchers (they take the position lists of the terms in query order):
+- phrase_matches: term i is at start + i -> "crude oil price"
+- near_matches: all terms are in a window of k words, in any order -> oil NEAR/3 price
+- ordered_near_matches: terms are in query order in a window of k words -> oil ONEAR/3 price
+
+All of them return the start positions of the matches in ascending order.
+"""
+import heapq
+
+from src.postings import PositionalPosting
+
+
+def intersect(postings):
+    """
+    Generator of (doc_id, [positions of each posting]) for the documents that
+    are in all of the given PositionalPostings.
+    """
+    if not postings or min(len(posting) for posting in postings) == 0:
+        return
+
+    # Drive on the shortest posting, the others are searched with cursors
+    order = sorted(range(len(postings)), key=lambda i: len(postings[i]))
+    driver = postings[order[0]]
+    cursors = [(i, postings[i].cursor()) for i in order[1:]]
+
+    for j, doc_id in enumerate(driver.doc_ids):
+        indexes = {order[0]: j}
+        for i, cursor in cursors:
+            found = cursor.advance_to(doc_id)
+            if found is None:
+                return
+            if found != doc_id:
+                break
+            indexes[i] = cursor.index
+        else:
+            yield doc_id, [postings[i].positions(indexes[i]) for i in range(len(postings))]
+
+def phrase_matches(position_lists):
+    """
+    Start positions s where term i is at s + i for all terms.
+
+    It is the intersection of the shifted lists (positions of term i - i), so each
+    pointer only moves forward: O(total number of positions).
+    """
+    pointers = [0] * len(position_lists)
+    result = []
+
+    while True:
+        # The biggest shifted position is the candidate start
+        candidate = None
+        for i, positions in enumerate(position_lists):
+            if pointers[i] >= len(positions):
+                return result
+            shifted = positions[pointers[i]] - i
+            if candidate is None or shifted > candidate:
+                candidate = shifted
+
+        matched = True
+        for i, positions in enumerate(position_lists):
+            while pointers[i] < len(positions) and positions[pointers[i]] - i < candidate:
+                pointers[i] += 1
+            if pointers[i] >= len(positions):
+                return result
+            if positions[pointers[i]] - i != candidate:
+                matched = False
+
+        if matched:
+            result.append(candidate)
+            for i in range(len(pointers)):
+                pointers[i] += 1
+
+def near_matches(position_lists, k):
+    """
+    Start positions of the windows that include all terms in any order,
+    where last position - first position <= k.
+
+    A heap keeps the current position of each term, the smallest one is moved
+    forward at each step: O(total number of positions * log(number of terms)).
+    """
+    if any(len(positions) == 0 for positions in position_lists):
+        return []
+
+    pointers = [0] * len(position_lists)
+    heap = [(positions[0], i) for i, positions in enumerate(position_lists)]
+    heapq.heapify(heap)
+    highest = max(position for position, _ in heap)
+    result = []
+
+    while True:
+        lowest, i = heap[0]
+        if highest - lowest <= k and (not result or result[-1] != lowest):
+            result.append(lowest)
+
+        pointers[i] += 1
+        if pointers[i] >= len(position_lists[i]):
+            return result
+
+        position = position_lists[i][pointers[i]]
+        heapq.heapreplace(heap, (position, i))
+        highest = max(highest, position)
+
+def ordered_near_matches(position_lists, k):
+    """
+    Start positions s where the terms follow each other in query order
+    (s < p1 < p2 ...) and last position - s <= k.
+
+    For each start the nearest next positions are taken. They never go back when
+    the start moves forward, so every pointer only moves forward.
+    """
+    pointers = [0] * len(position_lists)
+    result = []
+
+    for start in position_lists[0]:
+        last = start
+        for i in range(1, len(position_lists)):
+            positions = position_lists[i]
+            while pointers[i] < len(positions) and positions[pointers[i]] <= last:
+                pointers[i] += 1
+            if pointers[i] >= len(positions):
+                return result
+
+            last = positions[pointers[i]]
+            if last - start > k:
+                break
+        else:
+            result.append(start)
+
+    return result
+
+def match_documents(postings, matcher):
+    """
+    Run the matcher on each document that includes all terms.
+
+    - postings -> PositionalPostings of the terms in query order
+    - matcher -> function that takes the position lists and returns match positions
+
+    Returns PositionalPosting of the matched documents with the match positions.
+    """
+    result = PositionalPosting()
+    for doc_id, position_lists in intersect(postings):
+        positions = matcher(position_lists)
+        if positions:
+            result.append(doc_id, positions)
+    return result
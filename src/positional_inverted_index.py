@@ -1,168 +1,378 @@
 import time
 import re
-from collections import Counter
+import heapq
+from bisect import bisect_left
+from operator import itemgetter
 
-from src.metrics import calculate_tf
 from src.inverted_intex import InvertedIndex
+from src.block_sort_builder import BlockSortIndexBuilder, default_memory_budget
+from src.disk_index import IndexFormatError, MappedDictionary, positional_kind
+from src.collection_statistics import CollectionStatistics
+from src.postings import CompressedPosting, PositionalPosting, posting_cursor, gallop_ratio
+from src.instrumentation import span, count
+from src.lexicon import Lexicon
 class PositionalInvertedIndex(InvertedIndex):
     """
     Positional Inverted Index class with high level functions
     
     functions:
-    - save & load functions are same with the base class
+    - save & load functions are same with the base class, the collection statistics
+      are saved to their own file (statistics_path)
+    - statistics: collection statistics for ranking (N, df/idf, document lengths and norms)
     """
+    index_path = "positional_dictionary.idx"
+    pickle_path = "positional_dictionary.pkl"
+    statistics_path = "statistics.bin"
+    spelling_path = "positional_spelling.bin"
+    index_kind = positional_kind
 
-    def __init__(self) -> None:
+    # Older index files keep the statistics as pseudo-terms
+    pseudo_terms = ("N", "tf_index", "doc_norms", "term_bounds", InvertedIndex.universe_term)
+
+    def __init__(self, workers=1, memory_budget=default_memory_budget, dataset=None) -> None:
         """
         The index shema for posiiton inverted index is like that:
         {
-            "key": [
-                "positions": [1, 4, 20],
-                "doc_id": 9001
-            ],
-            "another key": [
-                "positions": [17],
-                "doc_id": 9002
-            ]
+            "key": PositionalPosting(
+                doc_ids: [9001, 9002],
+                offsets: [0, 3, 4],
+                positions: [1, 4, 20, 17]
+            ),
+            ...
         }
+        Positions of 9001 are positions[0:3] -> [1, 4, 20], positions of 9002
+        are positions[3:4] -> [17]. (See src.postings.PositionalPosting)
         """
-        super().__init__()
+        super().__init__(workers, memory_budget, dataset)
+
+        # Number of tokens of each document, counted while indexing
+        self.doc_lengths = {}
+
+        # Collection statistics, they are loaded (or computed) at the first use
+        self._statistics = None
 
-    def build(self):
+        # Universe in the positional form, it is created at the first use
+        self._universe = None
+
+    def build(self, save=True):
         """
         Building positional inverted index with using SGM Preprocessor
-        """
 
-        self.sgmp.run()
+        - save -> save the index and its statistics after they are built
+        """
+        self.generation += 1
+        self._universe = None
 
-        # Keep a dict for store how many times occure all unique words in document.
-        # (It is for cosine similarity calculation)
-        tf_index = {}
+        if self.workers > 1:
+            self._parallel_build()
+            if save:
+                self.save()
+            return
 
         print(f"[Warning] Positional Inverted Index build is started. This take may some time..(<50 sn)")
 
         start_building = time.perf_counter()
-        for doc in self.sgmp.docs:
-            doc.content = self.sgmp.stopword_remove(doc.content)
+
+        # Documents are streamed from the SGMPreprocessor, so they are not kept in memory
+        self._index_documents(self.sgmp.iter_documents())
+        self._compute_statistics()
+
+        end_building = time.perf_counter()
+        print(f"[Done] Positional Inverted Index is builded in {end_building - start_building:0.4f} seconds")
+
+        if save:
+            self.save()
+
+    def _index_documents(self, docs):
+        """
+        Add the tokens of the given documents with their positions to the dictionary.
+        The number of tokens of each document is kept in self.doc_lengths
+
+        Returns the number of indexed documents.
+        """
+        doc_lengths = self.doc_lengths = {}
+        builder = BlockSortIndexBuilder(self.memory_budget)
+        lexicon = Lexicon()
+        doc_ids = []
+
+        for doc in docs:
+            doc_ids.append(doc.id)
 
             # Get the token list and append
-            tokens = self.sgmp.tokenize(doc.content)
+            with span("preprocess.tokenize"):
+                doc.content = self.sgmp.stopword_remove(doc.content)
+                tokens = self.sgmp.tokenize(doc.content)
+
+            # The builder keeps the term ids, so a token string is kept once (in the lexicon)
+            with span("index.insert"):
+                for position, term_id in enumerate(lexicon.add_all(tokens)):
+                    builder.add(term_id, doc.id, position)
+            doc_lengths[doc.id] = len(tokens)
+            count("index.postings", len(tokens))
+
+        with span("index.finish"):
+            self._add_postings(builder, lexicon)
+            self._update(self.universe_term, CompressedPosting(sorted(doc_ids)))
+        return len(doc_ids)
 
-            c = Counter(tokens)
-            for position, token in enumerate(tokens):
-                self.add(token, {"positions": [position], "doc_id": doc.id})
+    def _posting_from_entries(self, entries):
+        """
+        This is a function that overrides the _posting_from_entries function from base class(InvertedIndex)
+        """
+        return PositionalPosting.from_entries(entries)
+
+    def postings(self):
+        """
+        (token, posting) pairs of the index without the pseudo-terms
+        """
+        return ((token, posting) for token, posting in self.dictionary.items() if token not in self.pseudo_terms)
 
-                if token in c.elements():
-                    if doc.id in tf_index.keys():
-                        token_dict = tf_index[doc.id]
-                        token_dict[token] = calculate_tf(c[token])
+    def _compute_statistics(self):
+        """
+        Compute the collection statistics after the postings are built
+        """
+        N = len(self.get(self.universe_term))
+        with span("statistics.compute"):
+            self._statistics = CollectionStatistics.from_postings(self.postings(), N, self.doc_lengths)
+
+    def save(self, binary=True):
+        """
+        This is a function that overrides the save function from base class(InvertedIndex)
+
+        The collection statistics are saved to their own file, with the checksum of the
+        binary index file, so they are used only with this index file.
+        """
+        checksum = super().save(binary)
+        if self._statistics is not None:
+            self._statistics.source_checksum = checksum or 0
+            with span("statistics.save"):
+                self._statistics.save(self.statistics_path)
+        return checksum
+
+    def load(self, verify=False) -> bool:
+        """
+        This is a function that overrides the load function from base class(InvertedIndex)
+
+        The statistics and the universe of the loaded index are created at the first use.
+        """
+        self._statistics = None
+        self._universe = None
+        return super().load(verify)
+
+    def statistics(self):
+        """
+        Return the collection statistics. They are loaded from statistics_path at the
+        first call, if they were saved with the loaded binary index file (same checksum).
+        Otherwise (no valid file, statistics of another index, pickle index) they are
+        computed from the postings, and saved if the index is a loaded binary index.
+        """
+        if self._statistics is None:
+            checksum = self.dictionary.checksum if isinstance(self.dictionary, MappedDictionary) else None
+            if checksum is not None:
+                try:
+                    with span("statistics.load"):
+                        statistics = CollectionStatistics.load(self.statistics_path)
+                    if statistics.source_checksum == checksum:
+                        self._statistics = statistics
                     else:
-                        token_dict = {token:calculate_tf(c[token])}
-                    tf_index[doc.id] = token_dict
+                        print(f"[LOG] {self.statistics_path} belongs to another index, the statistics are computed again")
+                except (FileNotFoundError, IndexFormatError) as e:
+                    if not isinstance(e, FileNotFoundError):
+                        print(f"[LOG] {e}")
 
-        self.add("N", len(self.sgmp.docs))
-        self.add("tf_index", tf_index)
-        end_building = time.perf_counter()
-        print(f"[Done] Positional Inverted Index is builded in {end_building - start_building:0.4f} seconds")
+            if self._statistics is None:
+                with span("statistics.compute"):
+                    self._statistics = CollectionStatistics.from_postings(self.postings(), len(self.universe()))
+                if checksum is not None:
+                    self._statistics.source_checksum = checksum
+                    self._statistics.save(self.statistics_path)
+        return self._statistics
+
+    def _build_partial(self, sgm_files):
+        """
+        This is a function that overrides the _build_partial function from base class(InvertedIndex)
+
+        Returns the partial dictionary with the lengths of its documents.
+        """
+        self._index_documents(self.sgmp.iter_documents(sgm_files))
+        return self.dictionary, self.doc_lengths
+
+    def _merge_partials(self, partials):
+        """
+        This is a function that overrides the _merge_partials function from base class(InvertedIndex)
+
+        Document lengths are joined, postings are merged as usual. Then the statistics
+        are computed, they need the idf values of the whole collection.
+        """
+        doc_lengths = {}
+        for _, lengths in partials:
+            doc_lengths.update(lengths)
+
+        super()._merge_partials([dictionary for dictionary, _ in partials])
+        self.doc_lengths = doc_lengths
+        self._compute_statistics()
 
-        self.save()
+    def _merge_postings(self, lists, ordered=False):
+        """
+        This is a function that overrides the _merge_postings function from base class(InvertedIndex)
+        """
+        if len(lists) == 1:
+            return lists[0]
+        if ordered:
+            return PositionalPosting.concatenate(lists)
+        return PositionalPosting.from_entries(heapq.merge(*lists, key=itemgetter(0)))
     
+    def add(self, token, value) -> None:
+        """
+        This is a function that overrides the add function from base class(BaseInvertedIndex)
+
+        - value -> a dict has include positions and doc_id
+        """
+        if token in self.dictionary.keys():
+            self._insert(token, value)
+        else:
+            self._update(token, PositionalPosting.from_entries([(value.get("doc_id"), value.get("positions"))]))
+
     def _insert(self, key, value):
         """
         This is a function that overrides the _insert function from base class(BaseInvertedIndex)
 
         - key 
-        - value -> a dict has include position and doc_id
+        - value -> a dict has include positions and doc_id
         """
-        # posting is like -> [{"positions":[1], "doc_id":4}, {"positions":[5], "doc_id":8}]
         posting = self.dictionary.get(key)
-        
-        # Find the index that showing where this id should be added
-        start = 0
-        end = len(posting) - 1
-        the_index = -1
+        doc_id = value.get("doc_id")
 
-        while start <= end:
-            middle = int((start+end)/2)
+        # A new last document is appended to the arrays. Otherwise the positions of an existing
+        # document are extended or the document is added to its sorted place, and the arrays are rebuilt.
+        i = bisect_left(posting.doc_ids, doc_id)
+        if i == len(posting.doc_ids):
+            posting.append(doc_id, value.get("positions"))
+            return
 
-            if posting[middle].get("doc_id") == value.get("doc_id"):
-                the_index = middle
-                break
-            elif posting[middle].get("doc_id") > value.get("doc_id"):
-                end = middle - 1
-            else:
-                start = middle + 1
-
-        if the_index == -1:
-            posting.insert(start, value)
+        entries = list(posting)
+        if entries[i][0] == doc_id:
+            entries[i] = (doc_id, list(entries[i][1]) + list(value.get("positions")))
         else:
-            posting[the_index].get("positions").extend(value.get("positions"))
+            entries.insert(i, (doc_id, value.get("positions")))
+
+        self._update(key, PositionalPosting.from_entries(entries))
+
+    def get(self, token):
+        """
+        This is a function that overrides the get function from base class(BaseInvertedIndex)
 
+        An empty PositionalPosting is returned for an unknown token.
+        """
+        value = self.dictionary.get(token)
+        return value if value is not None else PositionalPosting()
 
     def merge(self, l, r):
         """
         This is a function that overrides the merge function from base class(InvertedIndex)
+
+        Returns (doc_id, left positions, right positions) tuples of the common documents.
+        The common documents are found with a linear merge, or with galloping search
+        if one posting is much longer than the other one (see gallop_ratio).
         """
-        # Initialize indexes and result as an empty list
-        # i represents the pointer of long list and j belongs to short one
-        i, j = 0, 0
+        short, long = (l, r) if len(l) < len(r) else (r, l)
+        if len(short) * gallop_ratio < len(long):
+            pairs = self._skip_pairs(short, long)
+        else:
+            pairs = self._linear_pairs(short, long)
+
         result = []
+        for i, j in pairs:
+            left, right = (i, j) if short is l else (j, i)
+            result.append((l.doc_ids[left], l.positions(left), r.positions(right)))
 
-        short, long = (l, r) if len(l) < len(r) else (r, l)
-        while i < len(long) and j < len(short):
-            if long[i].get("doc_id") == short[j].get("doc_id"):
-                if len(l) < len(r):
-                    result_dict = {
-                        "left": short[j].get("positions"),
-                        "right": long[i].get("positions"),
-                        "doc_id": long[i].get("doc_id")
-                    }
-                else:
-                    result_dict = {
-                        "left": long[i].get("positions"),
-                        "right": short[j].get("positions"),
-                        "doc_id": long[i].get("doc_id")
-                    }
-                result.append(result_dict)
+        return result
+
+    def _linear_pairs(self, short, long):
+        """
+        Generator of the (short index, long index) pairs that have the same doc id
+        """
+        # i represents the pointer of long list and j belongs to short one
+        i, j = 0, 0
+        short_ids, long_ids = short.doc_ids, long.doc_ids
+        while i < len(long_ids) and j < len(short_ids):
+            if long_ids[i] == short_ids[j]:
+                yield j, i
                 j += 1
                 i += 1
-            elif long[i].get("doc_id") > short[j].get("doc_id"):
+            elif long_ids[i] > short_ids[j]:
                 j += 1
             else:
                 i += 1
 
-        return result
+    def _skip_pairs(self, short, long):
+        """
+        Generator of the (short index, long index) pairs that have the same doc id.
+        The doc ids of the short posting are searched in the long one with galloping search.
+        """
+        cursor = long.cursor()
+        for j, id in enumerate(short.doc_ids):
+            doc_id = cursor.advance_to(id)
+            if doc_id is None:
+                break
+            if doc_id == id:
+                yield j, cursor.index
     
     def union(self, l, r):
         """
         This is a function that overrides the union function from base class(InvertedIndex)
+
+        If a document is in both postings, the positions of the longer posting are kept.
         """
-        # Initialize indexes and result as an empty list
+        # Initialize indexes and result as an empty posting
         # i represents the pointer of long list and j belongs to short one
         i, j = 0, 0
-        result = []
+        result = PositionalPosting()
 
         short, long = (l, r) if len(l) < len(r) else (r, l)
+        short_ids, long_ids = short.doc_ids, long.doc_ids
 
         # This loop ends when short list traversed
-        while i < len(long) and j < len(short):
-            if long[i].get("doc_id") <= short[j].get("doc_id"):
-                result.append(long[i])
-                if long[i].get("doc_id") == short[j].get("doc_id"):
+        while i < len(long_ids) and j < len(short_ids):
+            if long_ids[i] <= short_ids[j]:
+                result.append(long_ids[i], long.positions(i))
+                if long_ids[i] == short_ids[j]:
                     j += 1
                 i += 1
             else:
-                result.append(short[j])
+                result.append(short_ids[j], short.positions(j))
                 j += 1
         
         # We may still have elements in long or short list.
         # These remain elements are added to result
-        return result + long[i:] + short[j:]
+        for k in range(i, len(long_ids)):
+            result.append(long_ids[k], long.positions(k))
+        for k in range(j, len(short_ids)):
+            result.append(short_ids[k], short.positions(k))
+        return result
     
     def difference(self, l, r):
         """
         This is a function that overrides the difference function from base class(InvertedIndex)
+
+        The documents of l that are not in r are kept with their positions.
         """
-        pass
-        
+        result = PositionalPosting()
+        cursor = posting_cursor(r)
+
+        for i, id in enumerate(l.doc_ids):
+            doc_id = cursor.advance_to(id)
+            if doc_id != id:
+                result.append(id, l.positions(i))
 
+        return result
+
+    def universe(self):
+        """
+        This is a function that overrides the universe function from base class(InvertedIndex)
+
+        All documents as a positional posting without positions.
+        """
+        if self._universe is None:
+            self._universe = PositionalPosting.from_doc_ids(super().universe())
+        return self._universe
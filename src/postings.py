@@ -0,0 +1,507 @@
+"""
+Compact posting list representation for the inverted index.
+
+Document ids of a posting list are sorted, so only the gaps between them are
+stored. Each gap is encoded with variable-byte (varint) encoding: 7 bits of the
+gap per byte and the high bit shows that more bytes follow. Most of the gaps fit
+to one byte, instead of a boxed int (28 bytes) and a list slot (8 bytes).
+
+Skip pointers:
+Every skip_interval ids, a skip pointer keeps the byte offset of the block and
+the id before it (base of the first gap). A cursor can jump over the blocks
+whose ids are smaller than the target without decoding them.
+
+Functions:
+- encode_gaps: sorted ids -> varint encoded gaps
+- decode_gaps: varint encoded gaps -> generator of ids (lazy)
+- posting_cursor: cursor with next() and advance_to() for any posting list
+- posting_size_report: compares list and compressed forms of a dictionary
+"""
+import sys
+from array import array
+from bisect import bisect_left
+
+"""
+Here are some global variables
+"""
+skip_interval = 64 # number of ids between two skip pointers
+gallop_ratio = 16 # intersections use advance_to if the long posting is this times longer
+
+
+def encode_gaps(ids, skips=None):
+    """
+    Encode the given sorted ids as varint gaps.
+    Returns the encoded bytes and the number of ids.
+
+    - skips -> optional (bases, offsets) arrays, the skip pointers are appended to them
+    """
+    data = bytearray()
+    last = 0
+    length = 0
+
+    for id in ids:
+        if skips is not None and length and length % skip_interval == 0:
+            skips[0].append(last)
+            skips[1].append(len(data))
+
+        gap = id - last
+        last = id
+        length += 1
+
+        while gap >= 0x80:
+            data.append((gap & 0x7F) | 0x80)
+            gap >>= 7
+        data.append(gap)
+
+    return bytes(data), length
+
+def decode_gaps(data):
+    """
+    Generator that decodes the varint gaps in the given bytes to ids one by one
+    """
+    value, shift, last = 0, 0, 0
+
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            last += value
+            yield last
+            value, shift = 0, 0
+
+def _first_gap(data):
+    """
+    (first gap, number of its bytes) of the varint encoded gaps
+    """
+    value, shift = 0, 0
+    for i, byte in enumerate(data):
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, i + 1
+        shift += 7
+    raise ValueError("Truncated varint")
+
+def _skip_array(data=b""):
+    """
+    Array of skip values, it is stored in little endian order
+    """
+    values = array("I")
+    values.frombytes(data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+def _skip_bytes(values):
+    if sys.byteorder == "big":
+        values = array("I", values)
+        values.byteswap()
+    return values.tobytes()
+
+class CompressedPosting:
+    """
+    Posting list that keeps sorted document ids as varint encoded gaps.
+
+    It is decoded lazily while iterating, so the intersection, union and
+    difference operations can walk on it without creating a list.
+    Pickle keeps only the encoded bytes and the skip pointers.
+
+    Usage:
+    - len(posting) -> number of ids, O(1)
+    - iter(posting) -> ids in ascending order
+    - posting.cursor() -> cursor that uses skip pointers in advance_to
+    - posting.tolist() -> list of ids
+    """
+    __slots__ = ("_data", "_length", "_skip_bases", "_skip_offsets")
+
+    def __init__(self, ids=()) -> None:
+        self._skip_bases, self._skip_offsets = _skip_array(), _skip_array()
+        self._data, self._length = encode_gaps(ids, (self._skip_bases, self._skip_offsets))
+
+    @classmethod
+    def from_bytes(cls, data, length, skip_data=b""):
+        """
+        Create the posting from already encoded bytes and skip pointers(see skip_data)
+        """
+        posting = cls.__new__(cls)
+        posting._data = data
+        posting._length = length
+        half = len(skip_data) // 2
+        posting._skip_bases = _skip_array(skip_data[:half])
+        posting._skip_offsets = _skip_array(skip_data[half:])
+        return posting
+
+    @classmethod
+    def concatenate(cls, postings):
+        """
+        Join postings whose ids are in ascending order one after another (every id of a
+        posting is smaller than the ids of the next one), e.g. the partial postings of
+        the workers that index contiguous ranges of documents.
+
+        The encoded bytes are copied, only the first gap of each posting is encoded again.
+        The skip pointers are moved and a skip pointer is added at each joint.
+        """
+        data = bytearray()
+        bases, offsets = _skip_array(), _skip_array()
+        length, last = 0, 0
+
+        for posting in postings:
+            if not posting._length:
+                continue
+            first, size = _first_gap(posting._data)
+            if length and first <= last:
+                raise ValueError("The postings are not in ascending order")
+
+            if length:
+                bases.append(last)
+                offsets.append(len(data))
+            # The first gap is relative to the last id of the previous posting
+            data.extend(encode_gaps([first - last])[0])
+            shift = len(data) - size
+            data.extend(memoryview(posting._data)[size:])
+
+            bases.extend(posting._skip_bases)
+            offsets.extend(offset + shift for offset in posting._skip_offsets)
+            length += posting._length
+            last = posting.last()
+
+        result = cls.__new__(cls)
+        result._data, result._length = bytes(data), length
+        result._skip_bases, result._skip_offsets = bases, offsets
+        return result
+
+    @property
+    def data(self):
+        return self._data
+
+    def last(self):
+        """
+        The biggest id of the posting (None if it is empty).
+        Only the block after the last skip pointer is decoded.
+        """
+        if not self._length:
+            return None
+        base, offset = (self._skip_bases[-1], self._skip_offsets[-1]) if self._skip_bases else (0, 0)
+        for last in decode_gaps(memoryview(self._data)[offset:]):
+            pass
+        return base + last
+
+    @property
+    def skip_data(self):
+        """
+        Skip pointers as bytes: all bases, then all offsets
+        """
+        return _skip_bytes(self._skip_bases) + _skip_bytes(self._skip_offsets)
+
+    def cursor(self):
+        return CompressedCursor(self)
+
+    def tolist(self):
+        return list(decode_gaps(self._data))
+
+    def nbytes(self):
+        """
+        Memory usage of the posting in bytes
+        """
+        return (sys.getsizeof(self) + sys.getsizeof(self._data)
+                + sys.getsizeof(self._skip_bases) + sys.getsizeof(self._skip_offsets))
+
+    def __iter__(self):
+        return decode_gaps(self._data)
+
+    def __len__(self):
+        return self._length
+
+    def __eq__(self, other):
+        if isinstance(other, CompressedPosting):
+            return self._data == other._data
+        try:
+            return self.tolist() == list(other)
+        except TypeError:
+            return NotImplemented
+
+    def __repr__(self):
+        return repr(self.tolist())
+
+    def __reduce__(self):
+        return (CompressedPosting.from_bytes, (self._data, self._length, self.skip_data))
+
+class CompressedCursor:
+    """
+    Cursor on a CompressedPosting.
+
+    - doc_id -> the current id (None if the posting is finished)
+    - next() -> move to the next id
+    - advance_to(target) -> move to the first id >= target with skip pointers
+    """
+    __slots__ = ("_data", "_bases", "_offsets", "_i", "_last", "doc_id")
+
+    def __init__(self, posting) -> None:
+        self._data = posting._data
+        self._bases = posting._skip_bases
+        self._offsets = posting._skip_offsets
+        self._i = 0 # index of the next byte
+        self._last = 0
+        self.doc_id = None
+        self.next()
+
+    @property
+    def value(self):
+        return self.doc_id
+
+    def next(self):
+        data, i = self._data, self._i
+        if i >= len(data):
+            self.doc_id = None
+            return None
+
+        value, shift = 0, 0
+        while True:
+            byte = data[i]
+            i += 1
+            value |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                break
+            shift += 7
+
+        self._i = i
+        self._last += value
+        self.doc_id = self._last
+        return self.doc_id
+
+    def advance_to(self, target):
+        if self.doc_id is None or self.doc_id >= target:
+            return self.doc_id
+
+        # Jump to the last block that starts before the target,
+        # if it is after the current position
+        k = bisect_left(self._bases, target) - 1
+        if k >= 0 and self._offsets[k] > self._i:
+            self._i = self._offsets[k]
+            self._last = self._bases[k]
+            self.next()
+
+        while self.doc_id is not None and self.doc_id < target:
+            self.next()
+        return self.doc_id
+
+class ListCursor:
+    """
+    Cursor on a sorted python list (or array). advance_to uses galloping (exponential)
+    search and then binary search, so it costs O(log d) for a jump of d items.
+
+    - key -> function that gives the doc id of an item
+    - value -> the current item of the list
+    - index -> the index of the current item
+    """
+    __slots__ = ("_posting", "_key", "_i")
+
+    def __init__(self, posting, key=None) -> None:
+        self._posting = posting
+        self._key = key
+        self._i = 0
+
+    @property
+    def value(self):
+        return self._posting[self._i] if self._i < len(self._posting) else None
+
+    @property
+    def index(self):
+        return self._i
+
+    @property
+    def doc_id(self):
+        if self._i >= len(self._posting):
+            return None
+        item = self._posting[self._i]
+        return self._key(item) if self._key else item
+
+    def next(self):
+        self._i += 1
+        return self.doc_id
+
+    def advance_to(self, target):
+        posting, key, i = self._posting, self._key, self._i
+        n = len(posting)
+
+        # Gallop until an item >= target is passed
+        bound = 1
+        while i + bound < n and (key(posting[i + bound]) if key else posting[i + bound]) < target:
+            bound *= 2
+
+        # The item at i + bound // 2 was smaller than target
+        low = i + bound // 2 if bound > 1 else i
+        self._i = bisect_left(posting, target, low, min(i + bound + 1, n), key=key)
+        return self.doc_id
+
+class PositionalPosting:
+    """
+    Compact positional posting list.
+
+    Instead of a dict per document, three arrays are kept:
+    - doc_ids -> sorted document ids
+    - offsets -> positions of doc_ids[i] are positions[offsets[i]:offsets[i + 1]]
+    - positions -> positions of all documents, one after another
+
+    Iterating gives (doc_id, positions) tuples.
+    """
+    __slots__ = ("doc_ids", "offsets", "_positions")
+
+    def __init__(self) -> None:
+        self.doc_ids = array("I")
+        self.offsets = array("I", [0])
+        self._positions = array("I")
+
+    @classmethod
+    def from_entries(cls, entries):
+        """
+        Create the posting from (doc_id, positions) entries that are sorted by doc_id
+        """
+        posting = cls()
+        for doc_id, positions in entries:
+            posting.append(doc_id, positions)
+        return posting
+
+    @classmethod
+    def from_doc_ids(cls, doc_ids):
+        """
+        Create the posting from sorted doc ids without positions
+        """
+        posting = cls()
+        posting.doc_ids.extend(doc_ids)
+        posting.offsets.extend([0] * len(posting.doc_ids))
+        return posting
+
+    @classmethod
+    def concatenate(cls, postings):
+        """
+        Join postings whose doc ids are in ascending order one after another
+        (see CompressedPosting.concatenate), the arrays are copied without iterating the entries
+        """
+        posting = cls()
+        for other in postings:
+            if not len(other):
+                continue
+            if len(posting) and other.doc_ids[0] <= posting.doc_ids[-1]:
+                raise ValueError("The postings are not in ascending order")
+            shift = len(posting._positions) - other.offsets[0]
+            posting.doc_ids.extend(other.doc_ids)
+            posting._positions.extend(other._positions[other.offsets[0]:other.offsets[-1]])
+            posting.offsets.extend(offset + shift for offset in other.offsets[1:])
+        return posting
+
+    @classmethod
+    def from_arrays(cls, doc_ids, offsets, positions):
+        posting = cls.__new__(cls)
+        posting.doc_ids, posting.offsets, posting._positions = doc_ids, offsets, positions
+        return posting
+
+    def append(self, doc_id, positions):
+        """
+        Append a document to the end of the posting. doc_id must be bigger than the last one.
+        """
+        self.doc_ids.append(doc_id)
+        self._positions.extend(positions)
+        self.offsets.append(len(self._positions))
+
+    def positions(self, i):
+        """
+        Positions of the i-th document of the posting
+        """
+        return self._positions[self.offsets[i]:self.offsets[i + 1]]
+
+    def find(self, doc_id):
+        """
+        Index of the given doc id in the posting (binary search), -1 if not exists
+        """
+        i = bisect_left(self.doc_ids, doc_id)
+        return i if i < len(self.doc_ids) and self.doc_ids[i] == doc_id else -1
+
+    def cursor(self):
+        return ListCursor(self.doc_ids)
+
+    def to_dicts(self):
+        """
+        The old dict form: [{"positions": [...], "doc_id": n}, ...]
+        """
+        return [{"positions": positions.tolist(), "doc_id": doc_id} for doc_id, positions in self]
+
+    def nbytes(self):
+        return (sys.getsizeof(self) + sys.getsizeof(self.doc_ids)
+                + sys.getsizeof(self.offsets) + sys.getsizeof(self._positions))
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def __iter__(self):
+        for i, doc_id in enumerate(self.doc_ids):
+            yield doc_id, self.positions(i)
+
+    def __eq__(self, other):
+        if not isinstance(other, PositionalPosting):
+            return NotImplemented
+        return (self.doc_ids == other.doc_ids and self.offsets == other.offsets
+                and self._positions == other._positions)
+
+    def __repr__(self):
+        return repr(self.to_dicts())
+
+    def __reduce__(self):
+        return (PositionalPosting.from_arrays, (self.doc_ids, self.offsets, self._positions))
+
+def posting_cursor(posting, key=None):
+    """
+    Return a cursor for the given posting (CompressedPosting, PositionalPosting or sorted list)
+    """
+    if isinstance(posting, (CompressedPosting, PositionalPosting)):
+        return posting.cursor()
+    return ListCursor(posting if isinstance(posting, list) else list(posting), key)
+
+def _dicts_size(posting):
+    """
+    Memory usage of the old dict form of a PositionalPosting
+    """
+    size = 0
+    dicts = posting.to_dicts()
+    size += sys.getsizeof(dicts)
+    for entry in dicts:
+        positions = entry["positions"]
+        size += sys.getsizeof(entry) + sys.getsizeof(positions) + sys.getsizeof(entry["doc_id"])
+        size += sum(sys.getsizeof(position) for position in positions)
+    return size
+
+def posting_size_report(dictionary):
+    """
+    Compare the memory usage of the postings in the given dictionary
+    as python lists of ints and as CompressedPosting.
+    Positional postings are compared as list of dicts and as PositionalPosting.
+
+    Returns a dict with the byte counts.
+    """
+    list_bytes = 0
+    compressed_bytes = 0
+    ids = 0
+
+    for posting in dictionary.values():
+        if isinstance(posting, PositionalPosting):
+            ids += len(posting)
+            list_bytes += _dicts_size(posting)
+            compressed_bytes += posting.nbytes()
+            continue
+
+        if not isinstance(posting, CompressedPosting):
+            if not all(isinstance(id, int) for id in posting):
+                continue
+            posting = CompressedPosting(posting)
+
+        as_list = posting.tolist()
+        ids += len(as_list)
+        list_bytes += sys.getsizeof(as_list) + sum(sys.getsizeof(id) for id in as_list)
+        compressed_bytes += posting.nbytes()
+
+    return {
+        "ids": ids,
+        "list_bytes": list_bytes,
+        "compressed_bytes": compressed_bytes,
+        "ratio": list_bytes / compressed_bytes if compressed_bytes else 0,
+    }
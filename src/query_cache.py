@@ -0,0 +1,145 @@
+"""
+Result cache of the query processors.
+
+The key is the normalized form of a query (its type and the tokens after
+preprocessing), so "Oil  AND price" and "oil AND price" share one entry.
+Entries are evicted in LRU order when the number of entries or their
+(approximate) size in bytes is over the limit. Every entry keeps the scope (the
+index it was computed from, e.g. id(index)) and the generation of that index. When
+an index is rebuilt or reloaded (its generation changes) only the entries of its
+scope are dropped, so processors of other indexes can share the cache.
+"""
+import sys
+import time
+from collections import OrderedDict
+
+class QueryCache:
+    """
+    LRU cache of query results with optional TTL and hit/miss counters.
+
+    - get(key, generation, scope) -> cached result or None
+    - put(key, result, generation, scope)
+    - stats() -> counters
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=None, ttl=None, clock=time.monotonic) -> None:
+        """
+        - max_entries -> max number of cached queries (None for no limit)
+        - max_bytes -> max approximate size of the cached results (None for no limit)
+        - ttl -> seconds an entry is valid (None for no expiry)
+        - clock -> function that returns the current time in seconds
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._clock = clock
+
+        # (scope, key) -> (result, size, expiry time)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        # scope -> generation of its entries
+        self._generations = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key, generation=0, scope=None):
+        """
+        Return the cached result of the key or None.
+        A generation different from the cached one of the scope drops the entries of the scope.
+        """
+        self._check_generation(scope, generation)
+
+        key = (scope, key)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        result, _, expiry = entry
+        if expiry is not None and self._clock() >= expiry:
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return result
+
+    def put(self, key, result, generation=0, scope=None):
+        """
+        Cache the result of the key, then evict the least recently used entries
+        until the limits are met. A result bigger than max_bytes is not cached.
+        """
+        self._check_generation(scope, generation)
+        key = (scope, key)
+
+        size = _result_size(result)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+
+        if key in self._entries:
+            self._remove(key)
+        expiry = self._clock() + self.ttl if self.ttl is not None else None
+        self._entries[key] = (result, size, expiry)
+        self._bytes += size
+
+        while ((self.max_entries is not None and len(self._entries) > self.max_entries)
+               or (self.max_bytes is not None and self._bytes > self.max_bytes)):
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+        self._generations.clear()
+
+    def stats(self):
+        """
+        Counters of the cache
+        """
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return (None, key) in self._entries
+
+    def _check_generation(self, scope, generation):
+        if self._generations.get(scope, generation) != generation:
+            stale = [key for key in self._entries if key[0] == scope]
+            if stale:
+                self.invalidations += 1
+            for key in stale:
+                self._remove(key)
+        self._generations[scope] = generation
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+def _result_size(result):
+    """
+    Approximate size of a result list in bytes (the list and its items)
+    """
+    size = sys.getsizeof(result)
+    for item in result:
+        size += sys.getsizeof(item)
+        if isinstance(item, dict):
+            size += sum(sys.getsizeof(value) for value in item.values())
+    return size
@@ -0,0 +1,177 @@
+"""
+Document at a time evaluation of the boolean queries.
+
+A query tree is turned into a tree of cursors. The leaves are the cursors of the
+postings (src.postings), and every node is a cursor with the same interface:
+- doc_id -> the current document (None if the cursor is finished)
+- next() -> move to the next document
+- advance_to(target) -> move to the first document >= target
+
+The documents come out one by one in ascending order, so the first page of a
+result is found without creating the whole result. The memory of a query depends
+on the page size and the skipped documents are never collected.
+
+Usage:
+    page(AndCursor([posting_cursor(oil), posting_cursor(price)]), offset=20, limit=10)
+"""
+import heapq
+
+class EmptyCursor:
+    """
+    Cursor without documents
+    """
+    doc_id = None
+
+    def next(self):
+        return None
+
+    def advance_to(self, target):
+        return None
+
+class AndCursor:
+    """
+    Documents that are in all cursors (intersection).
+
+    The cursors leapfrog: each one is advanced to the current candidate, a cursor
+    that passes the candidate gives the next candidate. The rarest cursor should be
+    the first one, so the others mostly jump with advance_to.
+    """
+    __slots__ = ("_cursors", "doc_id")
+
+    def __init__(self, cursors) -> None:
+        self._cursors = cursors
+        self.doc_id = None
+        self._align(cursors[0].doc_id)
+
+    def _align(self, target):
+        """
+        Move all cursors to the first document >= target that is in all of them
+        """
+        cursors = self._cursors
+        while target is not None:
+            for cursor in cursors:
+                doc_id = cursor.advance_to(target)
+                if doc_id is None or doc_id > target:
+                    target = doc_id
+                    break
+            else:
+                break
+        self.doc_id = target
+        return target
+
+    def next(self):
+        if self.doc_id is None:
+            return None
+        return self._align(self.doc_id + 1)
+
+    def advance_to(self, target):
+        if self.doc_id is None or self.doc_id >= target:
+            return self.doc_id
+        return self._align(target)
+
+class OrCursor:
+    """
+    Documents that are in any cursor (union). The cursors are kept in a heap by their
+    current document, only the cursors behind the target are moved.
+    """
+    __slots__ = ("_heap", "doc_id")
+
+    def __init__(self, cursors) -> None:
+        # The index i breaks the ties, so the cursors are never compared
+        self._heap = [(cursor.doc_id, i, cursor) for i, cursor in enumerate(cursors) if cursor.doc_id is not None]
+        heapq.heapify(self._heap)
+        self.doc_id = self._heap[0][0] if self._heap else None
+
+    def next(self):
+        """
+        The cursors of the current document move to their next document
+        """
+        if self.doc_id is None:
+            return None
+
+        heap, current = self._heap, self.doc_id
+        while heap and heap[0][0] == current:
+            _, i, cursor = heap[0]
+            doc_id = cursor.next()
+            if doc_id is None:
+                heapq.heappop(heap)
+            else:
+                heapq.heapreplace(heap, (doc_id, i, cursor))
+        self.doc_id = heap[0][0] if heap else None
+        return self.doc_id
+
+    def advance_to(self, target):
+        if self.doc_id is None or self.doc_id >= target:
+            return self.doc_id
+
+        heap = self._heap
+        while heap and heap[0][0] < target:
+            _, i, cursor = heap[0]
+            doc_id = cursor.advance_to(target)
+            if doc_id is None:
+                heapq.heappop(heap)
+            else:
+                heapq.heapreplace(heap, (doc_id, i, cursor))
+        self.doc_id = heap[0][0] if heap else None
+        return self.doc_id
+
+class DifferenceCursor:
+    """
+    Documents of the cursor that are not in the excluded cursor
+    """
+    __slots__ = ("_cursor", "_excluded", "doc_id")
+
+    def __init__(self, cursor, excluded) -> None:
+        self._cursor = cursor
+        self._excluded = excluded
+        self.doc_id = None
+        self._skip_excluded(cursor.doc_id)
+
+    def _skip_excluded(self, doc_id):
+        while doc_id is not None and self._excluded.advance_to(doc_id) == doc_id:
+            doc_id = self._cursor.next()
+        self.doc_id = doc_id
+        return doc_id
+
+    def next(self):
+        if self.doc_id is None:
+            return None
+        return self._skip_excluded(self._cursor.next())
+
+    def advance_to(self, target):
+        if self.doc_id is None or self.doc_id >= target:
+            return self.doc_id
+        return self._skip_excluded(self._cursor.advance_to(target))
+
+def union_cursor(cursors):
+    """
+    Union of the cursors, without an OrCursor for only one cursor
+    """
+    if not cursors:
+        return EmptyCursor()
+    return cursors[0] if len(cursors) == 1 else OrCursor(cursors)
+
+def page(cursor, offset=0, limit=None):
+    """
+    The documents of the cursor after the first offset ones, at most limit of them (None -> all)
+    """
+    for _ in range(offset):
+        if cursor.doc_id is None:
+            return []
+        cursor.next()
+
+    result = []
+    while cursor.doc_id is not None and (limit is None or len(result) < limit):
+        result.append(cursor.doc_id)
+        cursor.next()
+    return result
+
+def count(cursor) -> int:
+    """
+    Number of the documents of the cursor, they are not collected
+    """
+    n = 0
+    while cursor.doc_id is not None:
+        n += 1
+        cursor.next()
+    return n
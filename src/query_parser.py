@@ -0,0 +1,153 @@
+"""
+Parser of the boolean queries.
+
+The query is parsed to a tree (AST) with this grammar:
+
+    query   := or_expr ("NOT" or_expr)*      -> difference, e.g. a OR b NOT c = (a OR b) - c
+    or_expr := and_expr ("OR" and_expr)*
+    and_expr:= unary ("AND" unary)*
+    unary   := "NOT" unary | primary         -> a query can start with NOT
+    primary := TERM | "(" query ")"
+
+So the precedence is: parentheses > unary NOT > AND > OR > NOT (difference).
+AND / OR chains are flattened to n-ary nodes and a difference is kept
+as an And node with Not children, so the planner can apply NOT last.
+"""
+from dataclasses import dataclass, field
+from typing import List
+
+
+class QueryError(ValueError):
+    """
+    Base class of the errors of a query
+    """
+
+class QuerySyntaxError(QueryError):
+    """
+    Raised when a query cannot be parsed, e.g. missing operand or parenthesis
+    """
+
+@dataclass
+class Term():
+    token: str
+
+@dataclass
+class Not():
+    child: object
+
+@dataclass
+class And():
+    children: List = field(default_factory=list)
+
+@dataclass
+class Or():
+    children: List = field(default_factory=list)
+
+"""
+Here are some global variables
+"""
+operators = ("AND", "OR", "NOT")
+parentheses = ("(", ")")
+
+def lex(q, preprocess):
+    """
+    Split the query into tokens. Parentheses are separated first, then every part
+    is preprocessed with the given function (punctuation and stopword removal).
+    """
+    tokens = []
+    part = ""
+    for char in q:
+        if char in parentheses:
+            tokens.extend(preprocess(part) if part.strip() else [])
+            tokens.append(char)
+            part = ""
+        else:
+            part += char
+    tokens.extend(preprocess(part) if part.strip() else [])
+    return tokens
+
+def _flatten(node_class, children):
+    """
+    Create node_class(children), the children with the same class are joined
+    """
+    flat = []
+    for child in children:
+        if isinstance(child, node_class):
+            flat.extend(child.children)
+        else:
+            flat.append(child)
+    return flat[0] if len(flat) == 1 else node_class(flat)
+
+class QueryParser:
+    """
+    Recursive descent parser of the grammar above.
+
+    Usage: QueryParser(tokens).parse() -> the root node
+    """
+
+    def __init__(self, tokens) -> None:
+        self._tokens = tokens
+        self._i = 0
+
+    def parse(self):
+        if not self._tokens:
+            raise QuerySyntaxError("Please correct your query, it is empty!")
+
+        node = self._query()
+        if self._peek() is not None:
+            raise QuerySyntaxError(f"Please correct your query, unexpected '{self._peek()}'!")
+        return node
+
+    def _peek(self):
+        return self._tokens[self._i] if self._i < len(self._tokens) else None
+
+    def _take(self):
+        token = self._peek()
+        self._i += 1
+        return token
+
+    def _query(self):
+        left = self._or_expr()
+        negatives = []
+        while self._peek() == "NOT":
+            self._take()
+            negatives.append(Not(self._or_expr()))
+        return _flatten(And, [left] + negatives) if negatives else left
+
+    def _or_expr(self):
+        children = [self._and_expr()]
+        while self._peek() == "OR":
+            self._take()
+            children.append(self._and_expr())
+        return _flatten(Or, children)
+
+    def _and_expr(self):
+        children = [self._unary()]
+        while self._peek() == "AND":
+            self._take()
+            children.append(self._unary())
+        return _flatten(And, children)
+
+    def _unary(self):
+        if self._peek() == "NOT":
+            self._take()
+            return Not(self._unary())
+        return self._primary()
+
+    def _primary(self):
+        token = self._take()
+
+        if token is None:
+            raise QuerySyntaxError("Please correct your query, an operand is missing at the end!")
+        if token == "(":
+            node = self._query()
+            if self._take() != ")":
+                raise QuerySyntaxError("Please correct your query, a parenthesis is not closed!")
+            return node
+        if token in operators or token == ")":
+            raise QuerySyntaxError(f"Please correct your query, an operand is expected before '{token}'!")
+
+        # Two terms can not follow each other without an operator
+        if self._peek() is not None and self._peek() not in operators and self._peek() != ")":
+            raise QuerySyntaxError("Please correct your query, there is no operand!")
+        return Term(token)
@@ -1,214 +1,682 @@
+import re
+import math
+import heapq
+from collections import Counter
+from operator import itemgetter
 from typing import List
 
 from src.positional_inverted_index import PositionalInvertedIndex
 from src.base import BaseTextProcessor
 from src.boolean_query_processor import BooleanQueryProcessor
 from src.metrics import *
+from src.postings import PositionalPosting, posting_cursor
+from src.query_cursors import DifferenceCursor, union_cursor
+from src.phrase import match_documents, phrase_matches, near_matches, ordered_near_matches
+from src.query_parser import QuerySyntaxError
+from src.term_dictionary import wildcard, default_max_expansions
+from src.instrumentation import span, observe, query_trace
+import src.instrumentation as instrumentation
+import src.query_cursors as query_cursors
+import src.sparse_scoring as sparse_scoring
+
+"""
+Here are some global variables
+"""
+# NEAR/k or ONEAR/k as a separate word
+proximity_pattern = re.compile(r"(?<!\S)(O?NEAR)/(\d+)(?!\S)")
+
+# Bounds are multiplied by this, so float errors cannot prune a document that must be scored
+bound_slack = 1 + 1e-9
+
+# A top k query whose postings are all at most this long scores all of its documents with
+# a bounded heap. MaxScore costs more per document, it pays off when a long posting
+# (a frequent token, low bound) can be skipped.
+exhaustive_top_k_length = 1000
+
+def format_ranking(ranked) -> List:
+    """
+    Result strings of a ranking of (doc_id, cosine) pairs
+    """
+    return ["Document-{} with cosine similarity:{:.3f}".format(doc_id, cosine) for doc_id, cosine in ranked]
 
 class QueryProcessor(BooleanQueryProcessor):
-    def __init__(self) -> None:
+    def __init__(self, cache=None, index=None, max_expansions=default_max_expansions, correct_spelling=False,
+                 raw_scores=False) -> None:
+        """
+        - cache -> QueryCache for the results (see src.query_cache), None disables caching
+        - index -> positional index to search (e.g. SegmentedIndex), the saved PositionalInvertedIndex by default
+        - max_expansions -> max number of terms of a wildcard token like oil* (None -> no limit)
+        - correct_spelling -> replace the query terms that are not in the index with their
+                              nearest term (see src.spelling)
+        - raw_scores -> free text queries return (doc_id, cosine) pairs instead of the
+                        result strings (e.g. for the coordinator of src.sharding)
+        """
 
         # First creat different index from boolean query processor
-        self._index = PositionalInvertedIndex()
-        
-        # If dictionary cannot load, then build
-        if not self._index.load():
-            self._index.build()
+        if index is None:
+            index = PositionalInvertedIndex()
+
+            # If dictionary cannot load, then build
+            if not index.load():
+                index.build()
+        self._index = index
         
         # Creat text processor for process the query
         self._preprocessor = BaseTextProcessor()
 
-        # Keep the document count N
-        self.N = self._index.get("N")[0]
+        # Load the collection statistics (N, idf, document norms, token bounds)
+        self._index.statistics()
+
+        # Matrix backend of process_batch, it is created on first use
+        self._scorer = None
+        self._scorer_generation = None
 
-        # Load the tf values
-        self.tf_index = self._index.get("tf_index")[0]
+        # Results of the queries, keyed by the query type and tokens
+        self.cache = cache
 
-        # Create a dictionary to keep idf_values
-        self.idf_values = {}
+        # Sorted terms of the index for the wildcard tokens, it is created on first use
+        self.max_expansions = max_expansions
+        self._term_dictionary = None
+        self._term_generation = None
+        self.expansions = {}
 
-    def process(self, q) -> List:
+        # Spelling index of the index terms, it is loaded on first use
+        self.correct_spelling = correct_spelling
+        self._spelling = None
+        self._spelling_generation = None
+
+        self.raw_scores = raw_scores
+
+    @property
+    def statistics(self):
+        """
+        Collection statistics of the index (they change if the index is updated)
+        """
+        return self._index.statistics()
+
+    @property
+    def N(self):
+        return self.statistics.N
+
+    def process(self, q, top_k=None, offset=0) -> List:
         """
         This is a function to override process function of base class.
+
+        Query types:
+        - "w1 w2 w3" -> phrase query. Returns the documents with the start positions of the phrase.
+        - w1 NEAR/k w2 -> proximity query, the terms are in a window of k words in any order.
+        - w1 ONEAR/k w2 -> ordered proximity query, the terms are in query order in a window of k words.
+        - w1 w2 NOT w3 -> free text query. Returns the documents ranked by cosine similarity.
+
+        A token with "*" (oil*, *ing, pe*um) matches the terms of the index. In a free text
+        query the token is replaced by its terms, in phrase and proximity queries any of
+        its terms can be at that position.
+
+        - top_k -> only the best top_k documents of a free text query are returned.
+                   They are the same as the first top_k results without it, but most of
+                   the documents are not scored. (MaxScore, see _top_k_query)
+                   Phrase and proximity queries return their first top_k documents.
+        - offset -> the first offset results are skipped, e.g. offset=20, top_k=10 is the third page
+        """
+        if offset:
+            result = self.process(q, None if top_k is None else offset + top_k)
+            return result[offset:]
+
+        with query_trace("ranked", q):
+            q = q.strip()
+            if not q:
+                raise QuerySyntaxError("Please correct your query, it is empty!")
+
+            # Decide the type of the query (free text, phrase or proximity)
+            is_phrase = True if q[0] == '"' and q[-1] == '"' else False
+            if is_phrase:
+                q_tokens = self._preprocess(q)
+                result = self._cached(("phrase", tuple(q_tokens)), lambda: self._phrase_query(q_tokens))
+                return result if top_k is None else result[:top_k]
+
+            proximity = self._parse_proximity(q)
+            if proximity:
+                q_tokens, k, ordered = proximity
+                key = ("ONEAR" if ordered else "NEAR", tuple(q_tokens), k)
+                result = self._cached(key, lambda: self._proximity_query(q_tokens, k, ordered))
+                return result if top_k is None else result[:top_k]
+
+            # Then preprocess
+            q_tokens = self._preprocess(q)
+
+            # Free text tokens after NOT are not ranked, their documents are eliminated
+            q_tokens, excluded = self._split_negations(q_tokens)
+            q_tokens, excluded = self._expand_tokens(q_tokens), self._expand_tokens(excluded)
+            if not q_tokens:
+                return []
+
+            key = ("ranked", tuple(q_tokens), tuple(excluded), top_k)
+            return self._ranking(self._cached(key, lambda: self._ranked_query(q_tokens, excluded, top_k)))
+
+    def count(self, q) -> int:
+        """
+        This is a function that overrides the count function from base class(BooleanQueryProcessor)
+
+        Number of the results of the query. The documents of a free text query (any token
+        and none of the excluded tokens) are counted with cursors, without scoring them.
+        Phrase and proximity queries need the position checks, so they are run.
         """
+        stripped = q.strip()
+        if not stripped or (stripped[0] == '"' and stripped[-1] == '"') or proximity_pattern.search(stripped):
+            return len(self.process(q))
+
+        with query_trace("ranked.count", q):
+            q_tokens, excluded = self._split_negations(self._preprocess(stripped))
+            q_tokens, excluded = self._expand_tokens(q_tokens), self._expand_tokens(excluded)
+            if not q_tokens:
+                return 0
 
-        # Decide the type of the query (free text or phrase)
-        is_phrase = True if q[0] == '"' and q[-1] == '"' else False
+            cursor = union_cursor([posting_cursor(self._fetch(token.casefold())) for token in q_tokens])
+            if excluded:
+                cursor = DifferenceCursor(cursor, union_cursor([posting_cursor(self._fetch(token.casefold()))
+                                                                for token in excluded]))
+            return query_cursors.count(cursor)
 
-        # Then preprocess
-        q_tokens = self._preprocess(q)
+    def _ranked_query(self, q_tokens, excluded, top_k=None):
+        """
+        Free text query: documents that include any token (and none of the excluded
+        tokens), ranked by cosine similarity.
+        """
+        if top_k is not None:
+            with span("ranked.top_k", k=top_k):
+                return self._top_k_query(q_tokens, excluded, top_k)
 
+        # The postings are fetched (and decoded) once, the scoring uses them again
+        postings = self._fetch_postings(q_tokens)
         bag = []
-        count = 0
         for token in q_tokens:
-            bag.append(self._index.get(token.casefold()))
+            bag.append(postings[token.casefold()])
 
             if len(bag) > 1:
-                if is_phrase:
-                    sub_result = self._operation(bag, 'AND')
-                else:
+                with span("ranked.or"):
                     sub_result = self._operation(bag, 'OR')
-                if sub_result == None:
-                    print("sub_result is None")
-                    exit()
-                
-                if is_phrase:
-                    sub_result = self._phrase_check(sub_result, count)
-                else:
                     sub_result = self._free_text_check(sub_result)
                 bag.append(sub_result)
 
-            count += 1
-
         result_list = bag.pop()
-        result = []
-        if not is_phrase:
-            result = self._free_text_query_operations(q_tokens, list((map(lambda dict:dict.get("doc_id"), result_list))))
-        else:
-            result = result_list
+        for token in excluded:
+            excluded_posting = self._fetch(token.casefold())
+            with span("ranked.not"):
+                result_list = self._index.difference(result_list, excluded_posting)
+
+        observe("ranked.candidates", len(result_list))
+        with span("ranked.cosine", candidates=len(result_list)):
+            return self._free_text_query_operations(q_tokens, list(result_list.doc_ids), postings)
+
+    def _fetch_postings(self, q_tokens):
+        """
+        Case folded token -> posting of each distinct token of the query
+        """
+        postings = {}
+        for token in q_tokens:
+            key = token.casefold()
+            if key not in postings:
+                postings[key] = self._fetch(key)
+        return postings
+
+    def process_batch(self, queries, top_k=None) -> List:
+        """
+        Process many queries, returns the result list of each query (same as process).
+
+        If NumPy and SciPy are installed, the free text queries are scored together
+        with sparse matrix products (see src.sparse_scoring). Other queries, or all of
+        them without NumPy and SciPy, are processed one by one.
+        """
+        if not sparse_scoring.available:
+            return [self.process(q, top_k) for q in queries]
+
+        results = [None] * len(queries)
+        free_text = []
+        indexes = []
+        for i, q in enumerate(queries):
+            stripped = q.strip()
+            if not stripped or (stripped[0] == '"' and stripped[-1] == '"') or proximity_pattern.search(stripped):
+                results[i] = self.process(q, top_k)
+                continue
+
+            q_tokens, excluded = self._split_negations(self._preprocess(stripped))
+            q_tokens, excluded = self._expand_tokens(q_tokens), self._expand_tokens(excluded)
+            if not q_tokens:
+                results[i] = []
+                continue
+
+            key = ("ranked", tuple(q_tokens), tuple(excluded), top_k)
+            cached = self.cache.get(key, self._index.generation, id(self._index)) if self.cache is not None else None
+            if cached is not None:
+                results[i] = self._ranking(cached)
+                continue
+            free_text.append((q_tokens, excluded))
+            indexes.append(i)
+
+        if free_text:
+            if self._scorer is None or self._scorer_generation != self._index.generation:
+                with span("ranked.batch.matrix"):
+                    self._scorer = sparse_scoring.SparseScorer(self._index)
+                self._scorer_generation = self._index.generation
+            with span("ranked.batch.search", queries=len(free_text)):
+                ranked = self._scorer.search(free_text, top_k)
+            for i, (q_tokens, excluded), result in zip(indexes, free_text, ranked):
+                if self.cache is not None:
+                    self.cache.put(("ranked", tuple(q_tokens), tuple(excluded), top_k), list(result), self._index.generation, id(self._index))
+                results[i] = self._ranking(result)
+
+        return results
+
+    def _phrase_query(self, q_tokens):
+        """
+        The documents that include all tokens are found first, then the positions
+        of all tokens are checked together in one linear merge for each document.
+        (see src.phrase)
+        """
+        if not q_tokens:
+            return []
+
+        postings = [self._fetch_token(token) for token in q_tokens]
+        with span("phrase.check") as check:
+            result = match_documents(postings, phrase_matches).to_dicts()
+            check.set(result_size=len(result))
+        observe("phrase.result_size", len(result))
         return result
 
-    def _phrase_check(self, sub_result, count):
-        """
-        The sub_result is like:
-        [
-            {
-                "left" : [1,2,3,89],
-                "right": [2,3,4,34,145],
-                "doc_id": 8907
-            },
-            ...
-        ]
-
-        Process over left and right positions and check if 
-        left positions + count gives the right positions. 
-        If so keep them in a new key called positions.
-
-        :return: The processed sub_result will be like:,
-        [
-            {
-                "positions" : [1,2,3],
-                "doc_id": 8907
-            },
-            ...
-        ]
-        """
-        result = []
-        for dict in sub_result:
-            positions = []
-            for i in dict.get("left"):
-                if i+count in dict.get("right"):
-                    positions.append(i)
-            if len(positions) != 0:
-                result.append({"positions": positions, "doc_id": dict.get("doc_id")})
+    def _parse_proximity(self, q):
+        """
+        Parse a proximity query like: oil NEAR/3 price or oil ONEAR/3 price NEAR/3 ...
+        All operators of the query must be the same and there must be one term between them.
+
+        Returns (tokens, k, ordered) or None if it is not a proximity query.
+        """
+        parts = proximity_pattern.split(q)
+        if len(parts) == 1:
+            return None
+
+        operators = set(zip(parts[1::3], parts[2::3]))
+        if len(operators) > 1:
+            raise QuerySyntaxError("Please correct your query, the proximity operators must be the same!")
+        operator, k = operators.pop()
+
+        tokens = []
+        for part in parts[0::3]:
+            part_tokens = self._preprocess(part) if part.strip() else []
+            if len(part_tokens) != 1:
+                raise QuerySyntaxError(f"Please correct your query, {operator}/{k} needs one term on each side!")
+            tokens.extend(part_tokens)
+
+        return tokens, int(k), operator == "ONEAR"
+
+    def _proximity_query(self, q_tokens, k, ordered):
+        """
+        Documents where the tokens are in a window of k words, with the start positions of the windows
+        """
+        postings = [self._fetch_token(token) for token in q_tokens]
+        if ordered:
+            matcher = lambda position_lists: ordered_near_matches(position_lists, k)
+        else:
+            matcher = lambda position_lists: near_matches(position_lists, k)
+        with span("proximity.check") as check:
+            result = match_documents(postings, matcher).to_dicts()
+            check.set(result_size=len(result))
+        observe("proximity.result_size", len(result))
         return result
-    
+
+    def _expand_tokens(self, q_tokens):
+        """
+        Replace the wildcard tokens with their terms, e.g. [oil, petrol*] -> [oil, petrol, petroleum]
+        """
+        if not any(wildcard in token for token in q_tokens):
+            return q_tokens
+
+        tokens = []
+        for token in q_tokens:
+            if wildcard in token:
+                tokens.extend(self._expand(token.casefold()))
+            else:
+                tokens.append(token)
+        return tokens
+
+    def _union_all(self, postings):
+        """
+        This is a function that overrides the _union_all function from base class(BooleanQueryProcessor)
+
+        The positions of a document in several postings are merged (a position has
+        only one term), so a wildcard token can be a part of a phrase.
+        """
+        if len(postings) == 1:
+            return postings[0]
+
+        documents = {}
+        for posting in postings:
+            for doc_id, positions in posting:
+                documents.setdefault(doc_id, []).append(positions)
+        return PositionalPosting.from_entries(
+            (doc_id, list(heapq.merge(*documents[doc_id]))) for doc_id in sorted(documents))
+
+    def _split_negations(self, q_tokens):
+        """
+        Split the free text query tokens into ranked tokens and the tokens after NOT.
+        e.g. oil gold NOT price -> ([oil, gold], [price])
+        """
+        tokens, excluded = [], []
+        negate = False
+        for token in q_tokens:
+            if token == 'NOT':
+                negate = True
+            elif negate:
+                excluded.append(token)
+                negate = False
+            else:
+                tokens.append(token)
+        return tokens, excluded
+
     def _free_text_check(self, sub_result):
         """
-        The sub_result is like:
-        [
-            {
-                "left" : [1,2,3,89],
-                "right": [2,3,4,34,145],
-                "doc_id": 8907
-            },
-            ...
-        ]
+        The sub_result is the PositionalPosting of the OR operation.
 
         Just eleminate unnecessary position informations. And keep doc ids
         
-        :return: The processed sub_result will be like:
-        [ {'doc_id': 8907}, ..]
+        :return: PositionalPosting without positions
         """
-        ids = list((map(lambda dict:{"doc_id":dict.get("doc_id")}, sub_result)))
-        return ids
+        return PositionalPosting.from_doc_ids(sub_result.doc_ids)
 
-    def _free_text_query_operations(self, q_tokens, doc_ids):
+    def _free_text_query_operations(self, q_tokens, doc_ids, postings=None, top_k=None):
         """
         Cosine similarity with (log-scaled) TF-IDF weighting is used.
         The function returns the IDs of the documents as well as their cosine 
         similarity scores, ranked by their cosine similarities to the query. 
-        Documents with zero cosine similarity are eliminated
+
+        Term at a time scoring: only the postings of the query tokens are traversed
+        and the dot products are summed in accumulators. The document vector lengths
+        are precomputed at build time (see src.collection_statistics), so the cost of a query depends on
+        the posting lengths of its tokens, not on the length of the documents.
+
+        - postings -> already fetched postings of the tokens (see _fetch_postings)
+        - top_k -> only the best top_k documents are kept, in a bounded heap
         """
+        candidates = set(doc_ids)
+        dot_products = {}
+        # A token repeated in the query takes place more than once in the document vector,
+        # so its weight is added to the document length again for each repetition.
+        extra_lengths = {}
+
+        query_length = 0
+        for token, count, idf, _ in self._query_terms(q_tokens):
+            query_weight = calculate_tf(count) * idf
+            query_length += count * query_weight * query_weight
+            if query_weight == 0:
+                continue
+
+            posting = postings[token] if postings and token in postings else self._fetch(token)
+            offsets = posting.offsets
+            for i, doc_id in enumerate(posting.doc_ids):
+                if doc_id not in candidates:
+                    continue
+                weight = calculate_tf(offsets[i + 1] - offsets[i]) * idf
+                dot_products[doc_id] = dot_products.get(doc_id, 0) + count * query_weight * weight
+                if count > 1:
+                    extra_lengths[doc_id] = extra_lengths.get(doc_id, 0) + (count - 1) * weight * weight
+
+        query_length = math.sqrt(query_length)
+        statistics = self.statistics
+        scores = []
+        for doc_id in doc_ids:
+            doc_length = statistics.norm(doc_id)
+            if doc_id in extra_lengths:
+                doc_length = math.sqrt(doc_length * doc_length + extra_lengths[doc_id])
+            cosine = dot_products.get(doc_id, 0) / (query_length * doc_length) if query_length and doc_length else 0
+            # Ranked by the shown (3 digits) score, round gives the same value as the formatting
+            scores.append((round(cosine, 3), doc_id))
+
+        if top_k is not None:
+            # Same order as the stable sort: the smaller doc id first for the same score
+            ranked = heapq.nlargest(top_k, scores, key=lambda row:(row[0], -row[1]))
+        else:
+            ranked = sorted(scores, key=itemgetter(0), reverse=True)
+        return [(doc_id, cosine) for cosine, doc_id in ranked]
+
+    def _top_k_query(self, q_tokens, excluded, k):
         """
-        kelimeler | query vector   | doc1 vector  | doc2 vecotr
-        common       tfidf score     tfidf score    tfidf score 
-        stock        tfidf score     tfidf score    tfidf score 
+        Top k documents of a free text query with MaxScore dynamic pruning.
+
+        Each query token gets an upper bound of its share in the cosine similarity
+        (query weight / query norm * bound of the token). The best k documents are kept
+        in a heap. When the sum of the bounds of the weakest tokens cannot beat the
+        k-th best score, these tokens are not used to find new documents any more,
+        they are only checked (with a cursor) for the documents of the other tokens.
+        Scoring of a document stops as soon as it cannot enter the heap.
+
+        A query of one token is a scan of one posting with a bounded heap (see
+        _single_term_top_k). Short postings cost less than the bookkeeping of MaxScore,
+        so their documents are all scored with a bounded heap (see exhaustive_top_k_length).
+
+        The scores and the order of the results are the same as _free_text_query_operations.
         """
-        document_vectors = []
+        if k <= 0:
+            return []
 
-        # Create document vectors
-        for doc_id in doc_ids:
-            vector = []
-            for token in q_tokens:
-                idf = self.get_idf(token)
-                tf = self.tf_index.get(doc_id).get(token)
-                if tf == None:
-                    tf = 0
-                score = tf*idf
-                vector.append(score)
-            for token in self.tf_index.get(doc_id):
-                # Calculate the log scaled tf-idf score
-                # Then create a vector for this document
-                if token in q_tokens:
-                    continue
-                idf = self.get_idf(token)
-                tf = self.tf_index.get(doc_id).get(token)
-                score = tf*idf
-                vector.append(score)
+        postings = self._fetch_postings(q_tokens)
+        terms = self._query_terms(q_tokens)
+        if len(terms) == 1:
+            with span("ranked.top_k.single"):
+                return self._single_term_top_k(terms[0], postings[terms[0][0].casefold()], excluded, k)
 
-            document_vectors.append((doc_id, vector))
-        
-        # Create query vector
-        query_vector = []
-        for token in q_tokens:
-            tf = calculate_tf(q_tokens.count(token))
-            idf = self.get_idf(token)
-            score = tf*idf
-            query_vector.append(score)
-        
-        return [
-            "Document-{} with cosine similarity:{}".format(doc_id, cosine)
-            for doc_id, cosine
-            in self.calculate_cosine(document_vectors, query_vector)
-        ]
-            
-    def calculate_cosine(self, document_vectors, query_vector):
+        if max(map(len, postings.values())) <= exhaustive_top_k_length:
+            with span("ranked.top_k.exhaustive"):
+                doc_ids = set()
+                for posting in postings.values():
+                    doc_ids.update(posting.doc_ids)
+                for token in excluded:
+                    doc_ids.difference_update(self._fetch(token.casefold()).doc_ids)
+                return self._free_text_query_operations(q_tokens, sorted(doc_ids), postings, k)
+
+        query_length = 0
+        for token, count, idf, _ in terms:
+            query_weight = calculate_tf(count) * idf
+            query_length += count * query_weight * query_weight
+        query_length = math.sqrt(query_length)
+
+        # One list per posting: [bound, cursor, order, count, query weight, idf, offsets]
+        # The tokens of the index are case folded, so only a case folded token has a
+        # weight (as in _free_text_query_operations), the others only find documents.
+        lists = {}
+        for order, (token, count, idf, bound) in enumerate(terms):
+            key = token.casefold()
+            if key not in lists:
+                posting = postings[key]
+                lists[key] = [0, posting.cursor(), None, 0, 0, 0, posting.offsets]
+            query_weight = calculate_tf(count) * idf
+            if token == key and query_weight and query_length:
+                bound = count * query_weight * bound / query_length
+                lists[key][0:6] = [bound * bound_slack, lists[key][1], order, count, query_weight, idf]
+
+        lists = sorted(lists.values(), key=lambda row:row[0])
+        cumulative = []
+        total = 0
+        for row in lists:
+            total += row[0]
+            cumulative.append(total)
+
+        excluded_ids = set()
+        for token in excluded:
+            excluded_ids.update(self._fetch(token.casefold()).doc_ids)
+
+        # Heap of (score, -doc_id, cosine), the k-th best result is at the top.
+        # Documents come in ascending id order, so a new document must have a bigger
+        # (rounded) score to beat a result, like the stable sort of the full ranking.
+        heap = []
+        threshold = -1.0
+        essential = 0
+        # Documents found by the essential lists and documents that are fully scored
+        visited = scored = 0
+
+        while True:
+            doc_ids = [row[1].doc_id for row in lists[essential:] if row[1].doc_id is not None]
+            if not doc_ids:
+                break
+            doc_id = min(doc_ids)
+            visited += 1
+
+            norm = self.statistics.norm(doc_id)
+            weights = []
+            score = 0
+            for row in lists[essential:]:
+                cursor = row[1]
+                if cursor.doc_id == doc_id:
+                    if row[2] is not None:
+                        weights.append(self._top_k_weight(row, cursor.index))
+                        score += self._top_k_share(row, weights[-1], query_length, norm)
+                    cursor.next()
+
+            if doc_id in excluded_ids:
+                continue
+
+            # Other lists in descending bound order, while the document can still enter
+            for j in range(essential - 1, -1, -1):
+                if self._rounded(score + cumulative[j]) <= threshold:
+                    break
+                row = lists[j]
+                if row[2] is not None and row[1].advance_to(doc_id) == doc_id:
+                    weights.append(self._top_k_weight(row, row[1].index))
+                    score += self._top_k_share(row, weights[-1], query_length, norm)
+            else:
+                scored += 1
+                cosine = self._top_k_cosine(weights, query_length, norm)
+                if len(heap) < k:
+                    heapq.heappush(heap, (float(cosine), -doc_id, cosine))
+                elif float(cosine) > heap[0][0]:
+                    heapq.heapreplace(heap, (float(cosine), -doc_id, cosine))
+
+                if len(heap) == k:
+                    threshold = heap[0][0]
+                    while essential < len(lists) and self._rounded(cumulative[essential]) <= threshold:
+                        essential += 1
+
+        instrumentation.count("ranked.top_k.visited", visited)
+        instrumentation.count("ranked.top_k.scored", scored)
+        return [(-doc_id, score) for score, doc_id, _ in sorted(heap, reverse=True)]
+
+    def _single_term_top_k(self, term, posting, excluded, k):
+        """
+        Top k documents of a query with one (distinct) token. The posting is scanned with
+        a bounded heap of k documents, the scan stops when the k-th best score reaches
+        the bound of the token, because no later document can beat it.
+
+        The scores are computed like _free_text_query_operations does for one token.
+        """
+        token, count, idf, bound = term
+        query_weight = calculate_tf(count) * idf
+        query_length = math.sqrt(count * query_weight * query_weight)
+        if token != token.casefold():
+            # Only a case folded token is weighted, the others only find documents
+            query_weight = 0
+        limit = self._rounded(count * query_weight * bound / query_length * bound_slack) if query_length else 0
+
+        excluded_ids = set()
+        for other in excluded:
+            excluded_ids.update(self._fetch(other.casefold()).doc_ids)
+
+        # Heap of (score, -doc_id) like _top_k_query
+        heap = []
+        norms = self.statistics.norm
+        offsets = posting.offsets
+        for i, doc_id in enumerate(posting.doc_ids):
+            if doc_id in excluded_ids:
+                continue
+            cosine = 0
+            doc_length = norms(doc_id)
+            if query_weight:
+                weight = calculate_tf(offsets[i + 1] - offsets[i]) * idf
+                if count > 1:
+                    doc_length = math.sqrt(doc_length * doc_length + (count - 1) * weight * weight)
+                if doc_length:
+                    cosine = count * query_weight * weight / (query_length * doc_length)
+
+            item = (round(cosine, 3), -doc_id)
+            if len(heap) < k:
+                heapq.heappush(heap, item)
+            elif item > heap[0]:
+                heapq.heapreplace(heap, item)
+            if len(heap) == k and heap[0][0] >= limit:
+                break
+
+        return [(-doc_id, cosine) for cosine, doc_id in sorted(heap, reverse=True)]
+
+    def _top_k_weight(self, row, i):
         """
-        Calculate cosine similarity between query_vector and document vectors
+        (order, count, query weight, document weight) of the list row for its i-th document
         """
-        result = {}
-        for doc_id, vector in document_vectors:
-            extended_query_vector = query_vector
-            extended_query_vector.extend([0]*(len(vector)-len(query_vector)))
-            result[doc_id] = cosine(extended_query_vector, vector)
+        _, _, order, count, query_weight, idf, offsets = row
+        return order, count, query_weight, calculate_tf(offsets[i + 1] - offsets[i]) * idf
 
-        result = sorted(result.items(), key=lambda row:row[1], reverse=True)
-        return result 
+    def _top_k_share(self, row, weight, query_length, norm):
+        """
+        Upper bound of the share of one token in the cosine similarity
+        """
+        _, count, query_weight, doc_weight = weight
+        return count * query_weight * doc_weight / (query_length * norm) * bound_slack if norm else 0
+
+    def _top_k_cosine(self, weights, query_length, norm):
+        """
+        Cosine similarity of a document from the weights of the query tokens.
+        The sums are done in the same order as _free_text_query_operations.
+        """
+        dot_product = 0
+        extra_length = 0
+        for _, count, query_weight, doc_weight in sorted(weights):
+            dot_product += count * query_weight * doc_weight
+            extra_length += (count - 1) * doc_weight * doc_weight
+
+        if extra_length:
+            norm = math.sqrt(norm * norm + extra_length)
+        return cosine_from_norms(dot_product, query_length, norm)
+
+    def _ranking(self, ranked) -> List:
+        """
+        Result of a free text query from its (doc_id, cosine) pairs, see raw_scores
+        """
+        return list(ranked) if self.raw_scores else format_ranking(ranked)
+
+    def _rounded(self, score):
+        """
+        Score as it is shown (3 digits), results are ranked by this value
+        """
+        return float(f"{score:.3f}")
+
+    def _query_terms(self, q_tokens):
+        """
+        (token, count, idf, bound) of each distinct query token. A token is translated
+        to its term id once, then its statistics are read from the arrays by the id.
+        """
+        statistics = self.statistics
+        terms = []
+        for token, count in Counter(q_tokens).items():
+            term_id = statistics.term_id(token)
+            if term_id is None:
+                terms.append((token, count, 0, 0))
+            else:
+                terms.append((token, count, statistics.idfs[term_id], statistics.bounds[term_id]))
+        return terms
 
     def get_idf(self, token):
         """
         Function to get idf value belongs to given token.
-        If the idf value is already exist then return
-        Otherwise, calculate the idf, add it to the idf_values dict
-        then return.
+        It is precomputed in the collection statistics.
         """
-        if token in self.idf_values.keys():
-            return self.idf_values.get(token)
-        else:
-            idf = calculate_idf(self.N, len(self._index.get(token)))
-            self.idf_values[token] = idf
-            return idf
+        return self.statistics.idf(token)
 
     def get_tf(self, doc_id, token):
         """
         Get the token's posting list (with positions and document id)
-        Traverse it and find the positions array length belongs to 
-        given document id. Then calculate log scaled tf value
+        Find the given document id with binary search and get its positions
+        array length. Then calculate log scaled tf value
         """
         f = 0
-        for i in self._index.get(token):
-            if i.get("doc_id") == doc_id:
-                f = len(i.get("positions"))
+        posting = self._index.get(token)
+        i = posting.find(doc_id)
+        if i != -1:
+            f = len(posting.positions(i))
 
         return calculate_tf(f)
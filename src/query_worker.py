@@ -0,0 +1,82 @@
+"""
+Query processors of a worker process (query server and batch runner).
+
+Every worker process loads the indexes once, with load_processors as the
+initializer of its pool, then runs many queries with run_query. The parent
+process calls prepare_indexes before the pool starts, so a missing index (or
+spelling index) is built once instead of by every worker.
+"""
+import time
+
+from src.inverted_intex import InvertedIndex
+from src.positional_inverted_index import PositionalInvertedIndex
+from src.boolean_query_processor import BooleanQueryProcessor
+from src.query_processor import QueryProcessor
+from src.query_parser import QueryError
+
+"""
+Here are some global variables
+"""
+modes = ("boolean", "ranked")
+
+# Query processors of this process, they are created once by load_processors
+processors = {}
+
+# Options of the processors, a processor loaded later by run_query gets them too
+options = {"correct_spelling": False}
+
+def load_processors(modes=modes, correct_spelling=None):
+    """
+    Load the indexes of the given modes ("boolean", "ranked") once
+
+    - correct_spelling -> the processors replace the unknown query words with their
+                          nearest term (see src.spelling), None keeps the current option
+    """
+    if correct_spelling is not None:
+        options["correct_spelling"] = correct_spelling
+    for mode in modes:
+        if mode not in processors:
+            processors[mode] = QueryProcessor() if mode == "ranked" else BooleanQueryProcessor()
+        processors[mode].correct_spelling = options["correct_spelling"]
+
+def prepare_indexes(modes=modes, correct_spelling=False):
+    """
+    Build (and save) the indexes of the given modes that cannot be loaded, and the
+    statistics of the ranked mode. After that the workers only load the saved files.
+
+    - correct_spelling -> also build (and save) the spelling indexes of the modes
+    """
+    for mode in modes:
+        index = PositionalInvertedIndex() if mode == "ranked" else InvertedIndex()
+        if not index.load():
+            index.build()
+        if mode == "ranked":
+            index.statistics()
+        if correct_spelling:
+            index.spelling()
+
+def run_query(mode, q, top_k=None, offset=0):
+    """
+    Run one query. Returns (ok, results or error message, seconds)
+
+    - top_k -> number of results (the best ones for ranked, the first ones for boolean), None -> all
+    - offset -> number of the skipped first results, for paging
+    """
+    if mode not in processors:
+        load_processors((mode,))
+
+    start = time.perf_counter()
+    try:
+        if mode == "ranked":
+            result = True, processors[mode].process(q, top_k, offset)
+        else:
+            result = True, processors[mode].process(q, limit=top_k, offset=offset)
+    except QueryError as e:
+        result = False, str(e)
+    return result + (time.perf_counter() - start,)
+
+def ready():
+    """
+    Empty task, it makes sure that a worker is started (and its indexes are loaded)
+    """
+    return True
@@ -0,0 +1,621 @@
+"""
+Incremental indexing with segments.
+
+New documents are indexed to a small segment that is written once and never changed
+(the same binary format as the full indexes, see src.disk_index). A deleted or
+re-added document is only marked in the deleted ids (tombstones) of its segment.
+Queries search all segments: the posting of a token is the merge of its live
+postings in every segment.
+
+When there are merge_factor segments of a similar size (or a segment has more
+deleted than live documents), they are merged to one segment without their deleted
+documents. The merge runs in a background thread, queries and new documents are
+not blocked while it runs.
+
+The list of the segments and their deleted ids are kept in the manifest file of
+the segment directory. It is replaced atomically after each change.
+
+The statistics are kept per segment (SegmentStatistics): the df values and the terms
+of each document. They are computed once for a segment, a tombstone only subtracts
+the terms of its document. After a change the collection statistics are the sums of
+the segments, and the norms are computed from the kept terms with the new idf values.
+The df values of the spelling index are summed from the segments in the same way.
+"""
+import os
+import json
+import math
+import heapq
+import threading
+from bisect import bisect_left
+from array import array
+from itertools import chain
+
+from src.inverted_intex import InvertedIndex
+from src.block_sort_builder import default_memory_budget
+from src.disk_index import MappedDictionary, write_index, positional_kind
+from src.postings import CompressedPosting, PositionalPosting
+from src.collection_statistics import CollectionStatistics
+from src.metrics import calculate_tf, calculate_idf
+
+"""
+Here are some global variables
+"""
+manifest_name = "manifest.json"
+default_merge_factor = 4
+
+class Segment:
+    """
+    One immutable segment of a SegmentedIndex
+
+    - name -> file name of the segment without extension
+    - index -> index object of the segment (its dictionary is opened with mmap)
+    - deleted -> deleted doc ids of the segment (tombstones)
+    - statistics -> SegmentStatistics of the segment, they are computed at the first use if not given
+    """
+
+    def __init__(self, name, index, deleted=(), statistics=None) -> None:
+        self.name = name
+        self.index = index
+        self.deleted = set(deleted)
+        self._statistics = statistics
+
+        # Doc ids of the segment and its live ids with the number of tombstones they have
+        self._ids = None
+        self._live_ids = None
+        self._live_deleted = 0
+
+    def doc_ids(self):
+        return self.index.get(self.index.universe_term)
+
+    def ids(self):
+        """
+        Sorted ids of all documents of the segment, they are decoded once
+        """
+        if self._ids is None:
+            self._ids = list(self.doc_ids())
+        return self._ids
+
+    def __contains__(self, doc_id):
+        """
+        True if the document is in the segment (deleted or not), with a binary search on the ids
+        """
+        ids = self.ids()
+        i = bisect_left(ids, doc_id)
+        return i < len(ids) and ids[i] == doc_id
+
+    def live_ids(self, deleted=None):
+        """
+        Sorted ids of the live documents. The ids are decoded once, they are filtered
+        again only when there are new tombstones (tombstones are never removed).
+        """
+        deleted = self.deleted if deleted is None else deleted
+        if self._live_ids is None or self._live_deleted != len(deleted):
+            self._live_ids = _live_ids(self.ids(), deleted)
+            self._live_deleted = len(deleted)
+        return self._live_ids
+
+    def statistics(self):
+        if self._statistics is None:
+            self._statistics = SegmentStatistics.from_dictionary(self.index.dictionary, self.index.pseudo_terms)
+        return self._statistics
+
+    def size(self) -> int:
+        return len(self.doc_ids())
+
+    def live_size(self) -> int:
+        return self.size() - len(self.deleted)
+
+class SegmentStatistics:
+    """
+    Statistics of one segment: the df values of its terms and the terms of each document
+    (a forward index with the log scaled tf weights, in the order of the terms).
+
+    functions:
+    - apply_tombstones: subtract the terms of the deleted documents from the live df values
+    - norms: norm, length and term weights of the live documents with the given idf values
+    """
+
+    def __init__(self) -> None:
+        # Terms of the segment (sorted), the arrays below keep their numbers
+        self.tokens = []
+        self.dfs = array("I")
+        self.live_dfs = array("I")
+
+        # Terms of the i-th document are terms[starts[i]:starts[i + 1]]
+        self.doc_ids = array("I")
+        self.starts = array("I", [0])
+        self.terms = array("I")
+        self.weights = array("d")
+        self.lengths = array("I")
+
+        self._positions = {}
+        self._applied = set()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_dictionary(cls, dictionary, pseudo_terms=()):
+        """
+        - dictionary -> dictionary of the segment index (dict or MappedDictionary),
+                        positional postings give tf weights, others weight 1
+        """
+        items = dictionary.items() if isinstance(dictionary, MappedDictionary) else sorted(dictionary.items())
+        statistics = cls()
+        documents = {}
+        for token, posting in items:
+            if token in pseudo_terms:
+                continue
+            term = len(statistics.tokens)
+            statistics.tokens.append(token)
+            statistics.dfs.append(len(posting))
+            if isinstance(posting, PositionalPosting):
+                offsets = posting.offsets
+                for i, doc_id in enumerate(posting.doc_ids):
+                    documents.setdefault(doc_id, []).append((term, offsets[i + 1] - offsets[i]))
+            else:
+                for doc_id in posting:
+                    documents.setdefault(doc_id, []).append((term, 1))
+
+        statistics.live_dfs = array("I", statistics.dfs)
+        for doc_id in sorted(documents):
+            statistics._positions[doc_id] = len(statistics.doc_ids)
+            statistics.doc_ids.append(doc_id)
+            length = 0
+            for term, tf in documents[doc_id]:
+                statistics.terms.append(term)
+                statistics.weights.append(calculate_tf(tf))
+                length += tf
+            statistics.starts.append(len(statistics.terms))
+            statistics.lengths.append(length)
+        return statistics
+
+    def apply_tombstones(self, deleted):
+        """
+        Subtract the terms of the newly deleted documents from the live df values
+        """
+        with self._lock:
+            if len(deleted) == len(self._applied):
+                return
+            for doc_id in deleted - self._applied:
+                i = self._positions.get(doc_id)
+                if i is not None:
+                    for term in self.terms[self.starts[i]:self.starts[i + 1]]:
+                        self.live_dfs[term] -= 1
+            self._applied = set(deleted)
+
+class SegmentedIndex:
+    """
+    Index that is updated incrementally with segments. It has the functions of the
+    index classes that are used by the query processors, so it can be given to
+    BooleanQueryProcessor / QueryProcessor (index=...).
+
+    functions:
+    - load: open the segments of the manifest
+    - add_documents / add_sgm_files: index new documents to a new segment
+    - delete_documents: mark documents as deleted
+    - get, universe, merge, union, difference: same as the index class
+    - statistics: collection statistics of the live documents (positional indexes)
+    - merge_segments: merge some segments to one (maybe_merge runs the merge policy)
+    - wait_for_merges: wait until the background merge ends
+    """
+
+    def __init__(self, index_class=InvertedIndex, directory="segments", merge_factor=default_merge_factor,
+                 background_merge=True, memory_budget=default_memory_budget) -> None:
+        """
+        - index_class -> InvertedIndex or PositionalInvertedIndex
+        - directory -> folder of the segment files and the manifest
+        - merge_factor -> number of segments of a similar size that are merged
+        - background_merge -> merge in a thread, otherwise merges run in add/delete
+        """
+        if merge_factor < 2:
+            raise ValueError(f"merge_factor must be at least 2, not {merge_factor}")
+        self.index_class = index_class
+        self.directory = directory
+        self.merge_factor = merge_factor
+        self.background_merge = background_merge
+        self.memory_budget = memory_budget
+
+        # Empty index of the same class, it is used for the set operations
+        self._template = index_class(memory_budget=memory_budget)
+        self.universe_term = self._template.universe_term
+        self.pseudo_terms = self._template.pseudo_terms
+
+        # The list is replaced (not changed) on each update, so a query can use a snapshot
+        self.segments = []
+        self.generation = 0
+        self._next_segment = 0
+        self._lock = threading.RLock()
+        self._merge_lock = threading.Lock()
+        self._merge_thread = None
+
+        self._universe = None
+        self._statistics = None
+        self._dfs = None
+        self._cached_generation = None
+
+    def load(self) -> bool:
+        """
+        Open the segments of the manifest. Returns False if there is no manifest.
+        """
+        try:
+            with open(os.path.join(self.directory, manifest_name)) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            print("[LOG] Segment manifest not found!")
+            return False
+
+        with self._lock:
+            self.segments = [Segment(entry["name"], self._open(entry["name"]), entry["deleted"])
+                             for entry in manifest["segments"]]
+            self._next_segment = manifest["next_segment"]
+            self.generation += 1
+
+        print(f"[Done] {len(self.segments)} segments are loaded!")
+        return True
+
+    def add_documents(self, docs) -> int:
+        """
+        Index the given (not normalized) Documents to a new segment.
+        If a document id is already in the index, the old document is replaced.
+
+        Returns the number of added documents.
+        """
+        # The last one of the same id is kept
+        docs = {doc.id: doc for doc in docs}
+        if not docs:
+            return 0
+
+        builder = self.index_class(memory_budget=self.memory_budget)
+        builder._index_documents(builder.sgmp._normalize(doc) for doc in docs.values())
+
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock:
+            name = self._new_segment_name()
+        write_index(self._path(name), builder.dictionary, self._template.index_kind, self.pseudo_terms)
+        # The statistics are taken from the postings in memory, the segment file is not decoded
+        segment = Segment(name, self._open(name), statistics=self._segment_statistics(builder.dictionary))
+
+        with self._lock:
+            for old in self.segments:
+                old.deleted.update(doc_id for doc_id in docs if doc_id in old)
+            self.segments = self.segments + [segment]
+            self._changed()
+
+        self.maybe_merge()
+        return len(docs)
+
+    def add_sgm_files(self, sgm_files) -> int:
+        """
+        Index the documents of the given sgm files (in the dataset folder) to a new segment
+        """
+        sgmp = self._template.sgmp
+        docs = (doc for sgm in sgm_files for doc in sgmp._parse_documents(sgmp._read_chunks(sgm)))
+        return self.add_documents(docs)
+
+    def delete_documents(self, doc_ids) -> int:
+        """
+        Mark the given documents as deleted. Returns the number of deleted documents.
+        """
+        doc_ids = set(doc_ids)
+        count = 0
+        with self._lock:
+            for segment in self.segments:
+                for doc_id in doc_ids:
+                    if doc_id in segment and doc_id not in segment.deleted:
+                        segment.deleted.add(doc_id)
+                        count += 1
+            if count:
+                self._changed()
+
+        if count:
+            self.maybe_merge()
+        return count
+
+    def get(self, token):
+        """
+        Live posting of the token, merged from all segments
+        """
+        return self._merged_posting(self.segments, token)
+
+    def universe(self):
+        """
+        Posting of all live documents. The live ids of each segment are kept, so only
+        the segments with new tombstones are filtered again.
+        """
+        self._check_cache()
+        if self._universe is None:
+            with self._lock:
+                segments = [(segment, set(segment.deleted)) for segment in self.segments]
+            # The runs are sorted, so sorting them together is a merge
+            ids = sorted(chain.from_iterable(segment.live_ids(deleted) for segment, deleted in segments))
+            self._universe = PositionalPosting.from_doc_ids(ids) if self._is_positional() else CompressedPosting(ids)
+        return self._universe
+
+    def merge(self, l, r):
+        return self._template.merge(l, r)
+
+    def union(self, l, r):
+        return self._template.union(l, r)
+
+    def difference(self, l, r):
+        return self._template.difference(l, r)
+
+    def keys(self):
+        """
+        Sorted tokens of all segments (some of them may have only deleted documents)
+        """
+        tokens = set()
+        for segment in self.segments:
+            tokens.update(token for token in segment.index.dictionary.keys() if token not in self.pseudo_terms)
+        return sorted(tokens)
+
+    def postings(self):
+        """
+        (token, live posting) pairs, the tokens without live documents are skipped
+        """
+        segments = self.segments
+        for token in self.keys():
+            posting = self._merged_posting(segments, token)
+            if len(posting):
+                yield token, posting
+
+    def statistics(self):
+        """
+        Collection statistics of the live documents (only for positional indexes).
+
+        They are updated at the first call after a change: N and the df values are the
+        sums of the live values of the segments (tombstones are subtracted once), then
+        a new idf changes the norms, so the norms and the bounds are computed from the
+        terms of the documents (SegmentStatistics). The postings are not decoded again.
+        """
+        self._check_cache()
+        if self._statistics is None:
+            with self._lock:
+                segments = [(segment, set(segment.deleted)) for segment in self.segments]
+            self._statistics = self._collection_statistics(segments)
+        return self._statistics
+
+    def df(self, token) -> int:
+        """
+        Number of the live documents of the token. The df values are summed from the
+        segment statistics once after each change, the postings are not read.
+        """
+        self._check_cache()
+        if self._dfs is None:
+            with self._lock:
+                segments = [(segment, set(segment.deleted)) for segment in self.segments]
+            self._dfs = self._document_frequencies(segments)
+        return self._dfs.get(token, 0)
+
+    def _document_frequencies(self, segments):
+        """
+        token -> live df of the (segment, deleted ids) pairs, the tokens without live documents are skipped
+        """
+        dfs = {}
+        for segment, deleted in segments:
+            segment_statistics = segment.statistics()
+            segment_statistics.apply_tombstones(deleted)
+            for token, df in zip(segment_statistics.tokens, segment_statistics.live_dfs):
+                if df:
+                    dfs[token] = dfs.get(token, 0) + df
+        return dfs
+
+    def _collection_statistics(self, segments):
+        """
+        CollectionStatistics of the (segment, deleted ids) pairs, like CollectionStatistics.from_postings
+        computes them from the merged live postings
+        """
+        N = sum(len(segment.live_ids(deleted)) for segment, deleted in segments)
+        dfs = self._document_frequencies(segments)
+
+        statistics = CollectionStatistics()
+        statistics.N = N
+        for token in sorted(dfs):
+            statistics.terms.add(token)
+            statistics.dfs.append(dfs[token])
+            statistics.idfs.append(calculate_idf(N, dfs[token]))
+        statistics.bounds = array("d", [0.0] * len(statistics.dfs))
+
+        size = max((segment.statistics().doc_ids[-1] + 1 for segment, _ in segments if segment.statistics().doc_ids),
+                   default=0)
+        statistics.norms = array("d", [0.0] * size)
+        statistics.lengths = array("I", [0] * size)
+
+        # The norms with the idf values of the collection, then the bounds with the norms
+        idfs, norms, bounds = statistics.idfs, statistics.norms, statistics.bounds
+        for segment, deleted in segments:
+            segment_statistics = segment.statistics()
+            term_ids = [statistics.terms.get(token) for token in segment_statistics.tokens]
+            term_idfs = [0 if term_id is None else idfs[term_id] for term_id in term_ids]
+            starts, terms, weights = segment_statistics.starts, segment_statistics.terms, segment_statistics.weights
+
+            for i, doc_id in enumerate(segment_statistics.doc_ids):
+                if doc_id in deleted:
+                    continue
+                square = 0.0
+                for j in range(starts[i], starts[i + 1]):
+                    weight = weights[j] * term_idfs[terms[j]]
+                    square += weight * weight
+                norm = norms[doc_id] = math.sqrt(square)
+                statistics.lengths[doc_id] = segment_statistics.lengths[i]
+                if not norm:
+                    continue
+                for j in range(starts[i], starts[i + 1]):
+                    term_id = term_ids[terms[j]]
+                    bound = weights[j] * term_idfs[terms[j]] / norm
+                    if bound > bounds[term_id]:
+                        bounds[term_id] = bound
+        return statistics
+
+    def maybe_merge(self):
+        """
+        Run the merge policy, in a background thread if background_merge is set
+        """
+        if not self.background_merge:
+            self._merge_pending()
+            return
+
+        with self._lock:
+            if self._merge_thread is not None:
+                return
+            self._merge_thread = threading.Thread(target=self._merge_pending, daemon=True)
+            self._merge_thread.start()
+
+    def wait_for_merges(self):
+        thread = self._merge_thread
+        while thread is not None:
+            thread.join()
+            thread = self._merge_thread
+
+    def merge_segments(self, segments=None):
+        """
+        Merge the given segments (all segments by default) to one segment.
+        Deleted documents are removed from the merged segment.
+        """
+        with self._merge_lock:
+            self._merge_segments(segments)
+
+    def _merge_segments(self, segments):
+        with self._lock:
+            # A segment that is already merged by another merge is skipped
+            segments = [segment for segment in self.segments if segments is None or segment in segments]
+            # Deleted ids at the start, the ones that are deleted during the merge are kept
+            deleted = {segment.name: set(segment.deleted) for segment in segments}
+            name = self._new_segment_name()
+        if not segments:
+            return
+
+        dictionary = {}
+        tokens = set()
+        for segment in segments:
+            tokens.update(token for token in segment.index.dictionary.keys() if token not in self.pseudo_terms)
+        for token in sorted(tokens):
+            lists = [_live_posting(segment.index.get(token), deleted[segment.name]) for segment in segments]
+            lists = [posting for posting in lists if len(posting)]
+            if lists:
+                dictionary[token] = self._template._merge_postings(lists)
+
+        ids = heapq.merge(*(_live_ids(segment.doc_ids(), deleted[segment.name]) for segment in segments))
+        dictionary[self.universe_term] = CompressedPosting(ids)
+        write_index(self._path(name), dictionary, self._template.index_kind, self.pseudo_terms)
+        statistics = self._segment_statistics(dictionary)
+
+        with self._lock:
+            merged = Segment(name, self._open(name), statistics=statistics)
+            for segment in segments:
+                merged.deleted.update(segment.deleted - deleted[segment.name])
+
+            names = set(deleted)
+            position = min(i for i, segment in enumerate(self.segments) if segment.name in names)
+            remains = [segment for segment in self.segments if segment.name not in names]
+            self.segments = remains[:position] + [merged] + remains[position:]
+            self._save_manifest()
+
+        # A query may still use a snapshot with the merged segments, so their mmaps are not
+        # closed here (the last reference closes them). The open mmaps keep the removed files readable.
+        for segment in segments:
+            try:
+                os.remove(self._path(segment.name))
+            except OSError:
+                pass
+
+    def _merge_pending(self):
+        """
+        Merge the segments selected by the merge policy until there is nothing to merge
+        """
+        while True:
+            with self._lock:
+                segments = self._select_merge()
+                if not segments:
+                    self._merge_thread = None
+                    return
+            try:
+                self.merge_segments(segments)
+            except Exception as e:
+                print(f"[LOG] Segment merge is failed: {e}")
+                with self._lock:
+                    self._merge_thread = None
+                return
+
+    def _select_merge(self):
+        """
+        Merge policy: a segment with more deleted than live documents is merged alone
+        (its deleted documents are removed). Otherwise the oldest merge_factor segments
+        of the same size tier (log of the number of documents) are merged.
+        """
+        tiers = {}
+        for segment in self.segments:
+            if len(segment.deleted) > segment.live_size():
+                return [segment]
+            tier = int(math.log(max(segment.live_size(), 1), self.merge_factor))
+            tiers.setdefault(tier, []).append(segment)
+
+        for tier in sorted(tiers):
+            if len(tiers[tier]) >= self.merge_factor:
+                return tiers[tier][:self.merge_factor]
+        return None
+
+    def _merged_posting(self, segments, token):
+        lists = [_live_posting(segment.index.get(token), segment.deleted) for segment in segments]
+        lists = [posting for posting in lists if len(posting)]
+        if not lists:
+            return self._template.get(token)
+        return self._template._merge_postings(lists)
+
+    def _is_positional(self):
+        return self._template.index_kind == positional_kind
+
+    def _segment_statistics(self, dictionary):
+        """
+        SegmentStatistics of the dictionary of a new segment, from its postings in memory
+        """
+        return SegmentStatistics.from_dictionary(dictionary, self.pseudo_terms)
+
+    def _check_cache(self):
+        if self._cached_generation != self.generation:
+            self._universe = None
+            self._statistics = None
+            self._dfs = None
+            self._cached_generation = self.generation
+
+    def _changed(self):
+        """
+        Called with the lock after the live documents are changed
+        """
+        self.generation += 1
+        self._save_manifest()
+
+    def _new_segment_name(self):
+        name = f"segment_{self._next_segment:06d}"
+        self._next_segment += 1
+        return name
+
+    def _path(self, name):
+        return os.path.join(self.directory, name + ".idx")
+
+    def _open(self, name):
+        index = self.index_class(memory_budget=self.memory_budget)
+        index.dictionary = MappedDictionary(self._path(name))
+        return index
+
+    def _save_manifest(self):
+        manifest = {
+            "next_segment": self._next_segment,
+            "segments": [{"name": segment.name, "deleted": sorted(segment.deleted)} for segment in self.segments],
+        }
+        path = os.path.join(self.directory, manifest_name)
+        with open(path + ".tmp", "w") as f:
+            json.dump(manifest, f)
+        os.replace(path + ".tmp", path)
+
+def _live_ids(doc_ids, deleted):
+    return [doc_id for doc_id in doc_ids if doc_id not in deleted] if deleted else list(doc_ids)
+
+def _live_posting(posting, deleted):
+    """
+    The posting without the deleted documents
+    """
+    if not deleted:
+        return posting
+    if isinstance(posting, PositionalPosting):
+        return PositionalPosting.from_entries((doc_id, positions) for doc_id, positions in posting if doc_id not in deleted)
+    return [doc_id for doc_id in posting if doc_id not in deleted]
@@ -0,0 +1,299 @@
+"""
+Asyncio query server with a JSON protocol over HTTP (TCP or a unix socket).
+
+Endpoints:
+- GET /health -> {"status": "ok", "in_flight": ..., "max_pending": ..., "workers": ...}
+- POST /query  -> request:  {"query": "oil AND price", "mode": "boolean"}
+                             {"query": "hate love cry", "mode": "ranked", "top_k": 10, "deadline": 2.5}
+                             {"query": "oil OR price", "mode": "boolean", "top_k": 10, "offset": 20}
+                  response: {"query": ..., "mode": ..., "results": [...], "took_ms": ...}
+
+mode is "boolean" (BooleanQueryProcessor) or "ranked" (QueryProcessor, it also runs
+phrase and proximity queries). top_k is the number of results (the best ones, or the
+first ones of a boolean query) and offset skips the first results for paging. Queries are evaluated in a pool of worker processes,
+every worker loads the indexes once when it starts (binary indexes are mmapped, so
+the workers share the page cache). The event loop only parses the requests, so
+many requests are served concurrently.
+
+- backpressure -> when max_pending queries are running or waiting, new queries
+                  get 503 (with Retry-After) instead of waiting in an unbounded queue
+- deadline -> a query that does not finish in its deadline gets 504
+- errors -> an invalid query gets 400 with the message of the QueryError, any other
+            error (e.g. a worker process died) gets 500 and the connection stays usable
+"""
+import os
+import json
+import time
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from src.query_worker import modes, prepare_indexes, load_processors, run_query, ready
+
+"""
+Here are some global variables
+"""
+default_deadline = 10.0
+max_body_size = 1 << 20
+reasons = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable",
+           504: "Gateway Timeout"}
+# Workers are not forked from the server process, so they never get a copy of its client sockets
+# (a copied socket keeps a closed connection open until the worker exits)
+start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+class HTTPError(Exception):
+    def __init__(self, status, message, headers=None) -> None:
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+class QueryServer:
+    """
+    Asyncio HTTP server of the query processors.
+
+    Usage:
+        QueryServer(port=8080).run()                 # TCP
+        QueryServer(unix_path="/tmp/search.sock").run()
+    """
+
+    def __init__(self, host="127.0.0.1", port=8080, unix_path=None, workers=None,
+                 max_pending=64, deadline=default_deadline, modes=modes, correct_spelling=False) -> None:
+        """
+        - workers -> number of worker processes (cpu count by default)
+        - max_pending -> max number of queries that are running or waiting
+        - deadline -> default deadline of a query in seconds
+        - modes -> query processors that are loaded ("boolean", "ranked")
+        - correct_spelling -> spelling correct the unknown query words (see src.spelling)
+        """
+        self.host = host
+        self.port = port
+        self.unix_path = unix_path
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending
+        self.deadline = deadline
+        self.modes = tuple(modes)
+        self.correct_spelling = correct_spelling
+
+        self.in_flight = 0
+        self.served = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._pool = None
+        self._restart_lock = None
+        self._server = None
+        self._started = None
+
+    async def start(self):
+        """
+        Start the worker processes (they load the indexes) and the server.
+        A missing index is built here once, before the workers start.
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, prepare_indexes, self.modes, self.correct_spelling)
+
+        self._pool = self._new_pool()
+        self._restart_lock = asyncio.Lock()
+        await asyncio.gather(*(loop.run_in_executor(self._pool, ready) for _ in range(self.workers)))
+
+        if self.unix_path:
+            self._server = await asyncio.start_unix_server(self._handle, path=self.unix_path)
+            address = self.unix_path
+        else:
+            self._server = await asyncio.start_server(self._handle, self.host, self.port)
+            self.port = self._server.sockets[0].getsockname()[1]
+            address = f"http://{self.host}:{self.port}"
+
+        self._started = time.monotonic()
+        print(f"[Done] Query server is listening on {address} with {self.workers} workers")
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=load_processors,
+                                   initargs=(self.modes, self.correct_spelling),
+                                   mp_context=multiprocessing.get_context(start_method))
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+
+    async def serve_forever(self):
+        await self.start()
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.stop()
+
+    def run(self):
+        try:
+            asyncio.run(self.serve_forever())
+        except KeyboardInterrupt:
+            pass
+
+    def health(self):
+        return {
+            "status": "ok",
+            "modes": list(self.modes),
+            "workers": self.workers,
+            "in_flight": self.in_flight,
+            "max_pending": self.max_pending,
+            "served": self.served,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "uptime": time.monotonic() - self._started if self._started else 0,
+        }
+
+    async def query(self, request):
+        """
+        Run the query of a request dict in the worker pool
+        """
+        q = request.get("query")
+        mode = request.get("mode", "ranked")
+        top_k = request.get("top_k")
+        offset = request.get("offset", 0)
+        deadline = request.get("deadline", self.deadline)
+
+        if not isinstance(q, str):
+            raise HTTPError(400, "query must be a string")
+        if mode not in self.modes:
+            raise HTTPError(400, f"mode must be one of {list(self.modes)}")
+        if top_k is not None and (not isinstance(top_k, int) or isinstance(top_k, bool) or top_k < 0):
+            raise HTTPError(400, "top_k must be a non-negative integer")
+        if not isinstance(offset, int) or isinstance(offset, bool) or offset < 0:
+            raise HTTPError(400, "offset must be a non-negative integer")
+        if not isinstance(deadline, (int, float)) or deadline <= 0:
+            raise HTTPError(400, "deadline must be a positive number")
+
+        if self.in_flight >= self.max_pending:
+            self.rejected += 1
+            raise HTTPError(503, "Server is busy, please retry later", {"Retry-After": "1"})
+
+        # The slot is released when the worker finishes, also after a timeout,
+        # so the number of running queries never goes over max_pending
+        start = time.perf_counter()
+        pool = self._pool
+        try:
+            future = asyncio.get_running_loop().run_in_executor(pool, run_query, mode, q, top_k, offset)
+            self.in_flight += 1
+            future.add_done_callback(self._release)
+            ok, value, _ = await asyncio.wait_for(asyncio.shield(future), deadline)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise HTTPError(504, f"Query did not finish in {deadline} seconds")
+        except BrokenProcessPool:
+            await self._restart_pool(pool)
+            raise HTTPError(500, "A worker process died while running the query")
+
+        if not ok:
+            raise HTTPError(400, value)
+
+        self.served += 1
+        return {"query": q, "mode": mode, "results": value, "took_ms": (time.perf_counter() - start) * 1000}
+
+    async def _restart_pool(self, broken):
+        """
+        A broken pool (one of its workers died) cannot run any query again, so it is
+        replaced once, after the threads of the broken pool are stopped.
+        """
+        async with self._restart_lock:
+            if self._pool is not broken:
+                return
+            print("[LOG] A worker process of the query server died, the workers are started again")
+            await asyncio.get_running_loop().run_in_executor(None, broken.shutdown)
+            self._pool = self._new_pool()
+
+    def _release(self, future):
+        self.in_flight -= 1
+
+    async def _handle(self, reader, writer):
+        """
+        Serve the requests of one connection (keep-alive until the client closes it)
+        """
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+
+                try:
+                    status, response, extra_headers = 200, await self._route(method, path, body), {}
+                except HTTPError as e:
+                    status, response, extra_headers = e.status, {"error": str(e)}, e.headers
+                except Exception as e:
+                    print(f"[LOG] {method} {path} failed: {e!r}")
+                    status, response, extra_headers = 500, {"error": "Internal server error"}, {}
+
+                keep_alive = headers.get("connection", "").lower() != "close"
+                self._write_response(writer, status, response, extra_headers, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except HTTPError as e:
+            self._write_response(writer, e.status, {"error": str(e)}, e.headers, False)
+        finally:
+            writer.close()
+
+    async def _route(self, method, path, body):
+        if path == "/health":
+            if method != "GET":
+                raise HTTPError(405, "Use GET for /health")
+            return self.health()
+
+        if path == "/query":
+            if method != "POST":
+                raise HTTPError(405, "Use POST for /query")
+            try:
+                request = json.loads(body or b"{}")
+            except ValueError:
+                raise HTTPError(400, "Body must be a JSON object")
+            if not isinstance(request, dict):
+                raise HTTPError(400, "Body must be a JSON object")
+            return await self.query(request)
+
+        raise HTTPError(404, f"{path} is not found")
+
+    async def _read_request(self, reader):
+        """
+        Read one HTTP request. Returns (method, path, headers, body) or None at the end of the connection.
+        """
+        line = await reader.readline()
+        if not line:
+            return None
+        try:
+            method, path, _ = line.decode("latin-1").split(" ", 2)
+        except ValueError:
+            raise HTTPError(400, "Bad request line")
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        try:
+            length = int(headers.get("content-length", 0) or 0)
+        except ValueError:
+            raise HTTPError(400, "Content-Length must be an integer")
+        if length < 0:
+            raise HTTPError(400, "Content-Length must be an integer")
+        if length > max_body_size:
+            raise HTTPError(413, "Request body is too large")
+        body = await reader.readexactly(length) if length else b""
+        return method.upper(), path.split("?", 1)[0], headers, body
+
+    def _write_response(self, writer, status, response, headers, keep_alive):
+        body = json.dumps(response).encode("utf-8")
+        lines = [f"HTTP/1.1 {status} {reasons.get(status, '')}",
+                 "Content-Type: application/json",
+                 f"Content-Length: {len(body)}",
+                 f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
@@ -3,7 +3,8 @@ import re
 import time
 from dataclasses import dataclass
 
-from src.base import BaseTextProcessor, BaseDataAccess
+from src.base import BaseTextProcessor
+from src.instrumentation import span, count
 
 """
 Here are some global variables
@@ -21,70 +22,155 @@ class Document():
     id: int
     content: str
 
+"""
+Precompiled patterns of the parser.
+A document is found with the first two patterns, then its NEWID, TITLE and BODY
+are scanned in one pass with the third one.
+"""
+doc_start = "<REUTERS"
+doc_end = "</REUTERS>"
+field_pattern = re.compile("NEWID=\"(.*?)\">|<TITLE>(.*?)</TITLE>|<BODY>(.*?)</BODY>", re.DOTALL)
+
 class SGMPreprocessor(BaseTextProcessor):
 
-    def __init__(self) -> None:
-        self._dataset = dataset_path
+    def __init__(self, chunk_size=1 << 20, dataset=None) -> None:
+        """
+        - chunk_size -> number of characters read from a sgm file at once
+        - dataset -> folder of the sgm files, dataset_path by default
+        """
+        self._dataset = dataset or dataset_path
         self._docs = [] # List of Document
+        self._chunk_size = chunk_size
 
         super().__init__()
 
-    def _sgm_parser(self, content):
+    def _parse_documents(self, chunks):
+        """
+        Generator that parses the documents from the given text chunks.
+        Only the unfinished document is kept between two chunks, and the search of
+        its end continues where the last one stopped, so a long document is scanned once.
+        """
+        buffer = ""
+        scan = 0 # Offset of the buffer where the search of doc_end continues
+        for chunk in chunks:
+            buffer += chunk
+            pos = 0
+
+            while True:
+                end = buffer.find(doc_end, scan)
+                if end == -1:
+                    break
+                begin = buffer.find(doc_start, pos, end)
+                pos = scan = end + len(doc_end)
+
+                if begin == -1:
+                    continue
+
+                with span("ingest.parse"):
+                    document = self._parse_document(buffer[begin:pos])
+                if document:
+                    count("ingest.documents")
+                    yield document
+
+            # Trim the consumed prefix. The last len(doc_end) - 1 characters are searched
+            # again, they may be the start of a doc_end split by the next chunk.
+            buffer = buffer[pos:]
+            scan = max(len(buffer) - len(doc_end) + 1, 0)
+
+    def _parse_document(self, doc):
+        """
+        Parse one <REUTERS> element to Document with the precompiled field pattern.
+        Returns None if there is no id information.
+        """
+        id, title, body = None, None, None
+        for match in field_pattern.finditer(doc):
+            if match.group(1) is not None:
+                id = match.group(1) if id is None else id
+            elif match.group(2) is not None:
+                title = match.group(2) if title is None else title
+            elif body is None:
+                body = match.group(3)
+
+        # Continue with another document if there is no id information
+        if id is None:
+            return None
+
+        # Create content with joining title and body strings
+        # If they not exist then an empty string is used
+        # Note: join will append a whitespace between two strings
+        content = " ".join([title or "", body or ""])
+
+        return Document(int(id), content)
+
+    def _read_chunks(self, sgm):
         """
-        SGM parser to parse sgm file to id, title and body.
-        This function create the `self._docs` i.e list of Document
+        Generator that reads the given sgm file chunk by chunk.
+        New lines are replaced with whitespace as like BaseDataAccess.read does.
         """
+        with open(os.path.join(os.getcwd(), self._dataset, sgm), encoding='latin-1') as f:
+            while True:
+                with span("ingest.read"):
+                    chunk = f.read(self._chunk_size)
+                if not chunk:
+                    break
+                count("ingest.characters", len(chunk))
+                yield chunk.replace('\n', ' ')
+
+    def _normalize(self, doc):
+        """
+        Case folding and punctuation removing for content of the given document
+        """
+        with span("preprocess.normalize"):
+            self._text = doc.content
+            self.case_folding()
+            self.punctuation_remove()
+            doc.content = self._text
+        return doc
 
-        for doc in re.finditer("<REUTERS(.*?)</REUTERS>", content, re.DOTALL):
-            doc = doc.group(0)
-            
-            # Get the id from doc
-            # But continue with another document if there is no id information
-            id = re.findall("NEWID=\"(.*?)\">", doc, re.DOTALL)
-            if not id:
-                continue
+    def iter_documents(self, sgm_files=None):
+        """
+        Generator that yields the normalized documents one by one.
 
-            # Get the title and body informations
-            title = re.findall("<TITLE>(.*?)</TITLE>", doc, re.DOTALL)
-            body = re.findall("<BODY>(.*?)</BODY>", doc, re.DOTALL)
-            
-            # If they not exist then assign them an empty string
-            title = title[0] if title else ""
-            body = body[0] if body else ""
+        The documents are not kept in memory, so the index builders can consume
+        them as a stream. If there is no file list given, all of the .sgm files
+        in dataset folder are used.
+        """
+        if sgm_files is None:
+            sgm_files = self.sgm_files()
 
-            # Create content with joining title and body strings
-            # Note: join will append a whitespace between two strings
-            content = " ".join([title, body])
+        for sgm in sgm_files:
+            for doc in self._parse_documents(self._read_chunks(sgm)):
+                yield self._normalize(doc)
+
+    def sgm_files(self):
+        """
+        List the .sgm files in dataset folder in a stable(sorted) order
+        """
+        return sorted(path for path in os.listdir(self._dataset) if path.endswith('sgm'))
 
-            # Create Document with id and content
-            document = Document(int(id[0]), content)
-            self._docs.append(document)
+    def run(self, sgm_files=None):
+        """
+        Parse and preprocess the given sgm files and keep the documents in self._docs.
+        If there is no file list given, all of the .sgm files in dataset folder are used.
 
-    def run(self):
+        Note: iter_documents should be preferred for big collections.
+        """
         
         start_parsing = time.perf_counter()
 
-        # List the .sgm file in dataset folder
-        sgm_files = [path for path in os.listdir(self._dataset) if path.endswith('sgm')]
-
-        # Iterate over docs and create self._docs list
-        for sgm in sgm_files:
-            sgm_content = self.data.read(os.path.join(self._dataset, sgm), encoding='latin-1')
-            self._sgm_parser(sgm_content)
+        self._docs.extend(self.iter_documents(sgm_files))
         
         end_parsing = time.perf_counter()
-        print(f"[Done] SGM files are parsed in {end_parsing - start_parsing:0.4f} seconds")
+        print(f"[Done] SGM files are parsed and preprocessed in {end_parsing - start_parsing:0.4f} seconds")
 
-        for doc in self._docs:
-            self._text = doc.content
-            self.case_folding()
-            self.punctuation_remove()
-            doc.content = self._text
         
-        end_preprocess = time.perf_counter()
-        print(f"[Done] Documents are preprocessed in {end_preprocess - end_parsing:0.4f} seconds")
+    @property
+    def dataset(self):
+        """
+        Folder of the sgm files
+        """
+        return self._dataset
 
-        
     @property
     def docs(self):
         """
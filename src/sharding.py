@@ -0,0 +1,290 @@
+"""
+Document partitioned sharding with scatter-gather query execution.
+
+The documents are split into shards by doc id (hash: doc_id % shards, or range:
+sorted boundary ids). Every shard is a complete index of its own documents and it
+is served by its own worker process, so queries are not limited by one GIL.
+
+The coordinator (ShardedQueryProcessor) sends each query to all shards and merges
+their results. The wildcard tokens are expanded once by the coordinator with the
+terms of all shards, so every shard searches (and weights) the same terms:
+- boolean -> sorted doc id lists are merged (the shards have different documents)
+- phrase / proximity -> results are merged by doc id
+- ranked -> the best (doc_id, cosine) pairs of each shard are merged to the global
+            ranking, then the coordinator formats the result strings
+
+Ranking needs the statistics of the whole collection. The document frequencies of
+all shards are summed at build time, then every shard computes its idf values, norms
+and bounds with the global N and df, so the scores are the same as one index.
+"""
+import os
+import json
+import heapq
+import time
+import multiprocessing
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+
+from src.inverted_intex import InvertedIndex
+from src.positional_inverted_index import PositionalInvertedIndex
+from src.boolean_query_processor import BooleanQueryProcessor
+from src.query_processor import QueryProcessor, format_ranking
+from src.disk_index import MappedDictionary, positional_kind
+from src.collection_statistics import CollectionStatistics
+from src.sgm_preprocessor import SGMPreprocessor
+from src.term_dictionary import TermDictionary, wildcard, default_max_expansions
+
+"""
+Here are some global variables
+"""
+manifest_name = "shards.json"
+
+def shard_of(doc_id, shards, partition="hash"):
+    """
+    Shard number of the document.
+
+    - partition -> "hash" (doc_id % shards) or a sorted list of shards - 1 boundary ids
+                   (range partitioning, shard i has the ids in [boundaries[i - 1], boundaries[i]))
+    """
+    if partition == "hash":
+        return doc_id % shards
+    return bisect_right(partition, doc_id)
+
+def shard_paths(directory, shard):
+    """
+    Index and statistics file paths of the shard
+    """
+    return os.path.join(directory, f"shard_{shard}.idx"), os.path.join(directory, f"shard_{shard}.stats")
+
+def build_shards(index_class=PositionalInvertedIndex, shards=4, directory="shards", partition="hash", workers=None,
+                 dataset=None):
+    """
+    Build the shard indexes. The sgm files are parsed once here and each shard gets
+    its own documents, then every shard is normalized and indexed by a worker process.
+    For positional indexes, the statistics are computed in a second step with the
+    global N and df values.
+
+    - dataset -> folder of the sgm files (sgm_preprocessor.dataset_path by default)
+
+    Returns the manifest of the shards.
+    """
+    if partition != "hash" and len(partition) != shards - 1:
+        raise ValueError(f"Range partitioning needs {shards - 1} boundaries")
+
+    start_building = time.perf_counter()
+    os.makedirs(directory, exist_ok=True)
+    workers = workers or shards
+
+    sgmp = SGMPreprocessor(dataset=dataset)
+    documents = [[] for _ in range(shards)]
+    for sgm in sgmp.sgm_files():
+        for doc in sgmp._parse_documents(sgmp._read_chunks(sgm)):
+            documents[shard_of(doc.id, shards, partition)].append(doc)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        counts = list(executor.map(_build_shard, [index_class] * shards, [directory] * shards,
+                                   range(shards), documents))
+
+        N = sum(N for N, _ in counts)
+        if index_class.index_kind == positional_kind:
+            dfs = {}
+            for _, shard_dfs in counts:
+                for token, df in shard_dfs.items():
+                    dfs[token] = dfs.get(token, 0) + df
+            list(executor.map(_build_shard_statistics, [index_class] * shards, [directory] * shards,
+                              range(shards), [N] * shards, [dfs] * shards))
+
+    manifest = {
+        "kind": index_class.index_kind,
+        "shards": shards,
+        "partition": partition,
+        "N": N,
+    }
+    with open(os.path.join(directory, manifest_name), "w") as f:
+        json.dump(manifest, f)
+
+    end_building = time.perf_counter()
+    print(f"[Done] {shards} shards are builded from {N} documents in {end_building - start_building:0.4f} seconds")
+    return manifest
+
+def _open_shard(index_class, directory, shard):
+    index = index_class()
+    index.index_path, statistics_path = shard_paths(directory, shard)
+    index.spelling_path = os.path.join(directory, f"shard_{shard}.spelling")
+    if index_class.index_kind == positional_kind:
+        index.statistics_path = statistics_path
+    return index
+
+def _build_shard(index_class, directory, shard, docs):
+    """
+    Worker function of build_shards: index the (parsed, not normalized) documents of
+    the shard. Returns the number of documents and the df values.
+    """
+    index = _open_shard(index_class, directory, shard)
+    N = index._index_documents(index.sgmp._normalize(doc) for doc in docs)
+
+    # Postings are saved now, statistics after the df values of all shards are known
+    index.save()
+
+    dfs = {}
+    if index_class.index_kind == positional_kind:
+        dfs = {token: len(posting) for token, posting in index.postings()}
+    return N, dfs
+
+def _build_shard_statistics(index_class, directory, shard, N, dfs):
+    """
+    Worker function of build_shards. Compute the statistics of the shard with the global N and df.
+    """
+    index = _open_shard(index_class, directory, shard)
+    index.dictionary = MappedDictionary(index.index_path)
+    statistics = CollectionStatistics.from_postings(index.postings(), N, dfs=dfs)
+    statistics.source_checksum = index.dictionary.checksum
+    statistics.save(index.statistics_path)
+
+def _serve_shard(connection, index_class, directory, shard):
+    """
+    Worker process of a shard. It runs the calls of the coordinator on the query
+    processor of the shard: (method name, args, wildcard expansions) -> (True, result) or (False, error)
+    """
+    index = _open_shard(index_class, directory, shard)
+    if not index.load():
+        connection.send((False, FileNotFoundError(f"{index.index_path} is not found")))
+        return
+
+    if index_class.index_kind == positional_kind:
+        processor = QueryProcessor(index=index, raw_scores=True)
+    else:
+        processor = BooleanQueryProcessor(index=index)
+    connection.send((True, None))
+
+    while True:
+        message = connection.recv()
+        if message is None:
+            break
+        method, args, processor.expansions = message
+        try:
+            connection.send((True, getattr(processor, method)(*args)))
+        except Exception as e:
+            connection.send((False, e))
+
+class ShardedQueryProcessor:
+    """
+    Coordinator of the shard processes (scatter-gather).
+
+    It has the process functions of the query processors:
+    - process(q, top_k=None, offset=0)
+    - process_batch(queries, top_k=None)
+
+    Usage:
+        with ShardedQueryProcessor("shards") as qp:
+            qp.process("hate love cry", top_k=10)
+    """
+
+    def __init__(self, directory="shards", max_expansions=default_max_expansions) -> None:
+        """
+        - directory -> folder of the shards (see build_shards)
+        - max_expansions -> max number of terms of a wildcard token like oil* (None -> no limit)
+        """
+        self.max_expansions = max_expansions
+        with open(os.path.join(directory, manifest_name)) as f:
+            self.manifest = json.load(f)
+
+        index_class = PositionalInvertedIndex if self.manifest["kind"] == positional_kind else InvertedIndex
+        self._processes = []
+        self._connections = []
+        for shard in range(self.manifest["shards"]):
+            connection, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_serve_shard, args=(child, index_class, directory, shard), daemon=True)
+            process.start()
+            self._processes.append(process)
+            self._connections.append(connection)
+
+        # Wait until all shards are loaded
+        self._gather()
+
+    def process(self, q, top_k=None, offset=0):
+        """
+        Run the query on all shards and merge the results.
+        With offset, every shard gives its first offset + top_k results, the page is cut after the merge.
+        """
+        k = None if top_k is None else offset + top_k
+        args = (q,) if k is None else (q, k)
+        return self._merge(self._scatter("process", args, self._expansions([q])), k)[offset:]
+
+    def process_batch(self, queries, top_k=None):
+        """
+        Run the queries on all shards (each shard processes the whole batch) and
+        merge the results of each query
+        """
+        results = self._scatter("process_batch", (queries, top_k), self._expansions(queries))
+        return [self._merge(shard_results, top_k) for shard_results in zip(*results)]
+
+    def close(self):
+        for connection in self._connections:
+            connection.send(None)
+        for process in self._processes:
+            process.join()
+        self._connections, self._processes = [], []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _scatter(self, method, args, expansions=None):
+        for connection in self._connections:
+            connection.send((method, args, expansions or {}))
+        return self._gather()
+
+    def _expansions(self, queries):
+        """
+        Pattern -> terms of the wildcard tokens of the queries in the whole collection.
+        The terms of all shards are joined, then the pattern is expanded (and limited by
+        max_expansions) like on one index.
+        """
+        if not any(wildcard in q for q in queries):
+            return {}
+
+        terms = {}
+        for shard_terms in self._scatter("wildcard_terms", (queries,)):
+            for pattern, pattern_terms in shard_terms.items():
+                terms.setdefault(pattern, set()).update(pattern_terms)
+        return {pattern: TermDictionary(pattern_terms).expand(pattern, self.max_expansions)
+                for pattern, pattern_terms in terms.items()}
+
+    def _gather(self):
+        """
+        Receive one answer from every shard. An error of a shard is raised after
+        all answers are received, so the pipes stay in order.
+        """
+        results, error = [], None
+        for connection in self._connections:
+            ok, value = connection.recv()
+            if ok:
+                results.append(value)
+            elif error is None:
+                error = value
+        if error is not None:
+            raise error
+        return results
+
+    def _merge(self, results, top_k=None):
+        """
+        Merge the sorted results of the shards with the order of their type
+        """
+        first = next((result[0] for result in results if result), None)
+        if first is None:
+            return []
+
+        if isinstance(first, dict):
+            merged = heapq.merge(*results, key=lambda match: match["doc_id"])
+        elif isinstance(first, tuple):
+            # (doc_id, cosine) pairs: higher cosine first, then lower doc id
+            merged = heapq.merge(*results, key=lambda ranked: (-ranked[1], ranked[0]))
+        else:
+            merged = heapq.merge(*results)
+
+        merged = list(merged)
+        merged = merged[:top_k] if top_k is not None else merged
+        return format_ranking(merged) if isinstance(first, tuple) else merged
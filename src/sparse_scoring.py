@@ -0,0 +1,239 @@
+"""
+Vectorized scoring backend for the free text queries (optional).
+
+The tf-idf weights of the positional index are kept as a CSR document-term matrix
+with precomputed row norms (document vector lengths). Many queries are scored
+together: the queries are a sparse (queries x vocabulary) matrix and all cosine
+similarities are found with one sparse matrix product, then the best k documents
+of each query are selected with argpartition.
+
+It needs NumPy and SciPy. If they are not installed, available is False and
+SparseScorer raises ImportError.
+"""
+import math
+from collections import Counter
+
+from src.metrics import calculate_tf
+
+try:
+    import numpy as np
+    from scipy import sparse
+    available = True
+except ImportError:
+    np = None
+    sparse = None
+    available = False
+
+"""
+Here are some global variables
+"""
+# Number of queries scored with one matrix product (it limits the memory of a batch)
+batch_size = 1024
+
+class SparseScorer:
+    """
+    Document-term matrix of a PositionalInvertedIndex.
+
+    - search: rank a batch of free text queries, same results as QueryProcessor.process
+    - query_matrix: sparse matrix of the query weights
+    - score: cosine similarities of a query matrix (queries x documents)
+    - top_k: best k documents of each row of a score matrix
+    """
+
+    def __init__(self, index) -> None:
+        """
+        - index -> PositionalInvertedIndex (built or loaded)
+        """
+        if not available:
+            raise ImportError("SparseScorer needs numpy and scipy, please install them")
+
+        statistics = self._statistics = index.statistics()
+
+        self.doc_ids = np.array(index.universe().doc_ids, dtype=np.int64)
+        self.terms = {}
+        self.idf = []
+
+        # One empty array each, so an index without postings gives an empty matrix
+        rows, cols, tfs, idfs = ([np.zeros(0, dtype=np.int64)] for _ in range(4))
+        for token, posting in index.postings():
+            column = len(self.terms)
+            self.terms[token] = column
+            idf = statistics.idf(token)
+            self.idf.append(idf)
+
+            doc_ids = np.array(posting.doc_ids, dtype=np.int64)
+            rows.append(np.searchsorted(self.doc_ids, doc_ids))
+            cols.append(np.full(len(doc_ids), column, dtype=np.int64))
+            tfs.append(np.diff(np.array(posting.offsets, dtype=np.int64)))
+            idfs.append(np.full(len(doc_ids), idf))
+
+        shape = (len(self.doc_ids), len(self.terms))
+        rows, cols = np.concatenate(rows), np.concatenate(cols)
+        weights = (1 + np.log(np.concatenate(tfs))) * np.concatenate(idfs)
+
+        # Transposed (vocabulary x documents), so a query matrix is multiplied directly
+        self._weights = sparse.csr_matrix((weights, (rows, cols)), shape=shape).T.tocsr()
+        self._squares = self._weights.multiply(self._weights).tocsr()
+        self._presence = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=shape).T.tocsr()
+        self.norms = np.array([statistics.norm(doc_id) for doc_id in self.doc_ids.tolist()])
+
+    def query_matrix(self, token_lists):
+        """
+        Sparse matrices of the queries (one row per token list):
+        - weights -> count * log scaled tf * idf of each token
+        - repeats -> count - 1 of each repeated token
+        - query_norms -> query vector lengths
+
+        A token repeated in the query takes place more than once in the query and
+        document vectors, like QueryProcessor._free_text_query_operations.
+        """
+        weight_entries, repeat_entries = ([], [], []), ([], [], [])
+        query_norms = []
+
+        for row, tokens in enumerate(token_lists):
+            length = 0
+            for token, count in Counter(tokens).items():
+                # The idf comes from the statistics, so a token without a column (e.g. in
+                # another shard) still counts in the query length
+                query_weight = calculate_tf(count) * self._statistics.idf(token)
+                length += count * query_weight * query_weight
+                column = self.terms.get(token)
+                if column is None:
+                    continue
+                _append(weight_entries, row, column, count * query_weight)
+                if count > 1:
+                    _append(repeat_entries, row, column, count - 1)
+            query_norms.append(math.sqrt(length))
+
+        shape = (len(token_lists), len(self.terms))
+        return self._matrix(weight_entries, shape), self._matrix(repeat_entries, shape), np.array(query_norms)
+
+    def presence_matrix(self, token_lists):
+        """
+        Sparse matrix with 1 for each (case folded) token of the queries.
+        It finds the documents that include any token of a query.
+        """
+        entries = ([], [], [])
+        for row, tokens in enumerate(token_lists):
+            for token in set(token.casefold() for token in tokens):
+                column = self.terms.get(token)
+                if column is not None:
+                    _append(entries, row, column, 1)
+        return self._matrix(entries, (len(token_lists), len(self.terms)))
+
+    def score(self, weights, query_norms=None, repeats=None):
+        """
+        Cosine similarities (queries x documents) with one sparse matrix product.
+
+        - weights -> sparse (queries x vocabulary) matrix of the query weights
+        - query_norms -> query vector lengths, the row lengths of weights by default
+        - repeats -> sparse matrix of the repeated tokens (see query_matrix)
+        """
+        weights = sparse.csr_matrix(weights)
+        if query_norms is None:
+            query_norms = np.sqrt(np.asarray(weights.multiply(weights).sum(axis=1)).ravel())
+
+        scores = (weights @ self._weights).tocsr()
+        scores.sort_indices()
+        rows = np.repeat(np.arange(scores.shape[0]), np.diff(scores.indptr))
+        lengths = self.norms[scores.indices]
+
+        if repeats is not None and repeats.nnz:
+            extra = (sparse.csr_matrix(repeats) @ self._squares).tocsr()
+            extra.eliminate_zeros()
+            extra = extra.tocoo()
+
+            # Find the entry of each extra length in scores (the same row and document)
+            keys = rows * scores.shape[1] + scores.indices
+            extra_keys = extra.row.astype(np.int64) * scores.shape[1] + extra.col
+            positions = np.minimum(np.searchsorted(keys, extra_keys), max(len(keys) - 1, 0))
+            matched = keys[positions] == extra_keys if len(keys) else np.zeros(len(extra_keys), dtype=bool)
+
+            extra_lengths = np.zeros(len(keys))
+            np.add.at(extra_lengths, positions[matched], extra.data[matched])
+            lengths = np.where(extra_lengths > 0, np.sqrt(lengths * lengths + extra_lengths), lengths)
+
+        denominators = query_norms[rows] * lengths
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scores.data = np.where(denominators > 0, scores.data / denominators, 0)
+        return scores
+
+    def top_k(self, scores, k=None, candidates=None, excluded=None):
+        """
+        Best k documents of each row of the score matrix: [[(doc_id, cosine), ...], ...]
+        They are ranked like QueryProcessor (score with 3 digits, then doc id).
+
+        - candidates -> sparse matrix, only its non zero documents are ranked
+                        (the documents with a non zero score by default)
+        - excluded -> sparse matrix, its non zero documents are not ranked
+        - k -> None ranks all candidates
+        """
+        scores = scores.tocsr()
+        candidates = scores if candidates is None else candidates.tocsr()
+        excluded = excluded.tocsr() if excluded is not None else None
+
+        results = []
+        for row in range(scores.shape[0]):
+            if k is not None and k <= 0:
+                results.append([])
+                continue
+
+            columns = candidates.indices[candidates.indptr[row]:candidates.indptr[row + 1]]
+            if excluded is not None:
+                columns = np.setdiff1d(columns, excluded.indices[excluded.indptr[row]:excluded.indptr[row + 1]])
+            columns = np.unique(columns)
+
+            row_scores = np.zeros(len(columns))
+            start, end = scores.indptr[row], scores.indptr[row + 1]
+            found = np.searchsorted(columns, scores.indices[start:end])
+            inside = found < len(columns)
+            inside[inside] = columns[found[inside]] == scores.indices[start:end][inside]
+            row_scores[found[inside]] = scores.data[start:end][inside]
+
+            # Python round like QueryProcessor, np.round can differ at the 3rd digit
+            rounded = np.array([round(score, 3) for score in row_scores.tolist()])
+            if k is not None and k < len(columns):
+                # Documents with the same rounded score as the k-th one are also kept,
+                # so the ties are broken by doc id as in the full ranking
+                kth = rounded[np.argpartition(-rounded, k - 1)[k - 1]]
+                selected = np.flatnonzero(rounded >= kth)
+            else:
+                selected = np.arange(len(columns))
+
+            doc_ids = self.doc_ids[columns[selected]]
+            order = np.lexsort((doc_ids, -rounded[selected]))[:k]
+            results.append([(int(doc_ids[i]), float(rounded[selected[i]])) for i in order])
+
+        return results
+
+    def search(self, queries, k=None):
+        """
+        Rank a batch of free text queries.
+
+        - queries -> [(q_tokens, excluded tokens), ...] (see QueryProcessor._split_negations)
+        - k -> number of results of each query, None returns all matching documents
+
+        Returns the ranking of each query as (doc_id, cosine) pairs, in the order of QueryProcessor.process.
+        """
+        results = []
+        for start in range(0, len(queries), batch_size):
+            batch = queries[start:start + batch_size]
+            token_lists = [q_tokens for q_tokens, _ in batch]
+
+            weights, repeats, query_norms = self.query_matrix(token_lists)
+            scores = self.score(weights, query_norms, repeats)
+            candidates = self.presence_matrix(token_lists) @ self._presence
+            excluded = self.presence_matrix([excluded for _, excluded in batch]) @ self._presence
+
+            results.extend(self.top_k(scores, k, candidates, excluded))
+
+        return results
+
+    def _matrix(self, entries, shape):
+        rows, cols, data = entries
+        return sparse.csr_matrix((data, (rows, cols)), shape=shape)
+
+def _append(entries, row, column, value):
+    entries[0].append(row)
+    entries[1].append(column)
+    entries[2].append(value)
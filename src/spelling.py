@@ -0,0 +1,277 @@
+"""
+Spelling correction of the query terms (SymSpell style deletion index).
+
+For every term of the vocabulary, all strings made by deleting up to max_distance
+characters of its first prefix_length characters are precomputed. A misspelled
+word shares a deletion with every term that is within max_distance edits of it,
+so a lookup only generates the deletions of the word and finds the candidate terms
+with binary search. Then the real distances of the candidates are computed.
+
+The deletions are not kept as strings: each one is a 64 bit key
+(crc32 of the deletion << 32 | term id) in one sorted array. A crc32 collision
+only adds a candidate that is dropped by the distance check. So the index is
+compact, and it is saved and loaded as raw arrays.
+
+File layout: header (magic, version, settings, counts, checksums), then the
+document frequencies, the keys and the terms (utf-8, separated by \\0).
+"""
+import os
+import sys
+import zlib
+import struct
+from array import array
+from bisect import bisect_left
+
+from src.disk_index import IndexFormatError
+from src.lexicon import Lexicon
+
+"""
+Here are some global variables
+"""
+magic = b"TSESPEL\x00"
+format_version = 1
+
+default_max_distance = 2
+default_prefix_length = 7
+default_suggestions = 5
+
+# (word length, max distance): shorter words get fewer edits, otherwise almost every
+# short term is a suggestion (like the AUTO fuzziness of Elasticsearch)
+length_distances = ((2, 0), (5, 1))
+
+# magic, version, max distance, prefix length, term count, key count, terms length,
+# checksum of the source index, data checksum
+header_struct = struct.Struct("<8sIIIQQQII")
+
+class SpellingIndex:
+    """
+    Deletion index of a vocabulary.
+
+    functions:
+    - from_index: build it from the terms and document frequencies of an index
+    - suggest: nearest terms of a word, ranked by distance then document frequency
+    - correct: the best suggestion of a word (the word itself if it is a term)
+    - save / load: binary file of the index
+    """
+
+    def __init__(self, max_distance=default_max_distance, prefix_length=default_prefix_length) -> None:
+        """
+        - max_distance -> max number of edits (insert, delete, replace, swap) of a suggestion
+        - prefix_length -> only this many first characters are used for the deletions
+        """
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.terms = Lexicon()
+        self.dfs = array("I")
+        self.keys = array("Q")
+
+        # Checksum of the index file that the terms come from (0 -> not saved index)
+        self.source_checksum = 0
+
+    @classmethod
+    def from_terms(cls, items, max_distance=default_max_distance, prefix_length=default_prefix_length):
+        """
+        - items -> (term, document frequency) pairs
+        """
+        spelling = cls(max_distance, prefix_length)
+        keys = []
+        for term, df in items:
+            term_id = spelling.terms.add(term)
+            spelling.dfs.append(df)
+            for deletion in spelling._deletions(term):
+                keys.append(_hash(deletion) << 32 | term_id)
+        keys.sort()
+        spelling.keys = array("Q", keys)
+        return spelling
+
+    @classmethod
+    def from_index(cls, index, max_distance=default_max_distance, prefix_length=default_prefix_length):
+        """
+        Build the spelling index of the terms of an index (InvertedIndex, SegmentedIndex, ...)
+        """
+        df = getattr(index, "df", None) or (lambda term: len(index.get(term)))
+        return cls.from_terms(((term, df(term)) for term in index.keys()), max_distance, prefix_length)
+
+    def __len__(self):
+        return len(self.terms)
+
+    def __contains__(self, term):
+        return term in self.terms
+
+    def df(self, term) -> int:
+        term_id = self.terms.get(term)
+        return self.dfs[term_id] if term_id is not None else 0
+
+    def suggest(self, word, max_distance=None, limit=default_suggestions) -> list:
+        """
+        (term, distance, df) of the terms within max_distance edits of the word,
+        the nearest and then the most frequent ones first.
+        A term of the vocabulary gives itself with distance 0 first.
+
+        - max_distance -> None means it depends on the length of the word (see length_distances)
+        """
+        if max_distance is None:
+            max_distance = auto_distance(word)
+        max_distance = min(max_distance, self.max_distance)
+
+        candidates = set()
+        for deletion in self._deletions(word, max_distance):
+            key = _hash(deletion) << 32
+            i = bisect_left(self.keys, key)
+            end = bisect_left(self.keys, key + (1 << 32), i)
+            candidates.update(key & 0xFFFFFFFF for key in self.keys[i:end])
+
+        suggestions = []
+        counts = [0] * (max_distance + 1)
+        for term_id in candidates:
+            term = self.terms.term(term_id)
+            if abs(len(term) - len(word)) > max_distance:
+                continue
+            distance = edit_distance(word, term, max_distance)
+            if distance <= max_distance:
+                suggestions.append((term, distance, self.dfs[term_id]))
+                counts[distance] += 1
+                # If there are limit nearer terms, the terms of this distance cannot be suggested
+                while max_distance > 0 and sum(counts[:max_distance]) >= limit:
+                    max_distance -= 1
+
+        suggestions = [suggestion for suggestion in suggestions if suggestion[1] <= max_distance]
+        suggestions.sort(key=lambda suggestion: (suggestion[1], -suggestion[2], suggestion[0]))
+        return suggestions[:limit]
+
+    def correct(self, word, max_distance=None):
+        """
+        The word if it is a term, else its best suggestion (None if there is no suggestion)
+        """
+        if word in self.terms:
+            return word
+        suggestions = self.suggest(word, max_distance, limit=1)
+        return suggestions[0][0] if suggestions else None
+
+    def _deletions(self, word, max_distance=None):
+        """
+        The strings made by deleting 0 to max_distance characters of the prefix of the word
+        """
+        if max_distance is None:
+            max_distance = self.max_distance
+        level = {word[:self.prefix_length]}
+        deletions = set(level)
+        for _ in range(max_distance):
+            level = {string[:i] + string[i + 1:] for string in level for i in range(len(string))} - deletions
+            if not level:
+                break
+            deletions |= level
+        return deletions
+
+    def _sections(self):
+        sections = [array("I", self.dfs), array("Q", self.keys)]
+        if sys.byteorder == "big":
+            for section in sections:
+                section.byteswap()
+        return [section.tobytes() for section in sections] + [self.terms.to_bytes()]
+
+    def save(self, path):
+        """
+        Save the spelling index to path in binary format
+        """
+        sections = self._sections()
+        checksum = 0
+        for section in sections:
+            checksum = zlib.crc32(section, checksum)
+
+        header = header_struct.pack(magic, format_version, self.max_distance, self.prefix_length, len(self.terms),
+                                    len(self.keys), len(sections[-1]), self.source_checksum, checksum)
+        # Readers may load the file at any time, so it is replaced atomically, not rewritten
+        with open(path + ".tmp", "wb") as f:
+            f.write(header)
+            for section in sections:
+                f.write(section)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load the spelling index of save(path).
+        Raises FileNotFoundError or IndexFormatError (not valid file)
+        """
+        with open(path, "rb") as f:
+            data = f.read()
+
+        if len(data) < header_struct.size:
+            raise IndexFormatError(f"{path} is not a spelling file")
+        (file_magic, version, max_distance, prefix_length, term_count, key_count, terms_length,
+         source_checksum, checksum) = header_struct.unpack_from(data)
+        if file_magic != magic:
+            raise IndexFormatError(f"{path} is not a spelling file")
+        if version != format_version:
+            raise IndexFormatError(f"{path} has format version {version}, expected {format_version}")
+        if zlib.crc32(data[header_struct.size:]) != checksum:
+            raise IndexFormatError(f"{path} has a wrong checksum")
+
+        spelling = cls(max_distance, prefix_length)
+        spelling.source_checksum = source_checksum
+        start = header_struct.size
+        for name, typecode, count in (("dfs", "I", term_count), ("keys", "Q", key_count)):
+            values = array(typecode)
+            end = start + count * values.itemsize
+            values.frombytes(data[start:end])
+            if sys.byteorder == "big":
+                values.byteswap()
+            setattr(spelling, name, values)
+            start = end
+        spelling.terms = Lexicon.from_bytes(data[start:start + terms_length], term_count)
+        return spelling
+
+def _hash(string):
+    return zlib.crc32(string.encode("utf-8"))
+
+def auto_distance(word) -> int:
+    """
+    Max number of edits of a suggestion for the word, by its length
+    """
+    for length, distance in length_distances:
+        if len(word) <= length:
+            return distance
+    return default_max_distance
+
+def edit_distance(a, b, max_distance):
+    """
+    Damerau-Levenshtein distance (optimal string alignment) of a and b.
+    It stops when the distance is surely over max_distance, then max_distance + 1 is returned.
+
+    The common prefix and suffix are skipped, and only the cells that are at most
+    max_distance away from the diagonal are computed.
+    """
+    if a == b:
+        return 0
+    over = max_distance + 1
+    if abs(len(a) - len(b)) > max_distance:
+        return over
+
+    start = 0
+    while start < len(a) and start < len(b) and a[start] == b[start]:
+        start += 1
+    end_a, end_b = len(a), len(b)
+    while end_a > start and end_b > start and a[end_a - 1] == b[end_b - 1]:
+        end_a -= 1
+        end_b -= 1
+    a, b = a[start:end_a], b[start:end_b]
+    if not a or not b:
+        return min(len(a) + len(b), over)
+
+    before, previous = None, [j if j <= max_distance else over for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        current = [over] * (len(b) + 1)
+        if i <= max_distance:
+            current[0] = i
+        low, high = max(1, i - max_distance), min(len(b), i + max_distance)
+        for j in range(low, high + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            distance = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                distance = min(distance, before[j - 2] + 1)
+            current[j] = distance
+        if min(current[low - 1:high + 1]) > max_distance:
+            return over
+        before, previous = previous, current
+    return min(previous[-1], over)
@@ -0,0 +1,161 @@
+"""
+Sorted term dictionary for prefix and wildcard queries.
+
+The terms of an index are kept in a sorted array, so:
+- exact lookup is a binary search -> O(logn)
+- prefix scan (oil*) is a range of the array, found with two binary searches
+
+Suffix and infix wildcards (*ing, a*ion, *rol*) are found with a k-gram index:
+the terms are padded with "$" ($oil$) and each k characters long part of them
+is mapped to the (sorted) positions of the terms that include it. The k-grams of
+the pattern are intersected, then the candidates are checked with the pattern,
+because a term can have all the k-grams in another order.
+
+The terms can be any sorted sequence, e.g. the lexicon of a mapped index file
+(src.disk_index.MappedTerms). Then a prefix scan reads only the terms that the
+binary searches visit, and only the k-gram index reads all of them.
+
+Usage:
+    terms = TermDictionary(index.keys(), presorted=True)
+    terms.expand("petrol*")   -> ["petrol", "petroleum", ...]
+"""
+import re
+from array import array
+from bisect import bisect_left
+
+from src.query_parser import QueryError
+
+"""
+Here are some global variables
+"""
+wildcard = "*"
+boundary = "$"
+default_k = 3
+
+# A pattern that matches more terms than this is an error (None -> no limit)
+default_max_expansions = 100
+
+class WildcardError(QueryError):
+    """
+    Raised when a wildcard pattern matches too many terms or has no letters
+    """
+
+class TermDictionary:
+    """
+    Sorted array of the terms with a k-gram index.
+
+    functions:
+    - in: exact lookup with binary search
+    - prefix: terms that start with the prefix
+    - expand: terms that match a wildcard pattern
+    """
+
+    def __init__(self, terms, k=default_k, presorted=False) -> None:
+        """
+        - terms -> tokens of the index (they are sorted here)
+        - k -> length of the k-grams of the wildcard index
+        - presorted -> terms is already a sorted sequence, it is kept as it is
+        """
+        self.terms = terms if presorted else sorted(terms)
+        self.k = k
+        # k-gram -> positions of the terms, it is created on the first suffix / infix query
+        self._grams = None
+
+    def __len__(self):
+        return len(self.terms)
+
+    def __contains__(self, term):
+        i = bisect_left(self.terms, term)
+        return i < len(self.terms) and self.terms[i] == term
+
+    def prefix(self, prefix) -> list:
+        """
+        Terms that start with the prefix, in sorted order
+        """
+        start, end = self._range(prefix)
+        return self.terms[start:end]
+
+    def expand(self, pattern, max_expansions=default_max_expansions) -> list:
+        """
+        Sorted terms that match the pattern, "*" matches any (or no) characters.
+        A pattern without "*" gives itself if it is a term.
+
+        It raises WildcardError if more than max_expansions terms match.
+        """
+        if wildcard not in pattern:
+            return [pattern] if pattern in self else []
+        if not pattern.strip(wildcard):
+            raise WildcardError(f"Please correct your query, the wildcard {pattern} needs at least one letter!")
+
+        pieces = pattern.split(wildcard)
+        start, end = self._range(pieces[0])
+
+        if len(pieces) == 2 and not pieces[1]:
+            # Only a prefix: the range is the result
+            terms = self.terms[start:end]
+        else:
+            positions = self._candidates(pieces)
+            if positions is None:
+                positions = range(start, end)
+            else:
+                positions = (i for i in positions if start <= i < end)
+
+            matcher = re.compile(".*".join(re.escape(piece) for piece in pieces), re.DOTALL)
+            terms = [self.terms[i] for i in positions if matcher.fullmatch(self.terms[i])]
+
+        if max_expansions is not None and len(terms) > max_expansions:
+            raise WildcardError(f"Please correct your query, {pattern} matches {len(terms)} terms "
+                                f"(more than {max_expansions})!")
+        return terms
+
+    def _range(self, prefix):
+        """
+        (start, end) indexes of the terms that start with the prefix
+        """
+        start = bisect_left(self.terms, prefix)
+        if not prefix:
+            return start, len(self.terms)
+        # The first string after all strings that start with the prefix
+        end = bisect_left(self.terms, prefix[:-1] + chr(ord(prefix[-1]) + 1), start)
+        return start, end
+
+    def _candidates(self, pieces):
+        """
+        Sorted positions of the terms that have all k-grams of the pattern pieces.
+        None if the pieces are too short to have a k-gram.
+        """
+        parts = list(pieces)
+        parts[0] = boundary + parts[0]
+        parts[-1] = parts[-1] + boundary
+
+        grams = {part[i:i + self.k] for part in parts for i in range(len(part) - self.k + 1)}
+        if not grams:
+            return None
+
+        index = self.grams()
+        lists = sorted((index.get(gram, ()) for gram in grams), key=len)
+        if not lists[0]:
+            return []
+        positions = set(lists[0])
+        for other in lists[1:]:
+            positions.intersection_update(other)
+            if not positions:
+                return []
+        return sorted(positions)
+
+    def grams(self):
+        """
+        The k-gram index: k-gram -> array of the term positions (ascending)
+        """
+        if self._grams is None:
+            grams = {}
+            k = self.k
+            for i, term in enumerate(self.terms):
+                padded = boundary + term + boundary
+                for gram in {padded[j:j + k] for j in range(len(padded) - k + 1)}:
+                    positions = grams.get(gram)
+                    if positions is None:
+                        positions = grams[gram] = array("I")
+                    positions.append(i)
+            self._grams = grams
+        return self._grams
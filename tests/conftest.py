@@ -0,0 +1,100 @@
+"""
+Fixtures of the tests.
+
+A small Reuters-style corpus is written once, then each test runs in its own
+temporary folder that has the corpus (as the dataset folder) and the stopwords,
+because the indexes read and write their files in the working directory.
+"""
+import os
+import random
+import shutil
+
+import pytest
+
+from src.sgm_preprocessor import dataset_path
+from src.inverted_intex import InvertedIndex
+from src.positional_inverted_index import PositionalInvertedIndex
+
+"""
+Here are some global variables
+"""
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+docs = 240
+docs_per_file = 40
+vocabulary_size = 300
+syllables = ["ka", "lo", "mi", "ne", "ru", "sa", "to", "vi", "pe", "dor", "gan", "tel", "bri", "ost", "um"]
+
+def vocabulary(rng):
+    """
+    Distinct generated words of 2-4 syllables, the first ones are the most frequent
+    """
+    words = []
+    seen = set()
+    while len(words) < vocabulary_size:
+        word = "".join(rng.choice(syllables) for _ in range(rng.randint(2, 4)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+def write_corpus(directory, seed=3):
+    """
+    Write docs documents to sgm files of docs_per_file documents. The words have a
+    Zipfian frequency, and some stopwords and punctuation are mixed in.
+    """
+    rng = random.Random(seed)
+    words = vocabulary(rng)
+    weights = [1 / rank for rank in range(1, len(words) + 1)]
+    stopwords = ["the", "of", "and", "in", "with"]
+
+    for start in range(1, docs + 1, docs_per_file):
+        with open(os.path.join(directory, f"reut2-{start // docs_per_file:03d}.sgm"), "w", encoding="latin-1") as f:
+            f.write('<!DOCTYPE lewis SYSTEM "lewis.dtd">\n')
+            for doc_id in range(start, start + docs_per_file):
+                tokens = rng.choices(words, weights, k=rng.randint(5, 60))
+                for _ in range(len(tokens) // 5):
+                    tokens.insert(rng.randrange(len(tokens) + 1), rng.choice(stopwords))
+                title = " ".join(tokens[:4]).upper()
+                body = " ".join(tokens[4:]) + "."
+                f.write(f'<REUTERS TOPICS="YES" LEWISSPLIT="TRAIN" OLDID="{doc_id}" NEWID="{doc_id}">\n'
+                        f'<DATE>26-FEB-1987 15:01:01.79</DATE>\n'
+                        f'<TEXT>&#2;\n<TITLE>{title}</TITLE>\n<BODY>{body}\n Reuter\n&#3;</BODY></TEXT>\n'
+                        f'</REUTERS>\n')
+
+@pytest.fixture(scope="session")
+def corpus(tmp_path_factory):
+    """
+    Folder of the sgm files of the fixture corpus (6 files of 40 documents)
+    """
+    directory = tmp_path_factory.mktemp("corpus")
+    write_corpus(directory)
+    return directory
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch, corpus):
+    """
+    Working directory of a test with the corpus and the stopwords
+    """
+    shutil.copy(os.path.join(root, "stopwords.txt"), tmp_path)
+    os.symlink(corpus, tmp_path / dataset_path)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+@pytest.fixture
+def boolean_index(workdir):
+    index = InvertedIndex()
+    index.build()
+    return index
+
+@pytest.fixture
+def positional_index(workdir):
+    index = PositionalInvertedIndex()
+    index.build()
+    return index
+
+def terms(index):
+    """
+    Terms of the index from the most to the least frequent one
+    """
+    tokens = [token for token in index.dictionary if token not in index.pseudo_terms]
+    return sorted(tokens, key=lambda token: (-len(index.get(token)), token))
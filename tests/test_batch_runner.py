@@ -0,0 +1,96 @@
+"""
+Batch runner: results in input order, error records and the summary
+"""
+import io
+import os
+import json
+
+import pytest
+
+import src.query_worker as query_worker
+from src.batch_runner import BatchRunner, percentile, summarize
+from src.boolean_query_processor import BooleanQueryProcessor
+from src.query_processor import QueryProcessor
+from tests.conftest import terms
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_results_are_in_input_order(boolean_index, positional_index, monkeypatch, workers):
+    monkeypatch.setattr(query_worker, "processors", {})
+    monkeypatch.setattr("src.batch_runner.chunk_size", 2)
+    frequent = terms(boolean_index)
+    lines = [json.dumps({"id": "a", "query": f"{frequent[0]} {frequent[1]}", "top_k": 3}),
+             json.dumps({"query": f"{frequent[0]} AND {frequent[2]}", "mode": "boolean"}),
+             "",
+             f"{frequent[4]} {frequent[9]}",
+             json.dumps(f"{frequent[3]}"),
+             json.dumps({"query": f"{frequent[0]} AND", "mode": "boolean"}),
+             json.dumps({"query": 5}),
+             json.dumps({"query": frequent[0], "mode": "other"}),
+             json.dumps([1, 2]),
+             json.dumps({"query": frequent[0], "top_k": "3"}),
+             json.dumps({"query": f'"{frequent[0]} {frequent[1]}"', "top_k": -1})]
+    output = io.StringIO()
+    summary = BatchRunner(workers=workers).run(lines, output)
+
+    records = [json.loads(line) for line in output.getvalue().splitlines()]
+    ranked, boolean = QueryProcessor(index=positional_index), BooleanQueryProcessor(index=boolean_index)
+    assert [record["line"] for record in records] == [1, 2, 4, 5, 6, 7, 8, 9, 10, 11]
+    assert records[0]["id"] == "a" and records[0]["results"] == ranked.process(f"{frequent[0]} {frequent[1]}", 3)
+    assert records[1]["results"] == boolean.process(f"{frequent[0]} AND {frequent[2]}")
+    assert records[2]["results"] == ranked.process(f"{frequent[4]} {frequent[9]}")
+    assert records[3]["results"] == ranked.process(frequent[3])
+    assert all("error" in record and "results" not in record for record in records[4:])
+    assert "took_ms" in records[4] and "took_ms" not in records[5]
+    assert summary["queries"] == 10 and summary["errors"] == 6
+
+def test_summary():
+    assert percentile([], 50) == 0
+    assert [percentile(list(range(1, 101)), p) for p in (50, 95, 99)] == [50, 95, 99]
+    summary = summarize([3, 1, 2], errors=1, seconds=2)
+    assert summary["queries"] == 3 and summary["qps"] == 1.5 and summary["p50_ms"] == 2 and summary["p99_ms"] == 3
+
+class FailingProcessor:
+    def process(self, q, limit=None, offset=0):
+        if q == "fail":
+            raise RuntimeError("index file is gone")
+        return [1, 2, 3]
+
+def test_unexpected_error_is_an_error_record(monkeypatch):
+    monkeypatch.setattr(query_worker, "processors", {"boolean": FailingProcessor()})
+    output = io.StringIO()
+    summary = BatchRunner(mode="boolean").run(["oil", "fail", "gold"], output)
+
+    records = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert [record["line"] for record in records] == [1, 2, 3]
+    assert records[0]["results"] == records[2]["results"] == [1, 2, 3]
+    assert records[1]["error"] == "RuntimeError: index file is gone"
+    assert summary["queries"] == 3 and summary["errors"] == 1
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_correct_spelling_reaches_the_workers(boolean_index, positional_index, monkeypatch, workers):
+    monkeypatch.setattr(query_worker, "processors", {})
+    monkeypatch.setattr(query_worker, "options", {"correct_spelling": False})
+    word = next(word for word in terms(boolean_index)[10:] if word.isalpha() and len(word) > 5)
+    typo = word[:2] + word[3:]
+    lines = [json.dumps({"query": typo, "mode": "boolean"}), json.dumps({"query": typo})]
+    output = io.StringIO()
+    BatchRunner(workers=workers, correct_spelling=True).run(lines, output)
+
+    records = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert BooleanQueryProcessor(index=boolean_index).process(typo) == []
+    boolean = BooleanQueryProcessor(index=boolean_index, correct_spelling=True)
+    ranked = QueryProcessor(index=positional_index, correct_spelling=True)
+    assert records[0]["results"] == boolean.process(typo) and records[0]["results"]
+    assert records[1]["results"] == ranked.process(typo) and records[1]["results"]
+
+def test_indexes_are_built_once_before_the_workers(workdir, monkeypatch):
+    prepared = []
+    monkeypatch.setattr(query_worker, "processors", {})
+    monkeypatch.setattr("src.batch_runner.prepare_indexes",
+                        lambda *args: prepared.append(args) or query_worker.prepare_indexes(*args))
+    output = io.StringIO()
+    summary = BatchRunner(workers=2, mode="boolean").run(["oil", json.dumps({"query": "oil", "mode": "ranked"})], output)
+
+    assert prepared == [(query_worker.modes, False)]
+    assert os.path.exists("dictionary.idx") and os.path.exists("positional_dictionary.idx")
+    assert summary["queries"] == 2 and summary["errors"] == 0
@@ -0,0 +1,53 @@
+"""
+Synthetic corpus generator and the benchmark run
+"""
+import filecmp
+import json
+import os
+import random
+from collections import Counter
+
+import src.corpus_generator as corpus_generator
+from src.benchmark import compare, flatten, run_benchmark
+from src.corpus_generator import CorpusGenerator
+from src.sgm_preprocessor import SGMPreprocessor
+
+def test_corpus_is_deterministic(workdir, monkeypatch):
+    monkeypatch.setattr(corpus_generator, "docs_per_file", 40)
+    files = CorpusGenerator(docs=100, vocabulary_size=500, seed=1).write("a")
+    CorpusGenerator(docs=100, vocabulary_size=500, seed=1).write("b")
+    CorpusGenerator(docs=100, vocabulary_size=500, seed=2).write("c")
+
+    assert files == ["reut2-000.sgm", "reut2-001.sgm", "reut2-002.sgm"]
+    assert all(filecmp.cmp(os.path.join("a", sgm), os.path.join("b", sgm), shallow=False) for sgm in files)
+    assert not filecmp.cmp(os.path.join("a", files[0]), os.path.join("c", files[0]), shallow=False)
+
+    docs = list(SGMPreprocessor(dataset="a").iter_documents())
+    assert [doc.id for doc in docs] == list(range(1, 101))
+
+def test_words_follow_zipf():
+    generator = CorpusGenerator(docs=1, vocabulary_size=1000, seed=3)
+    counts = Counter(generator.words(random.Random(3), 50000))
+    ranks = [counts[word] for word in generator.vocabulary[:4]]
+    assert ranks == sorted(ranks, reverse=True)
+    assert counts[generator.vocabulary[0]] > 10 * counts[generator.vocabulary[100]]
+
+def test_benchmark_run_and_compare(workdir):
+    regressions = run_benchmark("bench/results.json", docs=120, vocabulary_size=400, queries=5, repeat=1,
+                                directory="bench")
+    assert regressions == []
+    with open("bench/results.json") as f:
+        results = json.load(f)
+
+    assert results["parse"]["docs"] == 120
+    assert set(results["workloads"]) == {"boolean_and", "boolean_or", "boolean_not", "phrase", "ranked", "ranked_top10",
+                                         "ranked_broad", "ranked_broad_top10"}
+    assert results["workloads"]["phrase"]["matches"] >= 5
+
+    assert compare(results, results) == []
+    slower = json.loads(json.dumps(results))
+    slower["workloads"]["ranked"]["p99_ms"] = results["workloads"]["ranked"]["p99_ms"] / 2
+    slower["workloads"]["ranked"]["qps"] = results["workloads"]["ranked"]["qps"] * 2
+    names = [name for name, _, _, _ in compare(results, slower)]
+    assert names == ["workloads.ranked.p99_ms", "workloads.ranked.qps"]
+    assert flatten(results)["config.docs"] == 120
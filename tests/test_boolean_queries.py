@@ -0,0 +1,108 @@
+"""
+Boolean queries
+"""
+import random
+
+import pytest
+
+from src.boolean_query_processor import BooleanQueryProcessor
+from src.inverted_intex import InvertedIndex
+from src.postings import CompressedPosting, PositionalPosting
+from src.query_parser import And, Not, Or, QuerySyntaxError, Term
+from src.query_processor import QueryProcessor
+from tests.conftest import terms
+
+@pytest.fixture
+def words(boolean_index):
+    return terms(boolean_index)[:6]
+
+def documents(index, word):
+    return set(index.get(word))
+
+def test_difference():
+    rng = random.Random(4)
+    index = InvertedIndex()
+    for left_length, right_length in [(0, 5), (5, 0), (50, 2000), (2000, 50), (700, 700)]:
+        left = sorted(rng.sample(range(3000), left_length))
+        right = sorted(rng.sample(range(3000), right_length))
+        expected = sorted(set(left) - set(right))
+        assert index.difference(CompressedPosting(left), CompressedPosting(right)) == expected
+        assert index.difference(left, right) == expected
+
+def test_universe(boolean_index, positional_index):
+    assert list(boolean_index.universe()) == list(range(1, 241))
+    assert list(positional_index.universe().doc_ids) == list(range(1, 241))
+
+def test_positional_difference_keeps_positions(positional_index):
+    w1, w2 = terms(positional_index)[:2]
+    left, right = positional_index.get(w1), positional_index.get(w2)
+    excluded = set(right.doc_ids)
+    expected = PositionalPosting.from_entries(entry for entry in left if entry[0] not in excluded)
+    assert positional_index.difference(left, right) == expected
+
+def test_not_queries(boolean_index, words):
+    processor = BooleanQueryProcessor()
+    a, b, c = (documents(boolean_index, word) for word in words[:3])
+    universe = set(boolean_index.universe())
+    w1, w2, w3 = words[:3]
+
+    assert processor.process(f"NOT {w1}") == sorted(universe - a)
+    assert processor.process(f"{w1} NOT {w2}") == sorted(a - b)
+    assert processor.process(f"{w1} AND {w2} NOT {w3}") == sorted((a & b) - c)
+    assert processor.process(f"{w1} OR {w2} NOT {w3}") == sorted((a | b) - c)
+
+def test_ranked_query_drops_documents_after_not(positional_index):
+    w1, w2, w3 = terms(positional_index)[20:23]
+    result = QueryProcessor().process(f"{w1} {w2} NOT {w3}")
+    doc_ids = {int(line.split("-")[1].split(" ")[0]) for line in result}
+    excluded = set(positional_index.get(w3).doc_ids)
+    included = {doc_id for word in (w1, w2) for doc_id in positional_index.get(word).doc_ids}
+    assert doc_ids == included - excluded
+
+def test_parse_precedence(boolean_index):
+    processor = BooleanQueryProcessor()
+    assert processor.parse("alpha OR beta AND gamma") == Or([Term("alpha"), And([Term("beta"), Term("gamma")])])
+    assert processor.parse("alpha OR beta NOT gamma") == And([Or([Term("alpha"), Term("beta")]), Not(Term("gamma"))])
+    assert processor.parse("NOT alpha AND beta") == And([Not(Term("alpha")), Term("beta")])
+    assert processor.parse("alpha AND (beta OR gamma) AND delta") == And([Term("alpha"), Or([Term("beta"), Term("gamma")]), Term("delta")])
+
+def test_precedence_and_parentheses(boolean_index, words):
+    processor = BooleanQueryProcessor()
+    a, b, c, d = (documents(boolean_index, word) for word in words[:4])
+    universe = set(boolean_index.universe())
+    w1, w2, w3, w4 = words[:4]
+
+    assert processor.process(f"{w1} OR {w2} AND {w3}") == sorted(a | (b & c))
+    assert processor.process(f"({w1} OR {w2}) AND {w3}") == sorted((a | b) & c)
+    assert processor.process(f"NOT {w1} AND {w2}") == sorted((universe - a) & b)
+    assert processor.process(f"{w1} AND NOT ({w2} OR {w3})") == sorted(a - (b | c))
+    assert processor.process(f"({w1} NOT {w2}) OR ({w3} AND {w4})") == sorted((a - b) | (c & d))
+
+@pytest.mark.parametrize("q", ["", "AND", "alpha AND", "alpha beta", "(alpha OR beta", "alpha OR beta)", "NOT", "alpha AND OR beta"])
+def test_syntax_errors(boolean_index, q):
+    with pytest.raises(QuerySyntaxError):
+        BooleanQueryProcessor().process(q)
+
+def test_paged_results_are_slices_of_full_result(boolean_index, words):
+    processor = BooleanQueryProcessor(index=boolean_index)
+    w1, w2, w3, w4, w5, w6 = words
+    queries = [w1, f"{w1} OR {w2} OR {w3}", f"{w1} AND {w2}", f"NOT {w4}",
+               f"({w1} OR {w5}) AND NOT {w6}", f"{w2} OR {w3} NOT {w4}", f"{w1} AND {w1[0]}*"]
+    for q in queries:
+        full = processor.process(q)
+        assert full
+        for offset in (0, 1, 7, len(full) - 1, len(full), len(full) + 5):
+            for limit in (None, 0, 1, 10):
+                assert processor.process(q, limit=limit, offset=offset) == full[offset:][:limit], (q, offset, limit)
+        assert processor.count(q) == len(full)
+
+def test_count_walks_cursors(boolean_index, words, monkeypatch):
+    processor = BooleanQueryProcessor(index=boolean_index)
+    w1, w2, w3, w4, w5, w6 = words
+    queries = [f"{w1} OR {w2} OR {w3}", f"{w1} AND {w2}", f"({w1} OR {w5}) AND NOT {w6}", f"NOT ({w2} OR {w4})"]
+    expected = [len(processor.process(q)) for q in queries]
+
+    def evaluate(node, postings):
+        raise AssertionError("count must not create the result")
+    monkeypatch.setattr(processor, "_evaluate", evaluate)
+    assert [processor.count(q) for q in queries] == expected
@@ -0,0 +1,88 @@
+"""
+Serial, parallel and block sort (spilling) builds give the same index
+"""
+import random
+
+import pytest
+
+from src.block_sort_builder import BlockSortIndexBuilder
+from src.inverted_intex import InvertedIndex
+from src.positional_inverted_index import PositionalInvertedIndex
+from src.postings import CompressedPosting, PositionalPosting
+
+@pytest.mark.parametrize("index_class", [InvertedIndex, PositionalInvertedIndex])
+@pytest.mark.parametrize("workers", [2, 4])
+def test_parallel_build_is_same_as_serial(workdir, index_class, workers):
+    serial = index_class()
+    serial.build()
+    parallel = index_class(workers=workers)
+    parallel.build()
+
+    assert parallel.dictionary == serial.dictionary
+
+def test_parallel_build_statistics(workdir):
+    serial = PositionalInvertedIndex()
+    serial.build()
+    parallel = PositionalInvertedIndex(workers=4)
+    parallel.build()
+
+    a, b = serial.statistics(), parallel.statistics()
+    assert a.N == b.N and set(a.terms) == set(b.terms)
+    assert all(a.idf(token) == b.idf(token) and a.bound(token) == pytest.approx(b.bound(token)) for token in a.terms)
+    assert list(a.norms) == pytest.approx(list(b.norms))
+    assert list(a.lengths) == list(b.lengths)
+
+@pytest.mark.parametrize("index_class", [InvertedIndex, PositionalInvertedIndex])
+def test_spilling_build_is_same_as_in_memory(workdir, index_class):
+    in_memory = index_class()
+    in_memory.build()
+    spilling = index_class(memory_budget=50)
+    spilling.build()
+
+    assert spilling.dictionary == in_memory.dictionary
+
+@pytest.mark.parametrize("memory_budget", [3, 1000])
+def test_block_sort_builder(memory_budget):
+    builder = BlockSortIndexBuilder(memory_budget)
+    for term, doc_id, position in [(2, 5, 1), (1, 7, 0), (2, 5, 0), (1, 2, 4), (3, 1, 2)]:
+        builder.add(term, doc_id, position)
+    assert list(builder.postings()) == [(1, [(2, [4]), (7, [0])]), (2, [(5, [0, 1])]), (3, [(1, [2])])]
+
+def test_unordered_partials_are_merged(workdir):
+    # The partials of the last files first: the postings cannot be concatenated
+    index = InvertedIndex(workers=2)
+    files = index.sgmp.sgm_files()
+    partials = [InvertedIndex()._build_partial(files[3:]), InvertedIndex()._build_partial(files[:3])]
+    index._merge_partials(partials)
+
+    serial = InvertedIndex()
+    serial.build(save=False)
+    assert index.dictionary == serial.dictionary
+
+def test_concatenate_postings():
+    rng = random.Random(1)
+    ids = sorted(rng.sample(range(1, 50000), 700))
+    parts = [ids[:1], ids[1:300], [], ids[300:]]
+
+    posting = CompressedPosting.concatenate([CompressedPosting(part) for part in parts])
+    assert posting.tolist() == ids
+    assert len(posting) == len(ids)
+    assert posting.last() == ids[-1]
+    for target in rng.sample(range(50001), 200):
+        cursor = posting.cursor()
+        expected = [doc_id for doc_id in ids if doc_id >= target]
+        assert cursor.advance_to(target) == (expected[0] if expected else None)
+
+    positional = PositionalPosting.concatenate(
+        [PositionalPosting.from_entries((doc_id, [doc_id % 5, doc_id % 5 + 2]) for doc_id in part) for part in parts])
+    assert positional == PositionalPosting.from_entries((doc_id, [doc_id % 5, doc_id % 5 + 2]) for doc_id in ids)
+
+    with pytest.raises(ValueError):
+        CompressedPosting.concatenate([CompressedPosting([5, 9]), CompressedPosting([9, 12])])
+
+@pytest.mark.parametrize("memory_budget", [3, 1000])
+def test_builder_without_positions(memory_budget):
+    builder = BlockSortIndexBuilder(memory_budget, positions=False)
+    for term, doc_id in [(2, 5), (1, 7), (2, 3), (1, 7), (2, 5), (1, 2)]:
+        builder.add(term, doc_id)
+    assert list(builder.postings()) == [(1, [2, 7]), (2, [3, 5])]
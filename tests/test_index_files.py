@@ -0,0 +1,147 @@
+"""
+Saved index files: the binary format, the pickle files and the collection statistics
+"""
+import os
+import shutil
+
+import pytest
+
+from src.collection_statistics import CollectionStatistics
+from src.disk_index import MappedDictionary, IndexFormatError, write_index, boolean_kind
+from src.inverted_intex import InvertedIndex
+from src.positional_inverted_index import PositionalInvertedIndex
+from tests.conftest import terms
+
+@pytest.mark.parametrize("index_class", [InvertedIndex, PositionalInvertedIndex])
+def test_binary_index_is_loaded(workdir, index_class):
+    built = index_class()
+    built.build()
+    loaded = index_class()
+    assert loaded.load(verify=True)
+
+    assert isinstance(loaded.dictionary, MappedDictionary)
+    assert dict(loaded.dictionary.items()) == built.dictionary
+    assert len(loaded.dictionary) == len(built.dictionary)
+    for token, posting in built.dictionary.items():
+        assert token in loaded.dictionary
+        assert loaded.dictionary[token] == posting
+        if token not in built.pseudo_terms:
+            assert loaded.dictionary.df(token) == len(posting)
+    assert loaded.dictionary.get("unknown token") is None
+    assert "unknown token" not in loaded.dictionary
+
+def test_corrupted_files_are_not_loaded(boolean_index):
+    with open(boolean_index.index_path, "r+b") as f:
+        f.seek(20)
+        byte = f.read(1)
+        f.seek(20)
+        f.write(bytes([byte[0] ^ 0xFF]))
+    with pytest.raises(IndexFormatError):
+        MappedDictionary(boolean_index.index_path)
+    assert not InvertedIndex().load()
+
+    boolean_index.save()
+    with open(boolean_index.index_path, "r+b") as f:
+        f.seek(-1, os.SEEK_END)
+        byte = f.read(1)
+        f.seek(-1, os.SEEK_END)
+        f.write(bytes([byte[0] ^ 0xFF]))
+    dictionary = MappedDictionary(boolean_index.index_path)
+    assert not dictionary.verify()
+    dictionary.close()
+    assert not InvertedIndex().load(verify=True)
+
+def test_pickle_index_is_loaded(boolean_index):
+    boolean_index.save(binary=False)
+    os.remove(boolean_index.index_path)
+    loaded = InvertedIndex()
+    assert loaded.load()
+    assert loaded.dictionary == boolean_index.dictionary
+
+def test_statistics_are_saved(positional_index):
+    computed = positional_index.statistics()
+    loaded = CollectionStatistics.load(positional_index.statistics_path)
+    for name in ("dfs", "idfs", "bounds", "lengths", "norms"):
+        assert list(getattr(loaded, name)) == list(getattr(computed, name)), name
+    assert loaded.N == computed.N == 240 and loaded.terms == computed.terms
+    assert not os.path.exists(positional_index.statistics_path + ".tmp")
+
+    index = PositionalInvertedIndex()
+    assert index.load()
+    assert index.statistics().N == 240
+    for token in terms(positional_index):
+        assert index.statistics().df(token) == len(positional_index.get(token))
+    assert index.statistics().df("unknown") == 0 and index.statistics().norm(10 ** 6) == 0
+
+def test_statistics_are_computed_without_the_file(positional_index):
+    os.remove(positional_index.statistics_path)
+    index = PositionalInvertedIndex()
+    assert index.load()
+    assert list(index.statistics().norms) == pytest.approx(list(positional_index.statistics().norms))
+    assert os.path.exists(positional_index.statistics_path)
+
+def test_statistics_of_another_index_are_computed_again(workdir, corpus):
+    index = PositionalInvertedIndex()
+    index.build()
+    shutil.copy(index.statistics_path, "old_statistics.bin")
+
+    # Another index with half of the documents is saved to the same files
+    os.mkdir("half")
+    for sgm in index.sgmp.sgm_files()[:3]:
+        os.symlink(os.path.join(corpus, sgm), os.path.join("half", sgm))
+    half = PositionalInvertedIndex(dataset="half")
+    half.build()
+    N = half.statistics().N
+    shutil.copy("old_statistics.bin", half.statistics_path)
+
+    loaded = PositionalInvertedIndex()
+    assert loaded.load()
+    assert loaded.statistics().N == N
+    assert all(loaded.statistics().idf(term) == half.statistics().idf(term) for term in half.keys())
+    assert list(loaded.statistics().norms) == pytest.approx(list(half.statistics().norms))
+
+    # The statistics are saved again with the checksum of the loaded index
+    assert CollectionStatistics.load(loaded.statistics_path).source_checksum == loaded.dictionary.checksum
+    reloaded = PositionalInvertedIndex()
+    assert reloaded.load()
+    assert reloaded.statistics().N == N
+
+def test_pickle_files_are_separate(workdir):
+    boolean = InvertedIndex()
+    boolean.build(save=False)
+    boolean.save(binary=False)
+    positional = PositionalInvertedIndex()
+    positional.build(save=False)
+    positional.save(binary=False)
+    assert boolean.pickle_path != positional.pickle_path
+
+    loaded_boolean, loaded_positional = InvertedIndex(), PositionalInvertedIndex()
+    assert loaded_boolean.load() and loaded_positional.load()
+    assert loaded_boolean.dictionary == boolean.dictionary
+    assert loaded_positional.dictionary == positional.dictionary
+
+def test_reload_closes_the_old_dictionary(boolean_index):
+    index = InvertedIndex()
+    assert index.load()
+    old = index.dictionary
+    token = terms(boolean_index)[0]
+
+    assert index.load()
+    assert index.dictionary is not old and old._file.closed and old._mm.closed
+    assert index.get(token) == boolean_index.get(token)
+
+    os.remove(index.index_path)
+    boolean_index.save(binary=False)
+    mapped = index.dictionary
+    assert index.load()
+    assert mapped._file.closed and index.dictionary == boolean_index.dictionary
+
+def test_saving_does_not_change_a_mapped_file(boolean_index):
+    mapped = MappedDictionary(boolean_index.index_path)
+    token = terms(boolean_index)[0]
+
+    write_index(boolean_index.index_path, {"other": [1, 2]}, boolean_kind)
+    assert list(mapped.get(token)) == list(boolean_index.get(token)) and mapped.verify()
+    assert list(MappedDictionary(boolean_index.index_path).get("other")) == [1, 2]
+    assert not os.path.exists(boolean_index.index_path + ".tmp")
+    mapped.close()
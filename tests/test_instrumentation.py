@@ -0,0 +1,75 @@
+"""
+Spans, counters, query traces and their exports
+"""
+import json
+
+import pytest
+
+import src.instrumentation as instrumentation
+from src.boolean_query_processor import BooleanQueryProcessor
+from src.inverted_intex import InvertedIndex
+from tests.conftest import terms
+
+@pytest.fixture(autouse=True)
+def clean_registry(monkeypatch):
+    for name in ("enabled", "profile_rate", "slow_query_ms", "on_query"):
+        monkeypatch.setattr(instrumentation, name, getattr(instrumentation, name))
+    instrumentation.reset()
+    yield
+    instrumentation.reset()
+
+def test_disabled_records_nothing(boolean_index):
+    w1, w2 = terms(boolean_index)[:2]
+    BooleanQueryProcessor(index=boolean_index).process(f"{w1} AND {w2}")
+
+    assert instrumentation.span("x") is instrumentation.span("y")
+    snapshot = instrumentation.snapshot()
+    assert snapshot["spans"] == {} and snapshot["counters"] == {} and snapshot["values"] == {}
+    assert instrumentation.last_trace() is None
+
+def test_query_trace(boolean_index):
+    traces = []
+    instrumentation.enable(profile=1, slow_ms=0, hook=traces.append)
+    w1, w2, w3 = terms(boolean_index)[:3]
+    BooleanQueryProcessor(index=boolean_index).process(f"{w1} AND {w2} OR {w3}")
+
+    trace = instrumentation.last_trace()
+    assert traces == [trace]
+    assert trace["name"] == "query.boolean" and trace["attrs"]["query"] == f"{w1} AND {w2} OR {w3}"
+    assert "profile" in trace
+
+    def names(span):
+        return [span["name"]] + [name for child in span.get("children", []) for name in names(child)]
+    assert {"boolean.and", "boolean.or", "posting.fetch"} <= set(names(trace))
+
+    snapshot = instrumentation.snapshot()
+    assert snapshot["counters"]["query.boolean"] == 1
+    assert snapshot["values"]["posting.length"]["count"] == 3
+    assert snapshot["slow_traces"] == [trace]
+
+def test_failed_query_trace(boolean_index):
+    instrumentation.enable()
+    with pytest.raises(Exception):
+        BooleanQueryProcessor(index=boolean_index).process("alpha AND")
+    assert "error" in instrumentation.last_trace()
+
+def test_build_metrics_and_exports(workdir):
+    instrumentation.enable()
+    index = InvertedIndex()
+    index.build()
+
+    snapshot = json.loads(instrumentation.to_json())
+    assert snapshot["counters"]["ingest.documents"] == 240
+    assert {"index.insert", "index.save", "ingest.parse"} <= set(snapshot["spans"])
+
+    text = instrumentation.to_prometheus()
+    assert '# TYPE search_span_seconds summary' in text
+    assert 'search_span_seconds_count{span="index.save"} 1' in text
+    assert 'search_events_total{name="ingest.documents"} 240' in text
+
+    instrumentation.export("metrics.prom")
+    instrumentation.export("metrics.json")
+    with open("metrics.prom") as f:
+        assert f.read() == text
+    with open("metrics.json") as f:
+        assert json.load(f)["counters"]["ingest.documents"] == 240
@@ -0,0 +1,19 @@
+"""
+Dense term ids of the lexicon
+"""
+from src.lexicon import Lexicon
+
+def test_ids_are_dense():
+    lexicon = Lexicon(["oil", "gold"])
+    assert lexicon.add("oil") == 0 and lexicon.add("price") == 2
+    assert lexicon.add_all(["gold", "wheat", "oil", "wheat"]) == [1, 3, 0, 3]
+    assert lexicon.get("corn") is None and lexicon.get("corn", -1) == -1
+    assert lexicon.term(3) == "wheat" and "gold" in lexicon and "corn" not in lexicon
+    assert len(lexicon) == 4 and list(lexicon) == lexicon.terms() == ["oil", "gold", "price", "wheat"]
+
+def test_bytes_round_trip():
+    for terms in ([], [""], ["oil"], ["oil", "", "ölçü", "gold"]):
+        lexicon = Lexicon(terms)
+        loaded = Lexicon.from_bytes(lexicon.to_bytes(), len(terms))
+        assert loaded == lexicon and loaded.terms() == terms
+        assert all(loaded.get(term) == term_id for term_id, term in enumerate(terms))
@@ -0,0 +1,72 @@
+"""
+Phrase, NEAR/k and ONEAR/k queries against brute force
+"""
+import itertools
+
+import pytest
+
+from src.query_parser import QuerySyntaxError
+from src.query_processor import QueryProcessor
+from tests.conftest import terms
+
+@pytest.fixture
+def processor(positional_index):
+    return QueryProcessor()
+
+def positions(index, words):
+    """
+    doc_id -> position lists of the words, for the documents that have all words
+    """
+    postings = [{doc_id: list(doc_positions) for doc_id, doc_positions in index.get(word)} for word in words]
+    doc_ids = set.intersection(*(set(posting) for posting in postings))
+    return {doc_id: [posting[doc_id] for posting in postings] for doc_id in doc_ids}
+
+def brute_force(index, words, match):
+    result = []
+    for doc_id, position_lists in sorted(positions(index, words).items()):
+        starts = sorted({combination[0] if match is phrase else min(combination)
+                         for combination in itertools.product(*position_lists) if match(combination)})
+        if starts:
+            result.append({"positions": starts, "doc_id": doc_id})
+    return result
+
+def phrase(combination):
+    return all(combination[i] == combination[0] + i for i in range(len(combination)))
+
+def near(k):
+    return lambda combination: max(combination) - min(combination) <= k
+
+def ordered_near(k):
+    return lambda combination: (all(a < b for a, b in zip(combination, combination[1:]))
+                                and combination[-1] - combination[0] <= k)
+
+def word_pairs(index, count=6):
+    frequent = terms(index)[:count]
+    return list(itertools.permutations(frequent, 2))
+
+def test_phrase_queries(positional_index, processor):
+    for w1, w2 in word_pairs(positional_index):
+        assert processor.process(f'"{w1} {w2}"') == brute_force(positional_index, [w1, w2], phrase), (w1, w2)
+
+@pytest.mark.parametrize("k", [1, 3, 8])
+def test_near_queries(positional_index, processor, k):
+    for w1, w2 in word_pairs(positional_index):
+        expected_docs = [entry["doc_id"] for entry in brute_force(positional_index, [w1, w2], near(k))]
+        result = processor.process(f"{w1} NEAR/{k} {w2}")
+        assert [entry["doc_id"] for entry in result] == expected_docs, (w1, w2)
+
+@pytest.mark.parametrize("k", [1, 3, 8])
+def test_ordered_near_queries(positional_index, processor, k):
+    for w1, w2 in word_pairs(positional_index):
+        expected = brute_force(positional_index, [w1, w2], ordered_near(k))
+        assert processor.process(f"{w1} ONEAR/{k} {w2}") == expected, (w1, w2)
+
+    w1, w2, w3 = terms(positional_index)[:3]
+    expected_docs = [entry["doc_id"] for entry in brute_force(positional_index, [w1, w2, w3], ordered_near(k))]
+    result = processor.process(f"{w1} ONEAR/{k} {w2} ONEAR/{k} {w3}")
+    assert [entry["doc_id"] for entry in result] == expected_docs
+
+@pytest.mark.parametrize("q", ["alpha NEAR/3", "NEAR/3 alpha", "alpha beta NEAR/3 gamma", "alpha NEAR/3 beta ONEAR/3 gamma"])
+def test_proximity_syntax_errors(processor, q):
+    with pytest.raises(QuerySyntaxError):
+        processor.process(q)
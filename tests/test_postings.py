@@ -0,0 +1,106 @@
+"""
+Posting list encodings
+"""
+import pickle
+import random
+
+import pytest
+
+import src.inverted_intex as inverted_intex
+from src.inverted_intex import InvertedIndex
+from src.positional_inverted_index import PositionalInvertedIndex
+from src.postings import CompressedPosting, PositionalPosting, encode_gaps, decode_gaps, posting_size_report, posting_cursor
+
+@pytest.mark.parametrize("ids", [[], [0], [1, 2, 3], [5, 127, 128, 16511, 16512, 2 ** 32 + 7],
+                                 sorted(random.Random(1).sample(range(1, 10 ** 6), 1000))])
+def test_compressed_posting_round_trip(ids):
+    data, length = encode_gaps(ids)
+    assert list(decode_gaps(data)) == ids and length == len(ids)
+
+    posting = CompressedPosting(ids)
+    assert len(posting) == len(ids)
+    assert list(posting) == posting.tolist() == ids
+    assert posting == ids and posting == CompressedPosting(ids)
+    assert pickle.loads(pickle.dumps(posting)) == posting
+    assert CompressedPosting.from_bytes(posting.data, len(ids)) == posting
+
+def test_small_gaps_take_one_byte():
+    posting = CompressedPosting(range(1, 1001))
+    assert len(posting.data) == 1000
+
+def test_size_report(boolean_index):
+    report = posting_size_report(boolean_index.dictionary)
+    assert report["ids"] == sum(len(posting) for posting in boolean_index.dictionary.values())
+    assert report["compressed_bytes"] < report["list_bytes"]
+
+@pytest.mark.parametrize("kind", [CompressedPosting, list])
+def test_cursor_advance_to(kind):
+    rng = random.Random(2)
+    ids = sorted(rng.sample(range(1, 20000), 900))
+    cursor = posting_cursor(kind(ids))
+    assert cursor.doc_id == ids[0]
+
+    # Random increasing targets with some next() calls between them
+    for target in sorted(rng.sample(range(20002), 300)):
+        expected = next((doc_id for doc_id in ids if doc_id >= max(target, cursor.doc_id or 0)), None)
+        assert cursor.advance_to(target) == expected
+        if expected is None:
+            break
+        if rng.random() < 0.3:
+            following = next((doc_id for doc_id in ids if doc_id > expected), None)
+            assert cursor.next() == following
+
+def test_skip_pointers_are_saved(boolean_index):
+    loaded = InvertedIndex()
+    assert loaded.load()
+    for token, posting in boolean_index.dictionary.items():
+        mapped = loaded.dictionary[token]
+        assert mapped.skip_data == posting.skip_data
+        ids = posting.tolist()
+        cursor = mapped.cursor()
+        assert cursor.advance_to(ids[-1]) == ids[-1]
+
+@pytest.mark.parametrize("ratio", [0, 10 ** 9])
+def test_intersection_paths(monkeypatch, ratio):
+    # 0 -> search the short posting in the long one, 10 ** 9 -> linear merge
+    monkeypatch.setattr(inverted_intex, "gallop_ratio", ratio)
+    rng = random.Random(3)
+    index = InvertedIndex()
+    for short_length, long_length in [(0, 10), (5, 3000), (300, 3000), (1000, 1000)]:
+        short = sorted(rng.sample(range(5000), short_length))
+        long = sorted(rng.sample(range(5000), long_length))
+        expected = sorted(set(short) & set(long))
+        for l, r in [(short, long), (long, short)]:
+            assert index.merge(CompressedPosting(l), CompressedPosting(r)) == expected
+            assert index.merge(l, r) == expected
+
+def test_positional_posting():
+    entries = [(2, [0, 5, 9]), (4, []), (11, [3])]
+    posting = PositionalPosting.from_entries(entries)
+
+    assert len(posting) == 3
+    assert [(doc_id, list(positions)) for doc_id, positions in posting] == entries
+    assert list(posting.positions(0)) == [0, 5, 9]
+    assert posting.find(4) == 1 and posting.find(5) == -1
+    assert posting.to_dicts() == [{"positions": positions, "doc_id": doc_id} for doc_id, positions in entries]
+    assert pickle.loads(pickle.dumps(posting)) == posting
+    assert PositionalPosting.from_doc_ids([1, 3]) == PositionalPosting.from_entries([(1, []), (3, [])])
+
+def test_positional_add(monkeypatch):
+    index = PositionalInvertedIndex()
+    for doc_id, positions in [(3, [1]), (8, [0, 4]), (5, [2]), (8, [7]), (12, [3])]:
+        index.add("oil", {"doc_id": doc_id, "positions": positions})
+    expected = [(3, [1]), (5, [2]), (8, [0, 4, 7]), (12, [3])]
+    assert [(doc_id, list(positions)) for doc_id, positions in index.get("oil")] == expected
+
+    # A new last document is appended without copying the posting
+    monkeypatch.setattr(PositionalPosting, "__iter__", None)
+    index.add("oil", {"doc_id": 20, "positions": [1]})
+    assert list(index.get("oil").doc_ids) == [3, 5, 8, 12, 20]
+
+def test_positional_postings_are_loaded(positional_index):
+    loaded = type(positional_index)()
+    assert loaded.load()
+    for token, posting in positional_index.dictionary.items():
+        if token not in positional_index.pseudo_terms:
+            assert loaded.get(token) == posting
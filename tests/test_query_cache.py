@@ -0,0 +1,93 @@
+"""
+Query result cache: LRU limits, TTL and invalidation by index generation
+"""
+from src.boolean_query_processor import BooleanQueryProcessor
+from src.query_cache import QueryCache
+from src.query_processor import QueryProcessor
+from tests.conftest import terms
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+def test_lru_eviction():
+    cache = QueryCache(max_entries=2)
+    cache.put("a", [1])
+    cache.put("b", [2])
+    assert cache.get("a") == [1]
+    cache.put("c", [3])
+
+    assert "b" not in cache and "a" in cache and "c" in cache
+    assert cache.stats()["evictions"] == 1
+
+def test_max_bytes():
+    cache = QueryCache(max_entries=None, max_bytes=1000)
+    cache.put("big", list(range(1000)))
+    assert "big" not in cache
+
+    for i in range(50):
+        cache.put(i, [i])
+    assert cache.stats()["bytes"] <= 1000 and 0 < len(cache) < 50
+
+def test_ttl():
+    clock = Clock()
+    cache = QueryCache(ttl=10, clock=clock)
+    cache.put("a", [1])
+    clock.now = 9
+    assert cache.get("a") == [1]
+    clock.now = 10
+    assert cache.get("a") is None
+    assert cache.stats()["expirations"] == 1
+
+def test_generation_change_clears_the_cache():
+    cache = QueryCache()
+    cache.put("a", [1], generation=1)
+    assert cache.get("a", generation=1) == [1]
+    assert cache.get("a", generation=2) is None
+    assert cache.stats()["invalidations"] == 1
+
+def test_generation_change_keeps_other_scopes():
+    cache = QueryCache()
+    cache.put("a", [1], generation=1, scope="first")
+    cache.put("a", [2], generation=5, scope="second")
+    assert cache.get("a", generation=2, scope="first") is None
+    assert cache.get("a", generation=5, scope="second") == [2]
+    assert len(cache) == 1
+
+def test_boolean_results_are_cached(boolean_index):
+    cache = QueryCache()
+    processor = BooleanQueryProcessor(cache=cache)
+    w1, w2 = terms(boolean_index)[:2]
+    expected = BooleanQueryProcessor().process(f"{w1} AND {w2}")
+
+    assert processor.process(f"{w1} AND {w2}") == expected
+    result = processor.process(f"{w1}  AND {w2}.")
+    assert result == expected and cache.hits == 1
+    result.append(0)
+    assert processor.process(f"{w1} AND {w2}") == expected
+
+    processor._index.load()
+    assert processor.process(f"{w1} AND {w2}") == expected
+    assert cache.misses == 2
+
+    # Another index with the same cache does not drop the entries of the first one
+    other = BooleanQueryProcessor(cache=cache)
+    other._index.load()
+    assert other.process(f"{w1} AND {w2}") == expected
+    assert processor.process(f"{w1} AND {w2}") == expected
+    assert cache.misses == 3 and cache.stats()["entries"] == 2
+
+def test_query_types_do_not_share_entries(positional_index):
+    cache = QueryCache()
+    processor = QueryProcessor(cache=cache)
+    uncached = QueryProcessor()
+    w1, w2 = terms(positional_index)[:2]
+
+    for q in (f'"{w1} {w2}"', f"{w1} {w2}", f"{w1} NEAR/3 {w2}", f"{w1} ONEAR/3 {w2}", f"{w1} NEAR/5 {w2}"):
+        assert processor.process(q) == uncached.process(q)
+        assert processor.process(q) == uncached.process(q)
+    assert processor.process(f"{w1} {w2}", 2) == uncached.process(f"{w1} {w2}", 2)
+    assert cache.stats()["entries"] == 6 and cache.hits == 5
@@ -0,0 +1,132 @@
+"""
+Free text queries are ranked by the cosine similarity of log scaled tf-idf vectors
+"""
+import math
+
+import pytest
+
+from src.metrics import calculate_idf, calculate_tf
+import src.instrumentation as instrumentation
+import src.query_processor as query_processor
+from src.query_processor import QueryProcessor
+from tests.conftest import terms
+
+def ranking(result):
+    """
+    [(doc_id, score)] of the result lines: Document-X with cosine similarity:Y
+    """
+    rows = []
+    for line in result:
+        document, score = line.split(" with cosine similarity:")
+        rows.append((int(document.split("-")[1]), float(score)))
+    return rows
+
+def document_vectors(index):
+    """
+    {doc_id: {token: log scaled tf * idf}} from the postings
+    """
+    N = len(index.universe())
+    vectors = {}
+    for token in index.dictionary:
+        if token in index.pseudo_terms:
+            continue
+        posting = index.get(token)
+        idf = calculate_idf(N, len(posting))
+        for doc_id, positions in posting:
+            vectors.setdefault(doc_id, {})[token] = calculate_tf(len(positions)) * idf
+    return vectors
+
+def brute_force(index, q_tokens, excluded=()):
+    """
+    Cosine similarity of the whole document vectors and the query vector
+    """
+    N = len(index.universe())
+    query = {token: calculate_tf(q_tokens.count(token)) * calculate_idf(N, len(index.get(token)))
+             for token in set(q_tokens)}
+    query_length = math.sqrt(sum(value * value for value in query.values()))
+    excluded_ids = {doc_id for token in excluded for doc_id in index.get(token).doc_ids}
+
+    scores = {}
+    for doc_id, vector in document_vectors(index).items():
+        if doc_id in excluded_ids or not set(vector) & set(query):
+            continue
+        length = math.sqrt(sum(value * value for value in vector.values()))
+        product = sum(query[token] * vector.get(token, 0) for token in query)
+        scores[doc_id] = product / (query_length * length) if query_length and length else 0
+    return scores
+
+def test_ranked_queries(positional_index):
+    processor = QueryProcessor()
+    frequent = terms(positional_index)
+    queries = [[frequent[12]], [frequent[10], frequent[30]], [frequent[15], frequent[40], frequent[90]]]
+
+    for q_tokens in queries:
+        result = ranking(processor.process(" ".join(q_tokens)))
+        expected = brute_force(positional_index, q_tokens)
+
+        assert {doc_id for doc_id, _ in result} == set(expected)
+        for doc_id, score in result:
+            assert score == pytest.approx(expected[doc_id], abs=1e-3), (q_tokens, doc_id)
+        assert [score for _, score in result] == sorted((score for _, score in result), reverse=True)
+
+def test_ranked_query_with_not(positional_index):
+    w1, w2, w3 = terms(positional_index)[20:23]
+    result = ranking(QueryProcessor().process(f"{w1} {w2} NOT {w3}"))
+    expected = brute_force(positional_index, [w1, w2], [w3])
+
+    assert {doc_id for doc_id, _ in result} == set(expected)
+    for doc_id, score in result:
+        assert score == pytest.approx(expected[doc_id], abs=1e-3)
+
+def test_top_k_is_the_head_of_the_ranking(positional_index):
+    processor = QueryProcessor()
+    frequent = terms(positional_index)
+    queries = [frequent[0], f"{frequent[0]} {frequent[1]}", f"{frequent[2]} {frequent[10]} {frequent[40]}",
+               f"{frequent[0]} {frequent[3]} NOT {frequent[1]}", " ".join(frequent[i] for i in (0, 1, 2, 5, 9, 30, 80, 150))]
+    for q in queries:
+        full = processor.process(q)
+        for top_k in (1, 3, 10, 1000):
+            assert processor.process(q, top_k) == full[:top_k], (q, top_k)
+
+def test_raw_scores(positional_index):
+    processor, raw = QueryProcessor(), QueryProcessor(raw_scores=True)
+    frequent = terms(positional_index)
+    for q in (frequent[0], f"{frequent[0]} {frequent[1]}", f"{frequent[2]} {frequent[10]} NOT {frequent[1]}"):
+        for top_k in (None, 1, 5):
+            assert raw.process(q, top_k) == ranking(processor.process(q, top_k)), (q, top_k)
+            assert raw.process_batch([q], top_k) == [ranking(processor.process(q, top_k))], (q, top_k)
+
+def test_paging_and_count(positional_index):
+    processor = QueryProcessor(index=positional_index)
+    frequent = terms(positional_index)
+    queries = [frequent[0], f"{frequent[2]} {frequent[10]} {frequent[40]}",
+               f"{frequent[0]} {frequent[3]} NOT {frequent[1]}", f'"{frequent[0]} {frequent[1]}"',
+               f"{frequent[0]} NEAR/4 {frequent[2]}"]
+    for q in queries:
+        full = processor.process(q)
+        assert processor.count(q) == len(full)
+        for top_k in (1, 5, 20):
+            for offset in (0, 3, len(full)):
+                assert processor.process(q, top_k, offset) == full[offset:offset + top_k], (q, top_k, offset)
+
+@pytest.mark.parametrize("exhaustive_length", [0, 10 ** 9])
+def test_top_k_of_broad_or_query(positional_index, monkeypatch, exhaustive_length):
+    # 0 -> MaxScore, 10 ** 9 -> bounded heap over all documents
+    monkeypatch.setattr(query_processor, "exhaustive_top_k_length", exhaustive_length)
+    processor = QueryProcessor(index=positional_index)
+    frequent = terms(positional_index)
+    q = " ".join(frequent[i] for i in (0, 1, 2, 5, 9, 30, 80, 150))
+    full = processor.process(q)
+
+    for top_k in (1, 3, 10):
+        assert processor.process(q, top_k) == full[:top_k]
+
+    if not exhaustive_length:
+        # MaxScore fully scores only a part of the candidates
+        instrumentation.reset()
+        instrumentation.enable()
+        try:
+            processor.process(q, 3)
+        finally:
+            instrumentation.disable()
+        assert instrumentation.snapshot()["counters"]["ranked.top_k.scored"] < len(full) // 2
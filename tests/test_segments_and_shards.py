@@ -0,0 +1,195 @@
+"""
+Segmented index against a fresh build and sharded against unsharded scores
+"""
+import os
+import random
+import threading
+
+import pytest
+
+from src.boolean_query_processor import BooleanQueryProcessor
+from src.inverted_intex import InvertedIndex
+from src.positional_inverted_index import PositionalInvertedIndex
+from src.query_processor import QueryProcessor
+from src.collection_statistics import CollectionStatistics
+from src.segments import SegmentedIndex, manifest_name
+from src.sharding import build_shards, ShardedQueryProcessor
+from src.term_dictionary import WildcardError
+from tests.conftest import terms
+
+def documents(index):
+    sgmp = index.sgmp
+    return [doc for sgm in sgmp.sgm_files() for doc in sgmp._parse_documents(sgmp._read_chunks(sgm))]
+
+def ranked_queries(index):
+    frequent = terms(index)
+    return [frequent[0], f"{frequent[0]} {frequent[1]}", f"{frequent[3]} {frequent[20]} {frequent[60]}",
+            f"{frequent[1]} {frequent[2]} NOT {frequent[0]}", f'"{frequent[0]} {frequent[1]}"',
+            f"{frequent[0]} NEAR/3 {frequent[2]}", f"{frequent[2][:2]}* {frequent[4]}"]
+
+def boolean_queries(index):
+    w1, w2, w3 = terms(index)[:3]
+    return [w1, f"{w1} AND {w2}", f"{w1} OR {w2} NOT {w3}", f"NOT {w2}"]
+
+@pytest.mark.parametrize("index_class, processor_class, queries", [
+    (InvertedIndex, BooleanQueryProcessor, boolean_queries),
+    (PositionalInvertedIndex, QueryProcessor, ranked_queries),
+])
+def test_segmented_is_same_as_fresh_build(workdir, index_class, processor_class, queries):
+    fresh = index_class()
+    fresh.build()
+    docs = documents(fresh)
+    deleted = set(random.Random(4).sample([doc.id for doc in docs], 30))
+
+    segmented = SegmentedIndex(index_class, "segments", merge_factor=2, background_merge=False)
+    for start in range(0, len(docs), 50):
+        segmented.add_documents(docs[start:start + 50])
+    segmented.delete_documents(deleted)
+
+    live = SegmentedIndex(index_class, "live", background_merge=False)
+    live.add_documents(doc for doc in docs if doc.id not in deleted)
+
+    queries = queries(fresh)
+    for q in queries:
+        assert processor_class(index=segmented).process(q) == processor_class(index=live).process(q), q
+
+    # Without the deletes it is the same as the fresh build
+    segmented.add_documents(doc for doc in docs if doc.id in deleted)
+    segmented.merge_segments()
+    for q in queries:
+        assert processor_class(index=segmented).process(q) == processor_class(index=fresh).process(q), q
+
+    reopened = SegmentedIndex(index_class, "segments")
+    assert reopened.load()
+    for q in queries:
+        assert processor_class(index=reopened).process(q) == processor_class(index=fresh).process(q), q
+
+def test_background_merge(workdir):
+    fresh = InvertedIndex()
+    fresh.build()
+    docs = documents(fresh)
+
+    segmented = SegmentedIndex(InvertedIndex, "segments", merge_factor=3)
+    for start in range(0, len(docs), 20):
+        segmented.add_documents(docs[start:start + 20])
+    segmented.wait_for_merges()
+
+    assert len(segmented.segments) < len(docs) // 20
+    assert list(segmented.universe()) == list(fresh.universe())
+    for q in boolean_queries(fresh):
+        assert BooleanQueryProcessor(index=segmented).process(q) == BooleanQueryProcessor(index=fresh).process(q), q
+    assert sorted(os.listdir("segments")) == sorted([segment.name + ".idx" for segment in segmented.segments] + [manifest_name])
+
+def test_queries_during_background_merges(workdir):
+    fresh = InvertedIndex()
+    fresh.build()
+    docs = documents(fresh)
+    queries = boolean_queries(fresh)
+
+    segmented = SegmentedIndex(InvertedIndex, "segments", merge_factor=2)
+    segmented.add_documents(docs[:10])
+    writer = threading.Thread(target=lambda: [segmented.add_documents(docs[start:start + 10])
+                                              for start in range(10, len(docs), 10)])
+    writer.start()
+
+    errors = []
+    while writer.is_alive() or segmented._merge_thread is not None:
+        for q in queries:
+            try:
+                BooleanQueryProcessor(index=segmented).process(q)
+                for token in segmented.keys():
+                    segmented.get(token)
+            except Exception as e:
+                errors.append(e)
+    writer.join()
+    segmented.wait_for_merges()
+
+    assert errors == []
+    for q in queries:
+        assert BooleanQueryProcessor(index=segmented).process(q) == BooleanQueryProcessor(index=fresh).process(q), q
+
+@pytest.mark.parametrize("merge_factor", [1, 0, -2])
+def test_merge_factor_is_checked(workdir, merge_factor):
+    with pytest.raises(ValueError):
+        SegmentedIndex(InvertedIndex, "segments", merge_factor=merge_factor)
+
+def test_merge_keeps_old_segments_readable_and_deletes_by_id(workdir):
+    docs = documents(InvertedIndex())
+    segmented = SegmentedIndex(InvertedIndex, "segments", merge_factor=100, background_merge=False)
+    for start in range(0, 120, 40):
+        segmented.add_documents(docs[start:start + 40])
+
+    assert segmented.delete_documents([docs[0].id, docs[50].id, docs[50].id, 10 ** 6]) == 2
+    assert segmented.delete_documents([docs[0].id]) == 0
+    segmented.add_documents(docs[100:101])
+    assert [len(segment.deleted) for segment in segmented.segments] == [1, 1, 1, 0]
+
+    old = list(segmented.segments)
+    token = segmented.keys()[0]
+    before = list(segmented.get(token))
+    segmented.merge_segments()
+    # A query that still holds the old snapshot can read it
+    assert list(segmented._merged_posting(old, token)) == before
+    assert len(segmented.universe()) == 118
+
+@pytest.mark.parametrize("partition", ["hash", [60, 150]])
+def test_sharded_is_same_as_unsharded(positional_index, partition):
+    processor = QueryProcessor(index=positional_index)
+    build_shards(PositionalInvertedIndex, 3, "shards", partition)
+    queries = ranked_queries(positional_index)
+    with ShardedQueryProcessor("shards") as sharded:
+        for q in queries:
+            assert sharded.process(q) == processor.process(q), q
+            assert sharded.process(q, 5) == processor.process(q, 5), q
+            assert sharded.process(q, 5, 2) == processor.process(q, 5, 2), q
+        assert sharded.process_batch(queries, 3) == [processor.process(q, 3) for q in queries]
+
+        # The limit applies to the terms of the whole collection
+        sharded.max_expansions = 1
+        with pytest.raises(WildcardError):
+            sharded.process(queries[-1])
+
+def test_sharded_boolean_is_same_as_unsharded(boolean_index):
+    processor = BooleanQueryProcessor(index=boolean_index)
+    build_shards(InvertedIndex, 3, "shards")
+    with ShardedQueryProcessor("shards") as sharded:
+        for q in boolean_queries(boolean_index):
+            assert sharded.process(q) == processor.process(q), q
+
+def test_segment_statistics_are_updated_incrementally(workdir):
+    fresh = PositionalInvertedIndex()
+    fresh.build(save=False)
+    docs = documents(fresh)
+    segmented = SegmentedIndex(PositionalInvertedIndex, "segments", merge_factor=100, background_merge=False)
+
+    rng = random.Random(5)
+    for start in range(0, len(docs), 60):
+        segmented.add_documents(docs[start:start + 60])
+        segmented.delete_documents(rng.sample([doc.id for doc in docs[:start + 60]], 10))
+
+        statistics = segmented.statistics()
+        expected = CollectionStatistics.from_postings(segmented.postings(), len(segmented.universe()))
+        assert statistics.N == expected.N
+        for token in (token for token, _ in segmented.postings()):
+            i, j = statistics.terms.get(token), expected.terms.get(token)
+            assert statistics.dfs[i] == expected.dfs[j], token
+            assert statistics.bounds[i] == pytest.approx(expected.bounds[j]), token
+        for doc_id in segmented.universe().doc_ids:
+            assert statistics.norms[doc_id] == pytest.approx(expected.norms[doc_id])
+            assert statistics.lengths[doc_id] == fresh.statistics().lengths[doc_id]
+
+def test_segmented_spelling_uses_segment_dfs(workdir, monkeypatch):
+    fresh = InvertedIndex()
+    fresh.build(save=False)
+    docs = documents(fresh)
+    segmented = SegmentedIndex(InvertedIndex, "segments", merge_factor=100, background_merge=False)
+    for start in range(0, len(docs), 80):
+        segmented.add_documents(docs[start:start + 80])
+    segmented.delete_documents(random.Random(6).sample([doc.id for doc in docs], 40))
+
+    expected = {token: len(segmented.get(token)) for token in segmented.keys()}
+
+    # The spelling index does not read the postings
+    monkeypatch.setattr(segmented, "get", None)
+    spelling = BooleanQueryProcessor(index=segmented).spelling_index()
+    assert {term: spelling.df(term) for term in spelling.terms.terms()} == expected
@@ -0,0 +1,94 @@
+"""
+Query server: the answers of the workers and the error statuses
+"""
+import asyncio
+import json
+import os
+import signal
+
+from src.boolean_query_processor import BooleanQueryProcessor
+from src.query_processor import QueryProcessor
+from src.server import QueryServer
+from tests.conftest import terms
+
+async def request(server, method, path, body=b""):
+    """
+    Send one request, returns (status, response dict)
+    """
+    return await raw_request(server, f"{method} {path} HTTP/1.1\r\nContent-Length: {len(body)}\r\n"
+                                     f"Connection: close\r\n\r\n".encode() + body)
+
+async def raw_request(server, data):
+    reader, writer = await asyncio.open_connection(server.host, server.port)
+    writer.write(data)
+    await writer.drain()
+    data = await reader.read()
+    writer.close()
+
+    head, _, body = data.partition(b"\r\n\r\n")
+    return int(head.split(b" ")[1]), json.loads(body)
+
+async def query(server, **request_dict):
+    return await request(server, "POST", "/query", json.dumps(request_dict).encode())
+
+def test_server(workdir):
+    async def run():
+        # The indexes are not built yet, the server builds them once before the workers start
+        server = QueryServer(port=0, workers=2)
+        await server.start()
+        try:
+            boolean_processor, ranked_processor = BooleanQueryProcessor(), QueryProcessor()
+            w1, w2 = terms(boolean_processor._index)[:2]
+
+            status, health = await request(server, "GET", "/health")
+            assert status == 200 and health["status"] == "ok" and health["workers"] == 2
+
+            status, response = await query(server, query=f"{w1} AND {w2}", mode="boolean")
+            assert status == 200 and response["results"] == boolean_processor.process(f"{w1} AND {w2}")
+            status, response = await query(server, query=f"{w1} {w2}", top_k=5)
+            assert status == 200 and response["results"] == ranked_processor.process(f"{w1} {w2}", 5)
+            status, response = await query(server, query=f"{w1} {w2}", top_k=5, offset=2)
+            assert status == 200 and response["results"] == ranked_processor.process(f"{w1} {w2}", 5, 2)
+
+            assert (await query(server, query=f"{w1} AND", mode="boolean"))[0] == 400
+            assert (await query(server, query=3))[0] == 400
+            assert (await query(server, query=w1, mode="other"))[0] == 400
+            assert (await query(server, query=f'"{w1} {w2}"', top_k=-1))[0] == 400
+            assert (await request(server, "POST", "/query", b"not json"))[0] == 400
+            assert (await request(server, "GET", "/query"))[0] == 405
+            assert (await request(server, "GET", "/other"))[0] == 404
+            assert (await raw_request(server, b"POST /query HTTP/1.1\r\nContent-Length: abc\r\n\r\n"))[0] == 400
+            assert (await raw_request(server, b"POST /query HTTP/1.1\r\nContent-Length: -4\r\n\r\n"))[0] == 400
+
+            # Dead workers give 500, then the pool is started again
+            for pid in list(server._pool._processes):
+                os.kill(pid, signal.SIGKILL)
+            assert (await query(server, query=w1))[0] == 500
+            assert (await query(server, query=w1))[0] == 200
+
+            server.max_pending = 0
+            assert (await query(server, query=w1))[0] == 503
+        finally:
+            await server.stop()
+
+    asyncio.run(run())
+
+def test_server_corrects_spelling(boolean_index, positional_index):
+    async def run():
+        server = QueryServer(port=0, workers=1, correct_spelling=True)
+        await server.start()
+        try:
+            word = next(word for word in terms(boolean_index)[10:] if word.isalpha() and len(word) > 5)
+            typo = word[:2] + word[3:]
+            assert BooleanQueryProcessor(index=boolean_index).process(typo) == []
+            boolean = BooleanQueryProcessor(index=boolean_index, correct_spelling=True)
+            ranked = QueryProcessor(index=positional_index, correct_spelling=True)
+
+            status, response = await query(server, query=typo, mode="boolean")
+            assert status == 200 and response["results"] == boolean.process(typo) and response["results"]
+            status, response = await query(server, query=typo, top_k=5)
+            assert status == 200 and response["results"] == ranked.process(typo, 5)
+        finally:
+            await server.stop()
+
+    asyncio.run(run())
@@ -0,0 +1,48 @@
+"""
+Streaming SGM parser: chunk boundaries do not change the parsed documents
+"""
+import re
+
+import pytest
+
+from src.sgm_preprocessor import SGMPreprocessor
+
+def regex_documents(sgmp):
+    """
+    (id, content) of the documents of all sgm files, parsed from the whole file text
+    """
+    result = []
+    for sgm in sgmp.sgm_files():
+        with open(f"{sgmp._dataset}/{sgm}", encoding="latin-1") as f:
+            text = f.read().replace("\n", " ")
+        for doc in re.findall("<REUTERS(.*?)</REUTERS>", text, re.DOTALL):
+            title = re.findall("<TITLE>(.*?)</TITLE>", doc, re.DOTALL)
+            body = re.findall("<BODY>(.*?)</BODY>", doc, re.DOTALL)
+            doc_id = int(re.findall('NEWID="(.*?)">', doc, re.DOTALL)[0])
+            result.append((doc_id, " ".join([title[0] if title else "", body[0] if body else ""])))
+    return result
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 100, 1 << 20])
+def test_chunk_size_does_not_change_documents(workdir, chunk_size):
+    sgmp = SGMPreprocessor(chunk_size=chunk_size)
+    documents = [(doc.id, doc.content) for sgm in sgmp.sgm_files()
+                 for doc in sgmp._parse_documents(sgmp._read_chunks(sgm))]
+    assert documents == regex_documents(sgmp)
+
+def test_documents_without_id_and_fields(workdir):
+    chunks = ['<REUTERS OLDID="1">no id</REUTERS> <REUTERS NEWID="7"><TITLE>only ',
+              'title</TITLE></REUTERS><REUTERS NEWID="8"><BODY>only body</BODY></REUTERS> trailing <REUT']
+    documents = list(SGMPreprocessor()._parse_documents(chunks))
+    assert [(doc.id, doc.content) for doc in documents] == [(7, "only title "), (8, " only body")]
+
+def test_long_document_over_many_chunks(workdir):
+    body = "oil price " * 500
+    chunks = ['<REUTERS NEWID="3"><BODY>'] + [body[i:i + 9] for i in range(0, len(body), 9)] + ["</BODY></REU", "TERS>"]
+    documents = list(SGMPreprocessor()._parse_documents(chunks))
+    assert [(doc.id, doc.content) for doc in documents] == [(3, " " + body)]
+
+def test_iter_documents_are_normalized(workdir):
+    documents = list(SGMPreprocessor().iter_documents())
+    assert len(documents) == 240
+    assert [doc.id for doc in documents] == list(range(1, 241))
+    assert all(doc.content == doc.content.casefold() and "." not in doc.content for doc in documents)
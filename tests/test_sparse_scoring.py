@@ -0,0 +1,33 @@
+"""
+The sparse matrix backend of process_batch gives the same results as process
+"""
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("scipy")
+
+import src.sparse_scoring as sparse_scoring
+from src.query_processor import QueryProcessor
+from src.positional_inverted_index import PositionalInvertedIndex
+from tests.conftest import terms
+
+@pytest.fixture
+def queries(positional_index):
+    frequent = terms(positional_index)
+    return [frequent[0], f"{frequent[10]} {frequent[30]}", f"{frequent[15]} {frequent[40]} {frequent[90]}",
+            f"{frequent[2]} {frequent[2]} {frequent[7]}", f"{frequent[0]} {frequent[3]} NOT {frequent[1]}",
+            f'"{frequent[0]} {frequent[1]}"', f"{frequent[0]} NEAR/3 {frequent[1]}", "NOT"]
+
+@pytest.mark.parametrize("top_k", [None, 1, 5])
+def test_process_batch_is_same_as_process(positional_index, queries, top_k):
+    processor = QueryProcessor()
+    assert processor.process_batch(queries, top_k) == [processor.process(q, top_k) for q in queries]
+
+def test_process_batch_without_numpy(positional_index, queries, monkeypatch):
+    monkeypatch.setattr(sparse_scoring, "available", False)
+    processor = QueryProcessor()
+    assert processor.process_batch(queries) == [processor.process(q) for q in queries]
+
+def test_index_without_postings(workdir):
+    scorer = sparse_scoring.SparseScorer(PositionalInvertedIndex())
+    assert scorer.search([(["alpha"], []), (["alpha", "beta"], ["gamma"])], 3) == [[], []]
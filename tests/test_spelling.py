@@ -0,0 +1,105 @@
+"""
+Spelling suggestions against brute force, query correction and the spelling file
+"""
+import os
+import random
+
+from src.boolean_query_processor import BooleanQueryProcessor
+from src.inverted_intex import InvertedIndex
+from src.positional_inverted_index import PositionalInvertedIndex
+from src.query_worker import prepare_indexes
+from src.query_processor import QueryProcessor
+from src.spelling import SpellingIndex, auto_distance, edit_distance
+from tests.conftest import terms
+
+def distance(a, b):
+    """
+    Optimal string alignment distance, the full table
+    """
+    table = [[i + j if i * j == 0 else 0 for j in range(len(b) + 1)] for i in range(len(a) + 1)]
+    for i in range(1, len(a) + 1):
+        for j in range(1, len(b) + 1):
+            table[i][j] = min(table[i - 1][j] + 1, table[i][j - 1] + 1,
+                              table[i - 1][j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                table[i][j] = min(table[i][j], table[i - 2][j - 2] + 1)
+    return table[-1][-1]
+
+def typos(words, count, seed=2):
+    """
+    Words with one or two random edits
+    """
+    rng = random.Random(seed)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    result = []
+    for _ in range(count):
+        word = list(rng.choice(words))
+        for _ in range(rng.randint(1, 2)):
+            i = rng.randrange(len(word))
+            edit = rng.choice(("insert", "delete", "replace", "swap"))
+            if edit == "insert":
+                word.insert(i, rng.choice(letters))
+            elif edit == "delete" and len(word) > 1:
+                del word[i]
+            elif edit == "replace":
+                word[i] = rng.choice(letters)
+            elif i + 1 < len(word):
+                word[i], word[i + 1] = word[i + 1], word[i]
+        result.append("".join(word))
+    return result
+
+def test_edit_distance():
+    for a in ("", "oil", "price", "petroleum", "abcdef"):
+        for b in typos(["oil", "price", "petroleum", "abcdef", "x"], 30) + ["", a]:
+            for max_distance in (0, 1, 2, 3):
+                assert edit_distance(a, b, max_distance) == min(distance(a, b), max_distance + 1), (a, b)
+
+def test_suggestions_are_same_as_brute_force(boolean_index):
+    dfs = {term: len(boolean_index.get(term)) for term in boolean_index.keys()}
+    spelling = SpellingIndex.from_index(boolean_index)
+    words = [term for term in dfs if len(term) <= spelling.prefix_length]
+
+    for word in typos(words, 300):
+        max_distance = auto_distance(word)
+        expected = sorted(((term, distance(word, term), df) for term, df in dfs.items()
+                           if distance(word, term) <= max_distance), key=lambda row: (row[1], -row[2], row[0]))
+        assert spelling.suggest(word) == expected[:5], word
+        assert spelling.correct(word) == (word if word in dfs else (expected[0][0] if expected else None))
+
+def test_correct_spelling_queries(boolean_index, positional_index):
+    w1, w2 = [word for word in terms(boolean_index) if len(word) >= 6 and word.isalpha()][:2]
+    typo1, typo2 = w1[:2] + w1[3:], w2[:-1] + "q"
+
+    boolean = BooleanQueryProcessor(index=boolean_index, correct_spelling=True)
+    assert boolean.process(f"{typo1} AND {typo2}") == boolean.process(f"{w1} AND {w2}")
+    assert boolean.suggest(f"{typo1} AND {w2}")[typo1][0][0] == w1
+
+    ranked = QueryProcessor(index=positional_index, correct_spelling=True)
+    assert ranked.process(f"{typo1} {typo2}") == QueryProcessor(index=positional_index).process(f"{w1} {w2}")
+
+def test_spelling_file(boolean_index, monkeypatch):
+    index = InvertedIndex()
+    assert index.load()
+    spelling = index.spelling()
+    assert os.path.exists(index.spelling_path)
+
+    loaded = SpellingIndex.load(index.spelling_path)
+    assert loaded.terms == spelling.terms and loaded.keys == spelling.keys and loaded.dfs == spelling.dfs
+    assert loaded.source_checksum == index.dictionary.checksum
+
+    # It is read from the file again, not computed
+    reloaded = InvertedIndex()
+    assert reloaded.load()
+    monkeypatch.setattr(SpellingIndex, "from_index", None)
+    assert reloaded.spelling().keys == spelling.keys
+
+def test_spelling_files_are_prepared_once(boolean_index, positional_index, monkeypatch):
+    prepare_indexes(correct_spelling=True)
+    for index_class in (InvertedIndex, PositionalInvertedIndex):
+        assert os.path.exists(index_class.spelling_path) and not os.path.exists(index_class.spelling_path + ".tmp")
+
+    # The workers load the files, they do not compute them again
+    monkeypatch.setattr(SpellingIndex, "from_index", None)
+    for index_class in (InvertedIndex, PositionalInvertedIndex):
+        index = index_class()
+        assert index.load() and len(index.spelling().terms)
@@ -0,0 +1,83 @@
+"""
+Wildcard tokens: the term dictionary and the wildcard queries
+"""
+import fnmatch
+
+import pytest
+
+from src.boolean_query_processor import BooleanQueryProcessor
+from src.disk_index import MappedTerms
+from src.inverted_intex import InvertedIndex
+from src.query_processor import QueryProcessor
+from src.term_dictionary import TermDictionary, WildcardError
+from tests.conftest import terms
+
+def brute_force(words, pattern):
+    return sorted(word for word in words if fnmatch.fnmatchcase(word, pattern))
+
+def patterns(words):
+    first = next(word for word in words if len(word) >= 5)
+    return [first[:1] + "*", first[:3] + "*", first + "*", "*" + first[-2:], "*" + first[-4:],
+            first[0] + "*" + first[-1], first[:2] + "*" + first[3:], "*" + first[1:3] + "*",
+            "*" + first[2:4] + "*" + first[-1], "zq*", "*zq", first, first + "zz"]
+
+def test_expand_is_same_as_brute_force(boolean_index):
+    words = boolean_index.keys()
+    dictionary = TermDictionary(words)
+    for pattern in patterns(words):
+        assert dictionary.expand(pattern, None) == brute_force(words, pattern), pattern
+    assert dictionary.prefix(words[3][:2]) == brute_force(words, words[3][:2] + "*")
+    assert words[0] in dictionary and words[0] + "zz" not in dictionary
+
+def test_expansion_limit():
+    dictionary = TermDictionary(["oil", "oilseed", "oily", "gold"])
+    assert dictionary.expand("oil*", 3) == ["oil", "oilseed", "oily"]
+    with pytest.raises(WildcardError):
+        dictionary.expand("oil*", 2)
+    with pytest.raises(WildcardError):
+        dictionary.expand("**")
+
+def test_boolean_wildcard_is_or_of_its_terms(boolean_index):
+    processor = BooleanQueryProcessor(index=boolean_index, max_expansions=None)
+    words = boolean_index.keys()
+    w1 = terms(boolean_index)[0]
+    for pattern in patterns(words)[:9]:
+        expansion = brute_force(words, pattern)
+        expected = processor.process(" OR ".join(expansion))
+        assert processor.process(pattern) == expected, pattern
+        assert processor.process(f"{w1} AND {pattern}") == processor.process(f"{w1} AND ({' OR '.join(expansion)})")
+    assert processor.process("zq*") == []
+
+def test_ranked_wildcards(positional_index):
+    processor = QueryProcessor(index=positional_index, max_expansions=None)
+    words = positional_index.keys()
+    w1, w2 = terms(positional_index)[:2]
+    pattern = w2[:2] + "*"
+    expansion = brute_force(words, pattern)
+
+    assert processor.process(f"{w1} {pattern}") == processor.process(" ".join([w1] + expansion))
+    phrase = {}
+    for term in expansion:
+        for entry in processor.process(f'"{w1} {term}"'):
+            phrase.setdefault(entry["doc_id"], []).extend(entry["positions"])
+    assert processor.process(f'"{w1} {pattern}"') == [{"positions": sorted(phrase[doc_id]), "doc_id": doc_id}
+                                                      for doc_id in sorted(phrase)]
+    broad = patterns(words)[0]
+    assert len(brute_force(words, broad)) > 1
+    with pytest.raises(WildcardError):
+        QueryProcessor(index=positional_index, max_expansions=1).process(f"{w1} {broad}")
+
+def test_wildcards_use_the_mapped_lexicon(boolean_index):
+    loaded = InvertedIndex()
+    assert loaded.load()
+    words = loaded.keys()
+    assert isinstance(words, MappedTerms)
+    assert list(words) == boolean_index.keys()
+    assert words[len(words) - 1] == words[-1] and words[2:5] == boolean_index.keys()[2:5]
+
+    expected = TermDictionary(boolean_index.keys())
+    dictionary = BooleanQueryProcessor(index=loaded).term_dictionary()
+    assert isinstance(dictionary.terms, MappedTerms)
+    for pattern in patterns(boolean_index.keys()):
+        assert dictionary.expand(pattern, None) == expected.expand(pattern, None), pattern
+    assert words[0] in dictionary and words[0] + "zz" not in dictionary